@@ -0,0 +1,932 @@
+"""
+Equivalence and property checks of the optimized code paths against the
+original implementations, with timings. These are for development; the
+benchmarks for users are in src/benchmark.py.
+
+Run from the repository root, e.g. `python scripts/checks.py oto-dedup`.
+"""
+
+import pathlib
+import random
+import sys
+import tempfile
+import time
+
+import click
+import textgrid
+import utaupy
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "src"))
+
+from benchmark import HIRAGANA, make_synthetic_oto_ini, make_synthetic_voicebank
+from g2p import g2p_cache
+from utils import (
+    group_otos_by_filename,
+    oto_dedup_key,
+    remove_duplicate_otos,
+)
+
+
+def make_duplicated_otos(num_entries: int, seed: int = 0) -> list[utaupy.otoini.Oto]:
+    """
+    Generate entries drawn from a small pool of timings so that many of them collide.
+    """
+    rng = random.Random(seed)
+    otos = []
+    for _ in range(num_entries):
+        oto = utaupy.otoini.Oto()
+        oto.filename = f"_{rng.randrange(max(1, num_entries // 50)):06d}.wav"
+        oto.alias = f"- {rng.choice(HIRAGANA)}"
+        oto.offset = rng.choice([0, 0.0, 250.0, 250.0001, 500.0])
+        oto.consonant = rng.choice([120.0, 120.0004])
+        oto.cutoff = -250.0
+        oto.preutterance = rng.choice([80.0, 80])
+        oto.overlap = rng.choice([25.0, 30.0])
+        otos.append(oto)
+    return otos
+
+
+def remove_duplicate_otos_reference(otos: list[utaupy.otoini.Oto]):
+    """
+    The original nested-loop implementation, kept to check the hashed one against.
+    """
+    unique_otos: list[utaupy.otoini.Oto] = []
+    for oto in otos:
+        for unique_oto in unique_otos:
+            if (
+                oto.filename == unique_oto.filename
+                and oto.offset == unique_oto.offset
+                and oto.consonant == unique_oto.consonant
+                and oto.cutoff == unique_oto.cutoff
+                and oto.preutterance == unique_oto.preutterance
+                and oto.overlap == unique_oto.overlap
+            ):
+                break
+        else:
+            unique_otos.append(oto)
+    return unique_otos
+
+
+def within_tolerance(a: utaupy.otoini.Oto, b: utaupy.otoini.Oto, tolerance: float):
+    filename_a, *timings_a = oto_dedup_key(a)
+    filename_b, *timings_b = oto_dedup_key(b)
+    return filename_a == filename_b and all(
+        abs(x - y) <= tolerance for x, y in zip(timings_a, timings_b)
+    )
+
+
+def traced_bytes(load, *args, **kwargs) -> int:
+    """
+    Memory held by the object `load` returns, as seen by tracemalloc.
+    """
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        loaded = load(*args, **kwargs)  # noqa: F841
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def otos_to_textgrid_reference(
+    otos: list[utaupy.otoini.Oto], duration_seconds: float
+) -> textgrid.TextGrid:
+    """
+    The original branch tree, kept to check the interval rules against.
+    """
+    sorted_otos = sorted(otos, key=lambda oto: oto.offset)
+    tg = textgrid.TextGrid()
+    grapheme_tier = textgrid.IntervalTier(
+        name="graphemes", minTime=0, maxTime=duration_seconds
+    )
+    phoneme_tier = textgrid.IntervalTier(
+        name="phonemes", minTime=0, maxTime=duration_seconds
+    )
+    for i, oto in enumerate(sorted_otos[:-1]):
+        splitted_alias = oto.alias.split()
+        next_splitted_alias = sorted_otos[i + 1].alias.split()
+        phs = g2p_cache(splitted_alias[1]) if splitted_alias[1] != "-" else []
+        next_phs = (
+            g2p_cache(next_splitted_alias[1]) if next_splitted_alias[1] != "-" else []
+        )
+        if i == 0:
+            if len(next_phs) == 0:
+                if len(phs) == 1:
+                    grapheme_tier.add(
+                        0,
+                        (oto.offset + oto.preutterance) / 1000,
+                        "AP",
+                    )
+                    grapheme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        duration_seconds,
+                        splitted_alias[1],
+                    )
+                    grapheme_tier.add(
+                        0,
+                        (oto.offset + oto.preutterance) / 1000,
+                        "SP",
+                    )
+                    phoneme_tier.add(
+                        0,
+                        (oto.offset + oto.preutterance) / 1000,
+                        "AP",
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        phs[0],
+                    )
+                    phoneme_tier.add(
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        duration_seconds,
+                        "SP",
+                    )
+                elif len(phs) == 2:
+                    grapheme_tier.add(
+                        0,
+                        (oto.offset + oto.overlap) / 1000,
+                        "AP",
+                    )
+                    grapheme_tier.add(
+                        (oto.offset + oto.overlap) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        splitted_alias[1],
+                    )
+                    grapheme_tier.add(
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        duration_seconds,
+                        "SP",
+                    )
+                    phoneme_tier.add(
+                        0,
+                        (oto.offset + oto.overlap) / 1000,
+                        "AP",
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.overlap) / 1000,
+                        (oto.offset + oto.preutterance) / 1000,
+                        phs[0],
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        phs[1],
+                    )
+                    phoneme_tier.add(
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        duration_seconds,
+                        "SP",
+                    )
+                else:
+                    raise ValueError("Invalid phoneme length.")
+            elif len(next_phs) == 1:
+                if len(phs) == 1:
+                    grapheme_tier.add(
+                        0,
+                        (oto.offset + oto.preutterance) / 1000,
+                        "AP",
+                    )
+                    grapheme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        splitted_alias[1],
+                    )
+                    phoneme_tier.add(
+                        0,
+                        (oto.offset + oto.preutterance) / 1000,
+                        "AP",
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        phs[0],
+                    )
+                elif len(phs) == 2:
+                    grapheme_tier.add(
+                        0,
+                        (oto.offset + oto.overlap) / 1000,
+                        "AP",
+                    )
+                    grapheme_tier.add(
+                        (oto.offset + oto.overlap) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        splitted_alias[1],
+                    )
+                    phoneme_tier.add(
+                        0,
+                        (oto.offset + oto.overlap) / 1000,
+                        "AP",
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.overlap) / 1000,
+                        (oto.offset + oto.preutterance) / 1000,
+                        phs[0],
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        phs[1],
+                    )
+                else:
+                    raise ValueError("Invalid phoneme length.")
+            elif len(next_phs) == 2:
+                if len(phs) == 1:
+                    grapheme_tier.add(
+                        0,
+                        (oto.offset + oto.preutterance) / 1000,
+                        "AP",
+                    )
+                    grapheme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].overlap) / 1000,
+                        splitted_alias[1],
+                    )
+                    phoneme_tier.add(
+                        0,
+                        (oto.offset + oto.preutterance) / 1000,
+                        "AP",
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].overlap) / 1000,
+                        phs[0],
+                    )
+                elif len(phs) == 2:
+                    grapheme_tier.add(
+                        0,
+                        (oto.offset + oto.overlap) / 1000,
+                        "AP",
+                    )
+                    grapheme_tier.add(
+                        (oto.offset + oto.overlap) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].overlap) / 1000,
+                        splitted_alias[1],
+                    )
+                    phoneme_tier.add(
+                        0,
+                        (oto.offset + oto.overlap) / 1000,
+                        "AP",
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.overlap) / 1000,
+                        (oto.offset + oto.preutterance) / 1000,
+                        phs[0],
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].overlap) / 1000,
+                        phs[1],
+                    )
+                else:
+                    raise ValueError("Invalid phoneme length.")
+            else:
+                raise ValueError("Invalid phoneme length.")
+        else:
+            if len(next_phs) == 0:
+                if len(phs) == 1:
+                    grapheme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        splitted_alias[1],
+                    )
+                    grapheme_tier.add(
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        duration_seconds,
+                        "SP",
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        phs[0],
+                    )
+                    phoneme_tier.add(
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        duration_seconds,
+                        "SP",
+                    )
+                elif len(phs) == 2:
+                    grapheme_tier.add(
+                        (oto.offset + oto.overlap) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        splitted_alias[1],
+                    )
+                    grapheme_tier.add(
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        duration_seconds,
+                        "SP",
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.overlap) / 1000,
+                        (oto.offset + oto.preutterance) / 1000,
+                        phs[0],
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        phs[1],
+                    )
+                    phoneme_tier.add(
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        duration_seconds,
+                        "SP",
+                    )
+                else:
+                    raise ValueError("Invalid phoneme length.")
+            elif len(next_phs) == 1:
+                if len(phs) == 1:
+                    grapheme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        splitted_alias[1],
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        phs[0],
+                    )
+                elif len(phs) == 2:
+                    grapheme_tier.add(
+                        (oto.offset + oto.overlap) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        splitted_alias[1],
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.overlap) / 1000,
+                        (oto.offset + oto.preutterance) / 1000,
+                        phs[0],
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].preutterance) / 1000,
+                        phs[1],
+                    )
+                else:
+                    raise ValueError("Invalid phoneme length.")
+            elif len(next_phs) == 2:
+                if len(phs) == 1:
+                    grapheme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].overlap) / 1000,
+                        splitted_alias[1],
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].overlap) / 1000,
+                        phs[0],
+                    )
+                elif len(phs) == 2:
+                    grapheme_tier.add(
+                        (oto.offset + oto.overlap) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].overlap) / 1000,
+                        splitted_alias[1],
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.overlap) / 1000,
+                        (oto.offset + oto.preutterance) / 1000,
+                        phs[0],
+                    )
+                    phoneme_tier.add(
+                        (oto.offset + oto.preutterance) / 1000,
+                        (otos[i + 1].offset + otos[i + 1].overlap) / 1000,
+                        phs[1],
+                    )
+                else:
+                    raise ValueError("Invalid phoneme length.")
+            else:
+                raise ValueError("Invalid phoneme length.")
+    tg.append(grapheme_tier)
+    tg.append(phoneme_tier)
+    return tg
+
+
+# Aliases by number of phonemes; "かか" has four and is rejected
+GOLDEN_GRAPHEMES = ["-", "あ", "ん", "か", "しゃ", "かか"]
+
+
+def make_golden_otos(seed: int) -> tuple[list[utaupy.otoini.Oto], float]:
+    """
+    Generate the entries of one file and its length, mostly well-formed but with rests, out-of-order entries, odd timings and unconvertible aliases.
+    """
+    rng = random.Random(seed)
+    otos = []
+    offset = rng.choice([0.0, 100.0, 250.0])
+    for position in range(rng.randrange(0, 7)):
+        oto = utaupy.otoini.Oto()
+        oto.filename = f"_{seed:06d}.wav"
+        if position == 0:
+            grapheme = rng.choice(["あ", "ん", "か", "しゃ"])
+        else:
+            grapheme = rng.choices(GOLDEN_GRAPHEMES, weights=[3, 4, 2, 4, 3, 1])[0]
+        oto.alias = f"{rng.choice(['-', 'a', 'n'])} {grapheme}"
+        oto.offset = offset
+        oto.consonant = 120.0
+        oto.cutoff = -250.0
+        oto.preutterance = rng.choices([80.0, 120.5, 0.0, 400.0], [8, 4, 1, 1])[0]
+        oto.overlap = rng.choices([25.0, 0.0, -10.0, 90.0], [8, 2, 1, 1])[0]
+        otos.append(oto)
+        offset += rng.choices([375.0, 200.25, 50.0, 0.0], [8, 4, 1, 1])[0]
+    if rng.random() < 0.1:
+        rng.shuffle(otos)
+    duration = offset / 1000 + rng.choices([0.5, 0.0], [9, 1])[0]
+    return otos, duration
+
+
+def otos_to_textgrid_outcome(convert, otos, duration: float, path: pathlib.Path):
+    """
+    The written TextGrid, or the name of the exception raised while converting or writing.
+    """
+    try:
+        convert(otos, duration).write(str(path))
+    except (ValueError, IndexError) as e:
+        return type(e).__name__
+    return path.read_bytes()
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command(help="Check and time the hashed oto deduplication against the original.")
+@click.option("--entries", type=int, default=5000, show_default=True)
+@click.option("--trials", type=int, default=200, show_default=True)
+@click.option("--tolerance", type=float, default=0.001, show_default=True)
+def oto_dedup(entries: int, trials: int, tolerance: float):
+    # Property checks on many small random inputs
+    for seed in range(trials):
+        otos = make_duplicated_otos(random.Random(seed).randrange(1, 300), seed)
+        unique_otos = remove_duplicate_otos(otos)
+        assert unique_otos == remove_duplicate_otos_reference(otos), seed
+        near_unique_otos = remove_duplicate_otos(otos, tolerance)
+        assert all(
+            any(within_tolerance(oto, kept, tolerance) for kept in near_unique_otos)
+            for oto in otos
+        ), seed
+        assert not any(
+            within_tolerance(a, b, tolerance)
+            for i, a in enumerate(near_unique_otos)
+            for b in near_unique_otos[i + 1 :]
+        ), seed
+        assert [oto for oto in otos if oto in near_unique_otos] == near_unique_otos
+    print(f"{trials} random inputs match the original implementation")
+
+    otos = make_duplicated_otos(entries)
+    start = time.perf_counter()
+    remove_duplicate_otos_reference(otos)
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    remove_duplicate_otos(otos)
+    hashed_seconds = time.perf_counter() - start
+    print(f"nested loop: {reference_seconds:.3f}s")
+    print(f"hashed:      {hashed_seconds:.3f}s")
+    print(f"speedup:     {reference_seconds / hashed_seconds:.0f}x")
+
+
+@cli.command(help="Check and time the columnar oto table against utaupy.")
+@click.option("--entries", type=int, default=100000, show_default=True)
+@click.option("--trials", type=int, default=200, show_default=True)
+def oto_table(entries: int, trials: int):
+    import numpy as np
+
+    from oto_table import OtoTable
+
+    for seed in range(trials):
+        otos = make_duplicated_otos(random.Random(seed).randrange(1, 300), seed)
+        table = OtoTable.from_otos(otos)
+        rows = np.arange(len(table))
+        for tolerance in (0, 0.001):
+            unique_otos = remove_duplicate_otos(otos, tolerance)
+            assert [otos[row] for row in table.unique_rows(rows, tolerance)] == (
+                unique_otos
+            ), seed
+        assert {
+            filename: [otos[row] for row in rows]
+            for filename, rows in table.groupby_filename().items()
+        } == group_otos_by_filename(otos), seed
+    print(f"{trials} random inputs deduplicate and group like the Oto lists")
+
+    oto_ini = make_synthetic_oto_ini(entries)
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        temp_dir = pathlib.Path(temp_dir_str)
+        for encoding in ("cp932", "utf-8"):
+            path = temp_dir / f"{encoding}.ini"
+            oto_ini.write(str(path), encoding=encoding)
+
+            start = time.perf_counter()
+            loaded = utaupy.otoini.load(str(path), encoding=encoding)
+            utaupy_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            table = OtoTable.read(path)
+            table_seconds = time.perf_counter() - start
+            utaupy_bytes = traced_bytes(
+                utaupy.otoini.load, str(path), encoding=encoding
+            )
+            table_bytes = traced_bytes(OtoTable.read, path)
+
+            assert [str(oto) for oto in table.to_otos()] == [str(oto) for oto in loaded]
+            loaded.write(str(temp_dir / "utaupy.ini"))
+            table.write(temp_dir / "table.ini")
+            assert (temp_dir / "utaupy.ini").read_bytes() == (
+                temp_dir / "table.ini"
+            ).read_bytes()
+            print(f"{len(table)} entries ({encoding}):")
+            print(
+                f"  utaupy: {utaupy_seconds:.3f}s, {utaupy_bytes / 1024 / 1024:.1f} MiB"
+            )
+            print(
+                f"  table:  {table_seconds:.3f}s, {table_bytes / 1024 / 1024:.1f} MiB"
+            )
+
+
+@cli.command(help="Compare per-file filtering of an oto.ini with a filename index.")
+@click.option("--entries", type=int, default=50000, show_default=True)
+@click.option("--aliases-per-file", type=int, default=8, show_default=True)
+@click.option(
+    "--legacy-files",
+    type=int,
+    default=200,
+    show_default=True,
+    help="Number of files timed with the linear filter; the total is extrapolated.",
+)
+def oto_index(entries: int, aliases_per_file: int, legacy_files: int):
+    oto_ini = make_synthetic_oto_ini(entries, aliases_per_file)
+    filenames = list(dict.fromkeys(oto.filename for oto in oto_ini))
+    print(f"{len(oto_ini)} entries, {len(filenames)} files")
+
+    sample = filenames[:legacy_files]
+    start = time.perf_counter()
+    legacy = {
+        filename: list(filter(lambda oto: oto.filename == filename, oto_ini))
+        for filename in sample
+    }
+    legacy_seconds = (time.perf_counter() - start) * len(filenames) / len(sample)
+
+    start = time.perf_counter()
+    otos_by_filename = group_otos_by_filename(oto_ini)
+    indexed = {filename: otos_by_filename.get(filename, []) for filename in filenames}
+    indexed_seconds = time.perf_counter() - start
+
+    assert all(legacy[filename] == indexed[filename] for filename in sample)
+    print(
+        f"filter per file: {legacy_seconds:.3f}s (extrapolated from {len(sample)} files)"
+    )
+    print(f"filename index:  {indexed_seconds:.3f}s")
+    print(f"speedup:         {legacy_seconds / indexed_seconds:.0f}x")
+
+
+@cli.command(help="Check and time the interval rules against the original branch tree.")
+@click.option("--entries", type=int, default=50000, show_default=True)
+@click.option("--trials", type=int, default=3000, show_default=True)
+def oto_intervals(entries: int, trials: int):
+    from oto import build_intervals, intervals_to_textgrid, otos_to_textgrid
+    from oto_table import OtoTable
+
+    golden_set = [make_golden_otos(seed) for seed in range(trials)]
+    oto_ini = make_synthetic_oto_ini(2000)
+    for otos in group_otos_by_filename(oto_ini).values():
+        golden_set.append((otos, otos[-1].offset / 1000 + 0.5))
+    failures = 0
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        temp_dir = pathlib.Path(temp_dir_str)
+        for index, (otos, duration) in enumerate(golden_set):
+            expected = otos_to_textgrid_outcome(
+                otos_to_textgrid_reference, otos, duration, temp_dir / "a.TextGrid"
+            )
+            actual = otos_to_textgrid_outcome(
+                otos_to_textgrid, otos, duration, temp_dir / "b.TextGrid"
+            )
+            assert expected == actual, index
+            failures += isinstance(expected, str)
+    print(
+        f"{len(golden_set)} files match the original implementation "
+        f"({failures} fail the same way in both)"
+    )
+
+    oto_ini = make_synthetic_oto_ini(entries)
+    files = [
+        (otos, otos[-1].offset / 1000 + 0.5)
+        for otos in group_otos_by_filename(oto_ini).values()
+    ]
+    oto_table = OtoTable.from_otos(oto_ini)
+    table_files = [
+        (rows, duration)
+        for rows, (_, duration) in zip(oto_table.groupby_filename().values(), files)
+    ]
+    # Fill the G2P cache first so that both sides are timed on conversion alone
+    otos_to_textgrid_reference(*files[0])
+    start = time.perf_counter()
+    for otos, duration in files:
+        otos_to_textgrid_reference(otos, duration)
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for intervals, (_, duration) in zip(
+        build_intervals(oto_table, table_files), table_files
+    ):
+        intervals_to_textgrid(intervals, duration)
+    vectorized_seconds = time.perf_counter() - start
+    print(f"{len(files)} files")
+    print(f"branch tree: {reference_seconds:.3f}s")
+    print(f"vectorized:  {vectorized_seconds:.3f}s")
+    print(f"speedup:     {reference_seconds / vectorized_seconds:.1f}x")
+
+
+@cli.command(
+    help="Check and time the TextGrid serializer against the textgrid package."
+)
+@click.option("--entries", type=int, default=50000, show_default=True)
+@click.option("--trials", type=int, default=3000, show_default=True)
+def textgrid_writer(entries: int, trials: int):
+    import numpy as np
+
+    from dataset import phoneme_durations
+    from oto import build_intervals, intervals_to_data, intervals_to_textgrid
+    from oto_table import OtoTable
+    from textgrids import read_bundle, read_textgrid, write_bundle, write_textgrid
+
+    golden_set = [make_golden_otos(seed) for seed in range(trials)]
+    oto_ini = make_synthetic_oto_ini(2000)
+    for otos in group_otos_by_filename(oto_ini).values():
+        golden_set.append((otos, otos[-1].offset / 1000 + 0.5))
+    checked = 0
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        temp_dir = pathlib.Path(temp_dir_str)
+        for index, (otos, duration) in enumerate(golden_set):
+            oto_table = OtoTable.from_otos(otos)
+            (intervals,) = build_intervals(
+                oto_table, [(np.arange(len(otos)), duration)]
+            )
+            if intervals is None:
+                continue
+            expected_path = temp_dir / "a.TextGrid"
+            actual_path = temp_dir / "b.TextGrid"
+            if not duration and not len(intervals["graphemes"]):
+                # Neither writer can tell the length of an empty TextGrid of length 0
+                continue
+            intervals_to_textgrid(intervals, duration).write(str(expected_path))
+            data = intervals_to_data(intervals, duration)
+            write_textgrid(actual_path, data)
+            assert expected_path.read_bytes() == actual_path.read_bytes(), index
+            # Data read back from a file is written out unchanged
+            write_textgrid(actual_path, read_textgrid(expected_path))
+            assert expected_path.read_bytes() == actual_path.read_bytes(), index
+            # The bundle gives build_dataset the same phonemes as the file
+            write_bundle(temp_dir / "bundle.jsonl", [("a", data)])
+            read_back = textgrid.TextGrid()
+            read_back.read(str(expected_path))
+            assert phoneme_durations(read_bundle(temp_dir / "bundle.jsonl")["a"]) == (
+                [interval.mark for interval in read_back[1]],
+                [interval.maxTime - interval.minTime for interval in read_back[1]],
+            ), index
+            checked += 1
+    print(f"{checked} TextGrids match the textgrid package byte for byte")
+
+    oto_table = OtoTable.from_otos(make_synthetic_oto_ini(entries))
+    files = [
+        (rows, oto_table.entries["offset"][rows].max() / 1000 + 0.5)
+        for rows in oto_table.groupby_filename().values()
+    ]
+    files = [
+        (intervals, duration)
+        for intervals, (_, duration) in zip(build_intervals(oto_table, files), files)
+        if intervals is not None
+    ]
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        temp_dir = pathlib.Path(temp_dir_str)
+        start = time.perf_counter()
+        for index, (intervals, duration) in enumerate(files):
+            intervals_to_textgrid(intervals, duration).write(
+                str(temp_dir / f"a{index}.TextGrid")
+            )
+        package_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for index, (intervals, duration) in enumerate(files):
+            write_textgrid(
+                temp_dir / f"b{index}.TextGrid", intervals_to_data(intervals, duration)
+            )
+        serializer_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        write_bundle(
+            temp_dir / "TextGrid.jsonl",
+            (
+                (f"c{index}", intervals_to_data(intervals, duration))
+                for index, (intervals, duration) in enumerate(files)
+            ),
+        )
+        bundle_seconds = time.perf_counter() - start
+    print(f"{len(files)} files")
+    print(f"textgrid package: {package_seconds:.3f}s")
+    print(
+        f"serializer:       {serializer_seconds:.3f}s "
+        f"({package_seconds / serializer_seconds:.1f}x)"
+    )
+    print(
+        f"bundle:           {bundle_seconds:.3f}s "
+        f"({package_seconds / bundle_seconds:.1f}x)"
+    )
+
+
+def parselmouth_pitch(wav_data, length: int, hparams: dict, interp_uv: bool = False):
+    """
+    Pitch extraction of MakeDiffSinger's get_pitch.py, for when the submodule is not checked out.
+    """
+    import numpy as np
+    import parselmouth
+
+    hop_size = hparams["hop_size"]
+    sample_rate = hparams["audio_sample_rate"]
+    f0_min, f0_max = 65, 800
+    l_pad = int(np.ceil(1.5 / f0_min * sample_rate))
+    r_pad = hop_size * ((len(wav_data) - 1) // hop_size + 1) - len(wav_data) + l_pad + 1
+    wav_data = np.pad(wav_data, (l_pad, r_pad))
+    pitch = parselmouth.Sound(wav_data, sampling_frequency=sample_rate).to_pitch_ac(
+        time_step=hop_size / sample_rate,
+        voicing_threshold=0.6,
+        pitch_floor=f0_min,
+        pitch_ceiling=f0_max,
+    )
+    f0 = pitch.selected_array["frequency"].astype(np.float32)
+    f0 = np.pad(f0, (0, max(0, length - len(f0))))[:length]
+    uv = f0 == 0
+    if interp_uv and 0 < uv.sum() < len(f0):
+        f0[uv] = 2 ** np.interp(
+            np.flatnonzero(uv), np.flatnonzero(~uv), np.log2(f0[~uv])
+        )
+    return f0, uv
+
+
+@cli.command(help="Check and time the shared f0 cache of the midi and ds stages.")
+@click.option("--samples", type=int, default=100, show_default=True)
+def f0_cache(samples: int):
+    import librosa
+
+    from cache import F0Cache
+
+    sys.path.append("src/MakeDiffSinger/variance-temp-solution")
+    try:
+        from get_pitch import get_pitch
+    except ImportError:
+        get_pitch = parselmouth_pitch
+    hparams = {"audio_sample_rate": 44100, "hop_size": 512}
+    with tempfile.TemporaryDirectory() as temp_dir_str:
+        temp_dir = pathlib.Path(temp_dir_str)
+        make_synthetic_voicebank(temp_dir, samples, sample_rate=44100)
+        waveforms = [
+            librosa.load(wav_file, sr=44100, mono=True)[0]
+            for wav_file in sorted(temp_dir.glob("*.wav"))
+        ]
+
+        def extract_all(extractor):
+            return [
+                extractor(
+                    waveform,
+                    int(len(waveform) / hparams["hop_size"] + 0.5),
+                    hparams,
+                    interp_uv=True,
+                )
+                for waveform in waveforms
+            ]
+
+        # estimate_midi and csv2ds each extracted the pitch of every sample
+        start = time.perf_counter()
+        expected = extract_all(get_pitch)
+        extract_all(get_pitch)
+        uncached_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cache = F0Cache(temp_dir / "f0.h5", "a")
+        extract_all(cache.cached(get_pitch))
+        cache.close()
+        cache = F0Cache(temp_dir / "f0.h5", "r")
+        actual = extract_all(cache.cached(get_pitch))
+        cache.close()
+        cached_seconds = time.perf_counter() - start
+        for (expected_f0, expected_uv), (f0, uv) in zip(expected, actual):
+            assert f0.dtype == expected_f0.dtype and (f0 == expected_f0).all()
+            assert (uv == expected_uv).all()
+        assert cache.hits == len(waveforms)
+    print(f"{len(waveforms)} cached pitch curves equal the extracted ones")
+    print(f"extracted twice: {uncached_seconds:.3f}s")
+    print(f"cached:          {cached_seconds:.3f}s")
+
+
+@cli.command(help="Compare batched SOFA alignment with the unbatched path.")
+@click.argument(
+    "folder", type=click.Path(exists=True, file_okay=False, path_type=pathlib.Path)
+)
+@click.option("--ckpt", default="src/ckpt/step.100000.ckpt", show_default=True)
+@click.option("--batch-frames", type=int, default=20000, show_default=True)
+@click.option(
+    "--tolerance",
+    type=float,
+    default=0.02,
+    show_default=True,
+    help="Maximum allowed boundary difference in seconds.",
+)
+def sofa_batch(folder: pathlib.Path, ckpt: str, batch_frames: int, tolerance: float):
+    sys.path.append("src/SOFA")
+    sys.path.append("src/SOFA/modules")
+    import lightning as pl
+    import numpy as np
+    import torch
+    from SOFA.train import LitForcedAlignmentTask
+
+    from alignment import predict_batched
+    from g2p import PyOpenJTalkG2P
+
+    torch.set_grad_enabled(False)
+    model = LitForcedAlignmentTask.load_from_checkpoint(ckpt)
+    model.set_inference_mode("force")
+    dataset = PyOpenJTalkG2P().get_dataset(sorted(folder.glob("*.wav")))
+
+    start = time.perf_counter()
+    trainer = pl.Trainer(logger=False)
+    expected = trainer.predict(model, dataloaders=dataset, return_predictions=True)
+    unbatched_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = predict_batched(model, dataset, batch_frames)
+    batched_seconds = time.perf_counter() - start
+
+    max_difference = 0.0
+    for expected_item, actual_item in zip(expected, actual):
+        assert expected_item[3] == actual_item[3], expected_item[0]
+        for index in (4, 6):
+            max_difference = max(
+                max_difference,
+                float(
+                    np.max(
+                        np.abs(
+                            np.asarray(expected_item[index])
+                            - np.asarray(actual_item[index])
+                        ),
+                        initial=0,
+                    )
+                ),
+            )
+    print(f"{len(expected)} utterances")
+    print(f"unbatched: {unbatched_seconds:.3f}s")
+    print(f"batched:   {batched_seconds:.3f}s")
+    print(f"max boundary difference: {max_difference * 1000:.3f}ms")
+    if max_difference > tolerance:
+        raise click.ClickException("Batched boundaries exceed the tolerance.")
+
+
+@cli.command(
+    help="Check that AP detection in a worker pool gives the intervals of SOFA's detector."
+)
+@click.argument(
+    "folder", type=click.Path(exists=True, file_okay=False, path_type=pathlib.Path)
+)
+@click.option("--ckpt", default="src/ckpt/step.100000.ckpt", show_default=True)
+@click.option("--workers", "-j", "num_workers", type=int, default=4, show_default=True)
+def ap_detection(folder: pathlib.Path, ckpt: str, num_workers: int):
+    sys.path.append("src/SOFA")
+    sys.path.append("src/SOFA/modules")
+    import copy
+
+    import lightning as pl
+    import numpy as np
+    import torch
+    from SOFA.modules.AP_detector import LoudnessSpectralcentroidAPDetector
+    from SOFA.train import LitForcedAlignmentTask
+
+    from ap_detection import detect_AP
+    from g2p import PyOpenJTalkG2P
+
+    model = LitForcedAlignmentTask.load_from_checkpoint(ckpt)
+    model.set_inference_mode("force")
+    dataset = PyOpenJTalkG2P().get_dataset(sorted(folder.glob("*.wav")))
+    with torch.inference_mode():
+        trainer = pl.Trainer(logger=False)
+        predictions = trainer.predict(
+            model, dataloaders=dataset, return_predictions=True
+        )
+
+        start = time.perf_counter()
+        expected = LoudnessSpectralcentroidAPDetector().process(
+            copy.deepcopy(predictions)
+        )
+        sequential_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = detect_AP(copy.deepcopy(predictions), num_workers)
+        pooled_seconds = time.perf_counter() - start
+
+    num_ap = 0
+    for expected_item, actual_item in zip(expected, actual, strict=True):
+        assert str(expected_item[0]) == str(actual_item[0])
+        # ph_seq, ph_intervals, word_seq, word_intervals
+        for index in (3, 4, 5, 6):
+            assert np.array_equal(
+                np.asarray(expected_item[index]), np.asarray(actual_item[index])
+            ), (expected_item[0], index)
+        num_ap += list(expected_item[3]).count("AP")
+    print(f"{len(expected)} utterances, {num_ap} AP intervals, all identical")
+    print(f"sequential: {sequential_seconds:.3f}s")
+    print(f"{num_workers} workers:  {pooled_seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,168 @@
+import pathlib
+
+import einops
+import torch
+import tqdm
+
+from SOFA.modules.utils.load_wav import load_wav
+from SOFA.train import LitForcedAlignmentTask
+
+
+def get_melspec(model: LitForcedAlignmentTask, wav_path: pathlib.Path):
+    """
+    Compute the normalized, time-scaled mel spectrogram exactly like `predict_step`.
+
+    Returns:
+        tuple[torch.Tensor, float]: Mel spectrogram of shape (1, C, T) and the audio length in seconds
+    """
+    sample_rate = model.melspec_config["sample_rate"]
+    waveform = load_wav(wav_path, model.device, sample_rate)
+    wav_length = waveform.shape[0] / sample_rate
+    melspec = model.get_melspec(waveform).detach().unsqueeze(0)
+    melspec = (melspec - melspec.mean()) / melspec.std()
+    melspec = einops.repeat(
+        melspec, "B C T -> B C (T N)", N=model.melspec_config["scale_factor"]
+    )
+    return melspec, wav_length
+
+
+def make_batches(lengths: list[int], max_frames: int) -> list[list[int]]:
+    """
+    Group item indices of similar length so that each padded batch holds at most `max_frames` frames.
+
+    Items longer than `max_frames` get a batch of their own.
+    """
+    batches: list[list[int]] = []
+    batch: list[int] = []
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # Indices are sorted by length, so the current item is the longest of the batch
+        if batch and lengths[index] * (len(batch) + 1) > max_frames:
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class PrecomputedOutputs:
+    """
+    Stands in for the model in `_infer_once` with network outputs that were already computed for a batch.
+
+    Everything but the network is delegated to the model, so `_infer_once`
+    decodes one utterance of the batch without running the network again and
+    without changing the model, which is shared across jobs.
+    """
+
+    def __init__(self, model: LitForcedAlignmentTask, outputs: tuple):
+        self._model = model
+        self._outputs = outputs
+
+    def forward(self, *args, **kwargs) -> tuple:
+        return self._outputs
+
+    __call__ = forward
+
+    def __getattr__(self, name: str):
+        return getattr(self._model, name)
+
+
+def decode(
+    model: LitForcedAlignmentTask,
+    outputs: tuple,
+    melspec: torch.Tensor,
+    wav_length: float,
+    ph_seq,
+    word_seq,
+    ph_idx_to_word_idx,
+) -> tuple:
+    """
+    `_infer_once` of one utterance from its slice of the batch outputs.
+    """
+    return type(model)._infer_once(
+        PrecomputedOutputs(model, outputs),
+        melspec,
+        wav_length,
+        ph_seq,
+        word_seq,
+        ph_idx_to_word_idx,
+        False,
+        False,
+    )
+
+
+def predict_batched(
+    model: LitForcedAlignmentTask, dataset, max_frames: int
+) -> list[tuple]:
+    """
+    Batched replacement for `pl.Trainer.predict(model, dataloaders=dataset)`.
+
+    Utterances are bucketed by length and zero-padded into batches, the network
+    runs once per batch, and each utterance is then decoded on its own slice of
+    the output by `decode`, so the predictions have the same format and order
+    as `predict_step`. Padding only affects the last few frames of the
+    shorter utterances of a batch, so boundaries match the unbatched path within
+    a small tolerance.
+    """
+    model.eval()
+    model.on_predict_start()
+    items = [dataset[i] for i in range(len(dataset))]
+
+    melspecs = []
+    wav_lengths = []
+    for wav_path, *_ in tqdm.tqdm(items):
+        melspec, wav_length = get_melspec(model, wav_path)
+        melspecs.append(melspec)
+        wav_lengths.append(wav_length)
+
+    predictions: list[tuple | None] = [None] * len(items)
+    batches = make_batches([melspec.shape[-1] for melspec in melspecs], max_frames)
+    with torch.inference_mode():
+        for batch in tqdm.tqdm(batches):
+            num_frames = max(melspecs[i].shape[-1] for i in batch)
+            padded = torch.cat(
+                [
+                    torch.nn.functional.pad(
+                        melspecs[i], (0, num_frames - melspecs[i].shape[-1])
+                    )
+                    for i in batch
+                ]
+            )
+            outputs = model.forward(padded.transpose(1, 2))
+            for batch_index, i in enumerate(batch):
+                wav_path, ph_seq, word_seq, ph_idx_to_word_idx = items[i]
+                item_outputs = tuple(
+                    output[batch_index : batch_index + 1, : melspecs[i].shape[-1]]
+                    for output in outputs
+                )
+                try:
+                    (
+                        ph_seq,
+                        ph_intervals,
+                        word_seq,
+                        word_intervals,
+                        confidence,
+                        _,
+                        _,
+                    ) = decode(
+                        model,
+                        item_outputs,
+                        melspecs[i],
+                        wav_lengths[i],
+                        ph_seq,
+                        word_seq,
+                        ph_idx_to_word_idx,
+                    )
+                except Exception as e:
+                    e.args += (f"{str(wav_path)}",)
+                    raise e
+                predictions[i] = (
+                    wav_path,
+                    wav_lengths[i],
+                    confidence,
+                    ph_seq,
+                    ph_intervals,
+                    word_seq,
+                    word_intervals,
+                )
+    return predictions
@@ -0,0 +1,75 @@
+import concurrent.futures
+import functools
+
+import tqdm
+
+from audio import ignore_interrupts
+from inference import configure_threads, default_threads
+
+# SOFA's LoudnessSpectralcentroidAPDetector normalizes and pads every
+# utterance on its own before computing its loudness and spectral centroid,
+# so stacking utterances into one zero-padded STFT would change the features
+# of the shorter ones and with them the AP intervals. Instead every worker
+# process keeps one detector and the utterances are spread over the workers,
+# longest first, which gives exactly the intervals of
+# `detector.process(predictions)`.
+
+
+@functools.cache
+def load_ap_detector():
+    """
+    Create SOFA's AP detector once per process.
+    """
+    import SOFA.modules.AP_detector
+
+    return SOFA.modules.AP_detector.LoudnessSpectralcentroidAPDetector()
+
+
+def initialize_worker(num_threads: int):
+    ignore_interrupts()
+    configure_threads(num_threads, 1)
+    load_ap_detector()
+
+
+def detect_one(prediction: tuple) -> tuple:
+    import torch
+
+    with torch.inference_mode():
+        return load_ap_detector().process([prediction])[0]
+
+
+def detect_AP(predictions: list[tuple], num_workers: int = 0) -> list[tuple]:
+    """
+    Add AP (breath) intervals to SOFA predictions like `LoudnessSpectralcentroidAPDetector().process`, optionally in a process pool.
+
+    Args:
+        predictions (list[tuple]): Predictions of `predict_step` or `predict_batched`
+        num_workers (int): Number of worker processes. 1 or less runs in the current process
+
+    Returns:
+        list[tuple]: The predictions with AP inserted, in the order of `predictions`
+    """
+    if num_workers <= 1 or len(predictions) <= 1:
+        return load_ap_detector().process(predictions)
+    num_workers = min(num_workers, len(predictions))
+    results: list[tuple | None] = [None] * len(predictions)
+    # The longest utterances go first so that no worker is left with one at the end
+    order = sorted(range(len(predictions)), key=lambda i: -predictions[i][1])
+    with (
+        concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=initialize_worker,
+            # Split the cores between the workers instead of letting every torch use all of them
+            initargs=(default_threads(num_workers),),
+        ) as executor,
+        tqdm.tqdm(total=len(predictions)) as pbar,
+    ):
+        futures = {executor.submit(detect_one, predictions[i]): i for i in order}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+                pbar.update(1)
+        except KeyboardInterrupt:
+            executor.shutdown(cancel_futures=True)
+            raise
+    return results
@@ -0,0 +1,214 @@
+import concurrent.futures
+import pathlib
+import signal
+import time
+from typing import Any, Callable
+
+import numpy as np
+import soundfile
+import tqdm
+
+
+# librosa takes seconds to import, so it is imported by the operations that use it
+
+
+class Downmix:
+    def __call__(self, y: np.ndarray, sr: int) -> tuple[np.ndarray, int]:
+        import librosa
+
+        return librosa.to_mono(y), sr
+
+
+class Normalize:
+    def __call__(self, y: np.ndarray, sr: int) -> tuple[np.ndarray, int]:
+        import librosa.util
+
+        return librosa.util.normalize(y, axis=None), sr
+
+
+class Trim:
+    def __init__(self, top_db: float = 30):
+        self.top_db = top_db
+
+    def __call__(self, y: np.ndarray, sr: int) -> tuple[np.ndarray, int]:
+        import librosa.effects
+
+        return librosa.effects.trim(y, top_db=self.top_db)[0], sr
+
+
+class Resample:
+    def __init__(self, target_sr: int):
+        self.target_sr = target_sr
+
+    def __call__(self, y: np.ndarray, sr: int) -> tuple[np.ndarray, int]:
+        import librosa
+
+        if sr == self.target_sr:
+            return y, sr
+        return librosa.resample(y, orig_sr=sr, target_sr=self.target_sr), self.target_sr
+
+
+class AudioTransform:
+    """
+    Decode a WAV file once, apply an ordered chain of operations and write it back once.
+
+    Each operation is a picklable callable taking and returning `(y, sr)`, so a
+    transform can be handed to `process_wav_files` and run in a worker pool.
+    Calling the transform returns the duration of the written audio in seconds.
+    The result is written to `output_dir` under the same name, or over the
+    input file when `output_dir` is None.
+    """
+
+    def __init__(
+        self,
+        operations: list[Callable[[np.ndarray, int], tuple[np.ndarray, int]]],
+        output_dir: pathlib.Path | None = None,
+    ):
+        self.operations = operations
+        self.output_dir = output_dir
+
+    def __call__(self, wav_file: pathlib.Path) -> float:
+        return self.timed(wav_file)[0]
+
+    def timed(self, wav_file: pathlib.Path) -> tuple[float, dict[str, float]]:
+        """
+        Like calling the transform, but also return the seconds spent loading, in each operation and writing.
+        """
+        import librosa
+
+        timings = {}
+        start = time.perf_counter()
+        y, sr = librosa.load(wav_file, sr=None, mono=False)
+        timings["load"] = time.perf_counter() - start
+        for operation in self.operations:
+            start = time.perf_counter()
+            y, sr = operation(y, sr)
+            name = type(operation).__name__.lower()
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+        output_file = (
+            wav_file if self.output_dir is None else self.output_dir / wav_file.name
+        )
+        start = time.perf_counter()
+        soundfile.write(output_file, y.T, sr)
+        timings["write"] = time.perf_counter() - start
+        return y.shape[-1] / sr, timings
+
+
+def probe_duration(wav_file: pathlib.Path) -> float:
+    info = soundfile.info(str(wav_file))
+    return info.frames / info.samplerate
+
+
+def probe_durations(
+    wav_files: list[pathlib.Path], durations: dict[pathlib.Path, float] | None = None
+) -> tuple[dict[pathlib.Path, float], dict[pathlib.Path, Exception]]:
+    """
+    Build a duration table from the file headers without decoding any audio.
+
+    Args:
+        wav_files (list[pathlib.Path]): Files to probe
+        durations (dict[pathlib.Path, float] | None): Known durations, e.g. reported by `AudioTransform`. These files are not probed again
+
+    Returns:
+        tuple[dict[pathlib.Path, float], dict[pathlib.Path, Exception]]: Durations in seconds and errors, keyed by file
+    """
+    durations = dict(durations or {})
+    probed, errors = process_wav_files(
+        probe_duration,
+        [wav_file for wav_file in wav_files if wav_file not in durations],
+    )
+    durations.update(probed)
+    return durations, errors
+
+
+def build_operations(
+    normalize: bool = False,
+    trim_top_db: float | None = None,
+    sample_rate: int | None = None,
+) -> list[Callable[[np.ndarray, int], tuple[np.ndarray, int]]]:
+    """
+    Build the preprocessing chain. Returns an empty list when there is nothing to do.
+    """
+    operations = []
+    if normalize:
+        operations.append(Normalize())
+    if trim_top_db is not None:
+        operations.append(Trim(top_db=trim_top_db))
+    if sample_rate is not None:
+        operations.append(Resample(sample_rate))
+    if operations:
+        operations.insert(0, Downmix())
+    return operations
+
+
+def ignore_interrupts():
+    """
+    Pool initializer. Ctrl+C reaches every process of the console, so workers ignore it and the parent decides whether to stop.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def process_wav_files(
+    func: Callable[[pathlib.Path], Any],
+    wav_files: list[pathlib.Path],
+    num_workers: int = 1,
+) -> tuple[dict[pathlib.Path, Any], dict[pathlib.Path, Exception]]:
+    """
+    Apply `func` to every WAV file, optionally in a process pool.
+
+    Each file is processed independently by the same function, so the output
+    does not depend on the number of workers. Errors are collected per file
+    instead of aborting the remaining files.
+
+    Args:
+        func (Callable[[pathlib.Path], Any]): Picklable function that processes one file
+        wav_files (list[pathlib.Path]): Files to process
+        num_workers (int): Number of worker processes. 1 or less runs in the current process
+
+    Returns:
+        tuple[dict[pathlib.Path, Any], dict[pathlib.Path, Exception]]:
+            Return values and errors keyed by file, both in the order of `wav_files`
+    """
+    results: dict[pathlib.Path, Any] = {}
+    errors: dict[pathlib.Path, Exception] = {}
+    with tqdm.tqdm(total=len(wav_files)) as pbar:
+        if num_workers <= 1 or len(wav_files) <= 1:
+            for wav_file in wav_files:
+                try:
+                    results[wav_file] = func(wav_file)
+                except Exception as e:
+                    errors[wav_file] = e
+                pbar.update(1)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(num_workers, len(wav_files)),
+                initializer=ignore_interrupts,
+            ) as executor:
+                futures = {
+                    executor.submit(func, wav_file): wav_file for wav_file in wav_files
+                }
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        exception = future.exception()
+                        if exception is not None:
+                            errors[futures[future]] = exception
+                        else:
+                            results[futures[future]] = future.result()
+                        pbar.update(1)
+                except KeyboardInterrupt:
+                    # Only the files in progress are finished
+                    executor.shutdown(cancel_futures=True)
+                    raise
+    return (
+        {wav_file: results[wav_file] for wav_file in wav_files if wav_file in results},
+        {wav_file: errors[wav_file] for wav_file in wav_files if wav_file in errors},
+    )
+
+
+def report_errors(errors: dict[pathlib.Path, Exception]):
+    if not errors:
+        return
+    print()
+    print(f"{len(errors)} file(s) failed and were excluded:")
+    for wav_file, error in errors.items():
+        print(f"  {wav_file.name}: {type(error).__name__}: {error}")
@@ -0,0 +1,496 @@
+import datetime
+import json
+import math
+import pathlib
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import utaupy
+
+HIRAGANA = list(
+    "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+)
+VOWELS = {"あ": "a", "い": "i", "う": "u", "え": "e", "お": "o", "ん": "n"}
+KANA_ROWS = {
+    "a": "あかさたなはまやらわ",
+    "i": "いきしちにひみり",
+    "u": "うくすつぬふむゆる",
+    "e": "えけせてねへめれ",
+    "o": "おこそとのほもよろを",
+    "n": "ん",
+}
+KANA_VOWELS = {kana: vowel for vowel, row in KANA_ROWS.items() for kana in row}
+SUITE_STAGES = ["g2p", "oto_index", "textgrid", "preprocess"]
+
+# Modules that must not be imported before a stage that needs them runs
+HEAVY_MODULES = [
+    "torch",
+    "lightning",
+    "librosa",
+    "pandas",
+    "pyopenjtalk",
+    "SOFA",
+    "MakeDiffSinger",
+]
+
+LOADED_MODULES_SCRIPT = """
+import runpy, sys
+names = sys.argv[2:]
+sys.path.insert(0, "src")
+sys.argv = ["src/main.py", sys.argv[1]]
+try:
+    runpy.run_path("src/main.py", run_name="__main__")
+except SystemExit:
+    pass
+print(" ".join(name for name in names if name in sys.modules), file=sys.stderr)
+"""
+
+
+def make_synthetic_oto_ini(
+    num_entries: int, aliases_per_file: int = 8, seed: int = 0
+) -> utaupy.otoini.OtoIni:
+    """
+    Generate a VCV-style oto.ini with `aliases_per_file` aliases per recording.
+    """
+    rng = random.Random(seed)
+    oto_ini = utaupy.otoini.OtoIni()
+    num_files = max(1, num_entries // aliases_per_file)
+    for i in range(num_entries):
+        file_index = i % num_files
+        position = i // num_files
+        oto = utaupy.otoini.Oto()
+        oto.filename = f"_{file_index:06d}.wav"
+        grapheme = rng.choice(HIRAGANA)
+        previous = "-" if position == 0 else rng.choice(list(VOWELS.values()))
+        oto.alias = f"{previous} {grapheme}"
+        oto.offset = 250.0 + position * 375.0
+        oto.consonant = 120.0
+        oto.cutoff = -250.0
+        oto.preutterance = 80.0
+        oto.overlap = 25.0
+        oto_ini.append(oto)
+    return oto_ini
+
+
+def make_synthetic_voicebank(
+    directory: pathlib.Path,
+    num_samples: int,
+    style: str = "vcv",
+    signal: str = "tone",
+    sample_rate: int = 16000,
+    seed: int = 0,
+) -> utaupy.otoini.OtoIni:
+    """
+    Write a voicebank of `num_samples` recordings with kana file names and an oto.ini (cp932) into `directory`.
+
+    A CV recording holds one syllable with the alias `- か`; a VCV recording
+    holds three to five syllables with the aliases `- あ`, `a か`, ... Each
+    syllable is 375 ms of a tone (with harmonics) or of noise, and the
+    recordings start and end with 250 ms of silence.
+    """
+    import numpy as np
+    import soundfile
+
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    oto_ini = utaupy.otoini.OtoIni()
+    kana = list(KANA_VOWELS)
+    for i in range(num_samples):
+        syllables = rng.choices(kana, k=1 if style == "cv" else rng.randint(3, 5))
+        # The index keeps names unique; digits are ignored when reading graphemes
+        filename = f"_{''.join(syllables)}{i:05d}.wav"
+        silence = np.zeros(int(0.25 * sample_rate), dtype=np.float32)
+        segments = [silence]
+        for position, syllable in enumerate(syllables):
+            length = int(0.375 * sample_rate)
+            if signal == "noise":
+                segment = np_rng.uniform(-0.3, 0.3, length)
+            else:
+                t = np.arange(length) / sample_rate
+                frequency = 220.0 * 2 ** (rng.randrange(-12, 12) / 12)
+                segment = sum(
+                    0.3 / harmonic * np.sin(2 * math.pi * frequency * harmonic * t)
+                    for harmonic in range(1, 4)
+                )
+            segments.append(segment.astype(np.float32))
+
+            oto = utaupy.otoini.Oto()
+            oto.filename = filename
+            previous = "-" if position == 0 else KANA_VOWELS[syllables[position - 1]]
+            oto.alias = f"{previous} {syllable}"
+            oto.offset = 250.0 + position * 375.0
+            oto.consonant = 120.0
+            oto.cutoff = -250.0
+            oto.preutterance = 80.0
+            oto.overlap = 25.0
+            oto_ini.append(oto)
+        segments.append(silence)
+        soundfile.write(
+            directory / filename, np.concatenate(segments), sample_rate, "PCM_16"
+        )
+    oto_ini.write(str(directory / "oto.ini"))
+    return oto_ini
+
+
+def time_stages(
+    voicebank_dir: pathlib.Path, work_dir: pathlib.Path, num_workers: int
+) -> dict[str, float]:
+    """
+    Time G2P, oto.ini indexing, TextGrid building and audio preprocessing on a voicebank.
+    """
+    from audio import (
+        AudioTransform,
+        build_operations,
+        probe_durations,
+        process_wav_files,
+    )
+    from g2p import G2PCache, PyOpenJTalkG2P
+    from oto import build_intervals, intervals_to_data, is_convertible
+    from oto_table import OtoTable
+    from stages import graphemes_from_file_name
+    from textgrids import write_textgrid
+
+    import numpy as np
+
+    wav_files = sorted(voicebank_dir.glob("*.wav"))
+    timings = {}
+
+    # G2P starts from an empty cache, as on the first run over a voicebank
+    start = time.perf_counter()
+    grapheme_to_phoneme = PyOpenJTalkG2P(G2PCache())
+    for wav_file in wav_files:
+        grapheme_to_phoneme(" ".join(graphemes_from_file_name(wav_file.stem)))
+    timings["g2p"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    oto_table = OtoTable.read(voicebank_dir / "oto.ini")
+    rows_by_filename = oto_table.groupby_filename()
+    no_rows = np.empty(0, dtype=np.intp)
+    rows_per_file = {
+        wav_file: oto_table.unique_rows(rows_by_filename.get(wav_file.name, no_rows))
+        for wav_file in wav_files
+    }
+    timings["oto_index"] = time.perf_counter() - start
+
+    durations, _ = probe_durations(wav_files)
+    textgrid_dir = work_dir / "TextGrid"
+    textgrid_dir.mkdir()
+    start = time.perf_counter()
+    convertible = {
+        wav_file: rows
+        for wav_file, rows in rows_per_file.items()
+        if is_convertible(oto_table, rows)
+    }
+    intervals_per_file = build_intervals(
+        oto_table,
+        [(rows, durations[wav_file]) for wav_file, rows in convertible.items()],
+    )
+    for wav_file, intervals in zip(convertible, intervals_per_file):
+        write_textgrid(
+            textgrid_dir / f"{wav_file.stem}.TextGrid",
+            intervals_to_data(intervals, durations[wav_file]),
+        )
+    timings["textgrid"] = time.perf_counter() - start
+
+    preprocess_dir = work_dir / "preprocess"
+    preprocess_dir.mkdir()
+    start = time.perf_counter()
+    _, errors = process_wav_files(
+        AudioTransform(
+            build_operations(normalize=True, trim_top_db=30), preprocess_dir
+        ),
+        wav_files,
+        num_workers,
+    )
+    timings["preprocess"] = time.perf_counter() - start
+    if errors:
+        raise click.ClickException(f"Preprocessing failed for {len(errors)} file(s).")
+    return timings
+
+
+def compare_with_baseline(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]],
+    max_regression: float,
+) -> list[str]:
+    """
+    Print the ratio of every timing to the baseline and return the ones that exceed `max_regression`.
+    """
+    regressions = []
+    for scale, timings in results.items():
+        for stage, seconds in timings.items():
+            baseline_seconds = baseline.get(scale, {}).get(stage)
+            if not baseline_seconds:
+                continue
+            ratio = seconds / baseline_seconds
+            marker = ""
+            if ratio > max_regression:
+                marker = "  REGRESSION"
+                regressions.append(f"{stage} at {scale}: {ratio:.2f}x")
+            print(
+                f"{scale:>6} {stage:<11} {baseline_seconds:8.3f}s -> {seconds:8.3f}s ({ratio:.2f}x){marker}"
+            )
+    return regressions
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command(
+    help="Compare the speed and alignment boundaries of a SOFA precision against fp32."
+)
+@click.argument(
+    "folder", type=click.Path(exists=True, file_okay=False, path_type=pathlib.Path)
+)
+@click.option("--ckpt", default="src/ckpt/step.100000.ckpt", show_default=True)
+@click.option("--precision", default="int8", show_default=True)
+@click.option("--threads", type=int, default=0, show_default=True)
+@click.option("--interop-threads", type=int, default=0, show_default=True)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    default=None,
+    help="Also write the report as JSON to this file.",
+)
+def sofa_precision(
+    folder: pathlib.Path,
+    ckpt: str,
+    precision: str,
+    threads: int,
+    interop_threads: int,
+    output: pathlib.Path | None,
+):
+    sys.path.append("src/SOFA")
+    sys.path.append("src/SOFA/modules")
+    import numpy as np
+    import torch
+
+    from g2p import PyOpenJTalkG2P
+    from inference import configure_threads, load_model
+
+    configure_threads(threads, interop_threads)
+    dataset = PyOpenJTalkG2P().get_dataset(sorted(folder.glob("*.wav")))
+
+    def predict(model_precision: str) -> tuple[list[tuple], float, float]:
+        import lightning as pl
+
+        start = time.perf_counter()
+        model = load_model(pathlib.Path(ckpt), model_precision)
+        load_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        with torch.inference_mode():
+            trainer = pl.Trainer(logger=False)
+            predictions = trainer.predict(
+                model, dataloaders=dataset, return_predictions=True
+            )
+        return predictions, load_seconds, time.perf_counter() - start
+
+    expected, fp32_load_seconds, fp32_seconds = predict("fp32")
+    actual, load_seconds, seconds = predict(precision)
+
+    differences = []
+    mismatched = []
+    for expected_item, actual_item in zip(expected, actual):
+        if expected_item[3] != actual_item[3] or len(expected_item[4]) != len(
+            actual_item[4]
+        ):
+            mismatched.append(str(expected_item[0]))
+            continue
+        for index in (4, 6):
+            differences.append(
+                np.abs(
+                    np.asarray(expected_item[index], dtype=float)
+                    - np.asarray(actual_item[index], dtype=float)
+                ).ravel()
+            )
+    differences = np.concatenate(differences or [np.zeros(0)])
+    audio_seconds = sum(item[1] for item in expected)
+    report = {
+        "utterances": len(expected),
+        "audio_seconds": audio_seconds,
+        "threads": torch.get_num_threads(),
+        "interop_threads": torch.get_num_interop_threads(),
+        "fp32": {"load_seconds": fp32_load_seconds, "predict_seconds": fp32_seconds},
+        precision: {"load_seconds": load_seconds, "predict_seconds": seconds},
+        "speedup": fp32_seconds / seconds,
+        "mismatched_phonemes": mismatched,
+        "boundaries": len(differences),
+        "max_difference_ms": float(differences.max(initial=0)) * 1000,
+        "mean_difference_ms": float(differences.mean()) * 1000
+        if len(differences)
+        else 0.0,
+        "within_10ms": float(np.mean(differences <= 0.01)) if len(differences) else 1.0,
+        "within_20ms": float(np.mean(differences <= 0.02)) if len(differences) else 1.0,
+    }
+    print(f"{report['utterances']} utterances, {audio_seconds:.1f}s of audio")
+    print(
+        f"threads: {report['threads']} intra-op, {report['interop_threads']} inter-op"
+    )
+    print(f"fp32:    {fp32_seconds:.3f}s (load {fp32_load_seconds:.3f}s)")
+    print(f"{precision + ':':<8} {seconds:.3f}s (load {load_seconds:.3f}s)")
+    print(f"speedup: {report['speedup']:.2f}x")
+    print(f"utterances with other phonemes: {len(mismatched)}")
+    print(
+        f"boundary difference: max {report['max_difference_ms']:.3f}ms, mean {report['mean_difference_ms']:.3f}ms"
+    )
+    print(
+        f"boundaries within 10ms: {report['within_10ms']:.2%}, within 20ms: {report['within_20ms']:.2%}"
+    )
+    if output is not None:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+@cli.command(
+    help="Check that --version and --help of main.py stay within a time budget and do not import heavy modules."
+)
+@click.option(
+    "--budget",
+    type=float,
+    default=1.0,
+    show_default=True,
+    help="Maximum median wall time in seconds.",
+)
+@click.option("--repeat", type=int, default=5, show_default=True)
+def startup(budget: float, repeat: int):
+    failures = []
+    for flag in ("--version", "--help"):
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, "src/main.py", flag], check=True, capture_output=True
+            )
+            seconds.append(time.perf_counter() - start)
+        median_seconds = statistics.median(seconds)
+        print(f"{flag}: {median_seconds:.3f}s (median of {repeat})")
+        if median_seconds > budget:
+            failures.append(f"{flag} took {median_seconds:.3f}s")
+
+        loaded = subprocess.run(
+            [sys.executable, "-c", LOADED_MODULES_SCRIPT, flag, *HEAVY_MODULES],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stderr.split()
+        if loaded:
+            failures.append(f"{flag} imported {', '.join(loaded)}")
+    if failures:
+        raise click.ClickException("; ".join(failures))
+    print(f"OK (budget {budget:.3f}s)")
+
+
+@cli.command(
+    help="Time the pipeline stages on synthetic voicebanks of several sizes and compare with a baseline."
+)
+@click.option(
+    "--scales",
+    default="100,1000,10000",
+    show_default=True,
+    help="Comma-separated numbers of recordings.",
+)
+@click.option(
+    "--style", type=click.Choice(["cv", "vcv"]), default="vcv", show_default=True
+)
+@click.option(
+    "--signal", type=click.Choice(["tone", "noise"]), default="tone", show_default=True
+)
+@click.option("--sample-rate", type=int, default=16000, show_default=True)
+@click.option("--workers", "-j", "num_workers", type=int, default=1, show_default=True)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    default=None,
+    help="Where to store the results. Defaults to src/work/benchmarks/<timestamp>.json.",
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False, path_type=pathlib.Path),
+    default=None,
+    help="Results of an earlier run to compare with.",
+)
+@click.option(
+    "--max-regression",
+    type=float,
+    default=1.25,
+    show_default=True,
+    help="Fail when a stage is slower than the baseline by more than this factor.",
+)
+def suite(
+    scales: str,
+    style: str,
+    signal: str,
+    sample_rate: int,
+    num_workers: int,
+    output: pathlib.Path | None,
+    baseline: pathlib.Path | None,
+    max_regression: float,
+):
+    # Load librosa and the OpenJTalk dictionary up front so the smallest scale does not pay for it
+    import librosa  # noqa: F401
+    import pyopenjtalk
+
+    pyopenjtalk.g2p("あ")
+
+    results = {}
+    for scale in [int(value) for value in scales.split(",")]:
+        with tempfile.TemporaryDirectory() as temp_dir_str:
+            temp_dir = pathlib.Path(temp_dir_str)
+            voicebank_dir = temp_dir / "voicebank"
+            voicebank_dir.mkdir()
+            work_dir = temp_dir / "work"
+            work_dir.mkdir()
+            make_synthetic_voicebank(voicebank_dir, scale, style, signal, sample_rate)
+            timings = time_stages(voicebank_dir, work_dir, num_workers)
+        results[str(scale)] = timings
+        print(
+            f"{scale:>6}: "
+            + ", ".join(f"{stage} {timings[stage]:.3f}s" for stage in SUITE_STAGES)
+        )
+
+    if output is None:
+        output = pathlib.Path("src/work/benchmarks") / (
+            datetime.datetime.now().strftime("%Y%m%d%H%M%S") + ".json"
+        )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "settings": {
+                    "style": style,
+                    "signal": signal,
+                    "sample_rate": sample_rate,
+                    "num_workers": num_workers,
+                },
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results: {output}")
+
+    if baseline is not None:
+        with open(baseline, "r", encoding="utf-8") as f:
+            baseline_results = json.load(f)["results"]
+        print()
+        regressions = compare_with_baseline(results, baseline_results, max_regression)
+        if regressions:
+            raise click.ClickException(
+                "Slower than the baseline: " + "; ".join(regressions)
+            )
+
+
+if __name__ == "__main__":
+    cli()
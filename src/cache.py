@@ -0,0 +1,207 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pathlib
+from typing import Callable
+
+
+def hash_file(path: pathlib.Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class AlignmentCache:
+    """
+    Content-addressed store of Phase 3 outputs (TextGrid intervals).
+
+    Entries are keyed by a hash of everything that determines the alignment:
+    the audio bytes, the grapheme text, the checkpoint file and the
+    preprocessing flags. Each entry is a small JSON file; when the total size
+    exceeds `max_bytes`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, directory: pathlib.Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def digest_file(self, path: pathlib.Path) -> str:
+        """
+        Hash a large file such as a checkpoint, reusing the last digest while its size and mtime are unchanged.
+        """
+        stat = path.stat()
+        digests_path = self.directory / "digests.json"
+        digests = {}
+        if digests_path.exists():
+            with open(digests_path, "r", encoding="utf-8") as f:
+                digests = json.load(f)
+        entry = digests.get(str(path.resolve()))
+        if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2]
+        digest = hash_file(path)
+        digests[str(path.resolve())] = [stat.st_size, stat.st_mtime_ns, digest]
+        temp_path = digests_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(digests, f)
+        os.replace(temp_path, digests_path)
+        return digest
+
+    def key(
+        self, wav_file: pathlib.Path, text: str, checkpoint_digest: str, flags: dict
+    ) -> str:
+        with open(wav_file, "rb") as f:
+            audio_digest = hashlib.file_digest(f, "sha256").hexdigest()
+        payload = json.dumps(
+            {
+                "audio": audio_digest,
+                "text": text,
+                "checkpoint": checkpoint_digest,
+                "flags": flags,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        # Touch the entry so that eviction drops the least recently used ones first
+        os.utime(path)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: dict):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        # Processes that share the cache (see shards.py) write to their own temporary files
+        temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def evict(self) -> int:
+        """
+        Remove least recently used entries until the cache fits in `max_bytes`.
+
+        Returns:
+            int: Number of removed entries
+        """
+        entries = []
+        for path in self.directory.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # Evicted by another process
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        total_bytes = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+            removed += 1
+        return removed
+
+    def stats(self) -> str:
+        return f"Alignment cache: {self.hits} hits, {self.misses} misses"
+
+
+class F0Cache:
+    """
+    HDF5 store of the results of a pitch extractor, so that steps which extract pitch from the same audio do it once.
+
+    Entries are keyed by a hash of the waveform samples, the other arguments
+    of the call (frame count, hop size, sample rate, interpolation...) and the
+    source code of the extractor. A cache opened with mode "r" is only read;
+    misses are computed but not stored.
+    """
+
+    def __init__(self, path: pathlib.Path, mode: str = "a"):
+        import h5py
+
+        self.file = h5py.File(path, mode)
+        self.writable = mode != "r"
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.file.close()
+
+    def key(self, extractor_digest: str, args: tuple, kwargs: dict) -> str:
+        import numpy as np
+
+        def encode(value):
+            # Arrays (the waveform) are represented by a hash of their samples
+            if isinstance(value, np.ndarray):
+                value = np.ascontiguousarray(value)
+                return {
+                    "dtype": value.dtype.str,
+                    "shape": value.shape,
+                    "sha256": hashlib.sha256(value.tobytes()).hexdigest(),
+                }
+            return value
+
+        payload = json.dumps(
+            {
+                "extractor": extractor_digest,
+                "args": [encode(value) for value in args],
+                "kwargs": {name: encode(value) for name, value in kwargs.items()},
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> tuple | None:
+        group = self.file.get(f"{key[:2]}/{key}")
+        if group is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return tuple(group[str(index)][()] for index in range(len(group)))
+
+    def put(self, key: str, values: tuple):
+        if not self.writable:
+            return
+        group = self.file.require_group(key[:2]).create_group(key)
+        for index, value in enumerate(values):
+            group.create_dataset(str(index), data=value)
+
+    def cached(self, extractor: Callable) -> Callable:
+        """
+        Wrap `extractor(*args, **kwargs) -> tuple of arrays` to look its results up in the cache first.
+        """
+        try:
+            source = inspect.getsource(extractor).encode("utf-8")
+        except OSError:
+            # No source file; the bytecode changes with the code all the same
+            source = extractor.__code__.co_code
+        extractor_digest = hashlib.sha256(source).hexdigest()
+
+        @functools.wraps(extractor)
+        def wrapper(*args, **kwargs):
+            key = self.key(extractor_digest, args, kwargs)
+            values = self.get(key)
+            if values is None:
+                values = extractor(*args, **kwargs)
+                self.put(key, values)
+            return values
+
+        return wrapper
+
+    def stats(self) -> str:
+        return f"F0 cache: {self.hits} hits, {self.misses} misses"
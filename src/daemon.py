@@ -0,0 +1,512 @@
+import contextlib
+import datetime
+import json
+import os
+import pathlib
+import queue
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+import click
+
+# main extends sys.path for SOFA and the MakeDiffSinger scripts
+from inference import PRECISIONS
+from main import ALIGNERS, check_output_path, convert, load_jobs
+
+# Jobs are passed through a spool directory rather than a socket so that
+# submitting works the same on Windows and needs nothing but the file system:
+#
+#   incoming/<id>.json  written by `submit`, picked up in name (= submission) order
+#   jobs/<id>.json      accepted into the queue
+#   status/<id>.json    state and timings of the job
+#   logs/<id>.log       output of the conversion
+
+
+def write_json(path: pathlib.Path, data: dict):
+    """
+    Replace `path` atomically, so that readers never see a partly written file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def read_json(path: pathlib.Path) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def seconds_between(start: str, end: str) -> float:
+    return (
+        datetime.datetime.fromisoformat(end) - datetime.datetime.fromisoformat(start)
+    ).total_seconds()
+
+
+def now() -> str:
+    return datetime.datetime.now().isoformat()
+
+
+class Spool:
+    def __init__(self, spool_dir: pathlib.Path):
+        self.incoming_dir = spool_dir / "incoming"
+        self.jobs_dir = spool_dir / "jobs"
+        self.status_dir = spool_dir / "status"
+        self.logs_dir = spool_dir / "logs"
+        for directory in (
+            self.incoming_dir,
+            self.jobs_dir,
+            self.status_dir,
+            self.logs_dir,
+        ):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def submit(self, job: dict) -> str:
+        job_id = f"{datetime.datetime.now():%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+        write_json(
+            self.incoming_dir / f"{job_id}.json",
+            {"id": job_id, "submitted_at": now(), "job": job},
+        )
+        return job_id
+
+    def incoming(self) -> list[pathlib.Path]:
+        return sorted(self.incoming_dir.glob("*.json"))
+
+    def accept(self, path: pathlib.Path) -> dict:
+        """
+        Move a submitted job into `jobs` and mark it as queued.
+        """
+        entry = read_json(path)
+        os.replace(path, self.jobs_dir / path.name)
+        self.set_status(
+            entry["id"],
+            state="queued",
+            name=entry["job"]["name"],
+            submitted_at=entry["submitted_at"],
+        )
+        return entry
+
+    def unfinished(self) -> list[dict]:
+        """
+        Jobs accepted by an earlier server that did not finish, in submission order. Jobs that had started are marked as `resumed`.
+        """
+        entries = []
+        for path in sorted(self.jobs_dir.glob("*.json")):
+            status = self.status(path.stem)
+            if status is None or status["state"] in ("queued", "running"):
+                entry = read_json(path)
+                entry["resumed"] = status is not None and status["state"] == "running"
+                entries.append(entry)
+        return entries
+
+    def status(self, job_id: str) -> dict | None:
+        path = self.status_dir / f"{job_id}.json"
+        if not path.exists():
+            incoming_path = self.incoming_dir / f"{job_id}.json"
+            if incoming_path.exists():
+                return {
+                    "id": job_id,
+                    "name": read_json(incoming_path)["job"]["name"],
+                    "state": "submitted",
+                }
+            return None
+        return read_json(path)
+
+    def set_status(self, job_id: str, **fields) -> dict:
+        status = self.status(job_id) or {}
+        status.update(id=job_id, **fields)
+        write_json(self.status_dir / f"{job_id}.json", status)
+        return status
+
+
+def run_job(spool: Spool, entry: dict, shared_options: dict) -> dict:
+    """
+    Run one queued job and record its state and latency.
+
+    `queue_seconds` is the time from submission to start, `run_seconds` the
+    conversion itself and `latency_seconds` their sum.
+    """
+    job_id = entry["id"]
+    job = {
+        **entry["job"],
+        "voicebanks": [pathlib.Path(path) for path in entry["job"]["voicebanks"]],
+    }
+    started_at = now()
+    spool.set_status(job_id, state="running", started_at=started_at)
+    start = time.perf_counter()
+    error = None
+    with (
+        open(spool.logs_dir / f"{job_id}.log", "a", encoding="utf-8") as log,
+        contextlib.redirect_stdout(log),
+        contextlib.redirect_stderr(log),
+    ):
+        try:
+            # A job picked up again after a restart continues from its stage
+            # manifests; if it was interrupted while exporting, its partial
+            # output is replaced
+            convert(
+                job,
+                shared_options,
+                True,
+                [],
+                "cprofile",
+                overwrite=entry.get("resumed", False),
+            )
+        except Exception as e:
+            traceback.print_exc()
+            error = f"{type(e).__name__}: {e}"
+    run_seconds = time.perf_counter() - start
+    return spool.set_status(
+        job_id,
+        state="failed" if error else "done",
+        finished_at=now(),
+        queue_seconds=seconds_between(entry["submitted_at"], started_at),
+        run_seconds=run_seconds,
+        latency_seconds=seconds_between(entry["submitted_at"], started_at)
+        + run_seconds,
+        output=job["output"],
+        error=error,
+    )
+
+
+def worker(
+    spool: Spool,
+    jobs: queue.Queue,
+    shared_options: dict,
+    stopping: threading.Event,
+    echo,
+):
+    while not stopping.is_set():
+        try:
+            entry = jobs.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        echo(f"{entry['id']} ({entry['job']['name']}): running")
+        status = run_job(spool, entry, shared_options)
+        echo(
+            f"{entry['id']} ({entry['job']['name']}): {status['state']} "
+            f"in {status['run_seconds']:.2f}s, {status['latency_seconds']:.2f}s after submission"
+            + (f" ({status['error']})" if status["error"] else "")
+        )
+        jobs.task_done()
+
+
+@click.group()
+def cli():
+    """
+    Keep the models loaded in one process and convert the jobs submitted to a spool directory.
+    """
+
+
+spool_option = click.option(
+    "--spool",
+    "spool_dir",
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    default="src/spool",
+    show_default=True,
+    help="Directory through which jobs are submitted and reported.",
+)
+
+
+@cli.command()
+@spool_option
+@click.option(
+    "--queue-size",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of accepted jobs that wait for the converter. Further submissions stay in the spool until there is room.",
+)
+@click.option(
+    "--warm",
+    type=click.Choice([*ALIGNERS, "none"], case_sensitive=False),
+    default="sofa",
+    show_default=True,
+    help="Aligner whose models are loaded before the first job.",
+)
+@click.option(
+    "--poll-interval",
+    type=click.FloatRange(min=0, min_open=True),
+    default=1.0,
+    show_default=True,
+    help="Seconds between checks for submitted jobs.",
+)
+@click.option(
+    "--workers",
+    "-j",
+    "num_workers",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    show_default=True,
+    help="Number of worker processes for audio preprocessing.",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    default="src/cache",
+    show_default=True,
+    help="Directory for caches that are reused across runs.",
+)
+@click.option(
+    "--cache-size",
+    type=click.IntRange(min=0),
+    default=1024,
+    show_default=True,
+    help="Maximum size of the alignment cache in MiB.",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Do not read or write the caches in --cache-dir.",
+)
+@click.option(
+    "--staging",
+    type=click.Choice(["link", "copy"]),
+    default="link",
+    show_default=True,
+    help="How audio is placed into the work and output directories.",
+)
+@click.option(
+    "--textgrid-format",
+    type=click.Choice(["files", "bundle"]),
+    default="files",
+    show_default=True,
+    help="How alignments are passed to the dataset build.",
+)
+@click.option(
+    "--model-precision",
+    type=click.Choice(PRECISIONS),
+    default="fp32",
+    show_default=True,
+    help="Weights of the SOFA model; see main.py --model-precision.",
+)
+@click.option(
+    "--torch-threads",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Threads torch uses within an operator. 0 uses the torch default.",
+)
+@click.option(
+    "--torch-interop-threads",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Threads torch uses to run independent operators in parallel. 0 uses the torch default.",
+)
+@click.option(
+    "--ap-workers",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Worker processes that detect breaths (AP). 0 detects them in this process.",
+)
+def serve(
+    spool_dir: pathlib.Path,
+    queue_size: int,
+    warm: str,
+    poll_interval: float,
+    num_workers: int,
+    cache_dir: pathlib.Path,
+    cache_size: int,
+    no_cache: bool,
+    staging: str,
+    textgrid_format: str,
+    model_precision: str,
+    torch_threads: int,
+    torch_interop_threads: int,
+    ap_workers: int,
+):
+    """
+    Convert submitted jobs one at a time until interrupted.
+    """
+    from g2p import g2p_cache
+
+    spool = Spool(spool_dir)
+    # The worker redirects the conversion output to the job logs
+    stdout = sys.stdout
+
+    def echo(message: str):
+        print(
+            f"[{datetime.datetime.now():%H:%M:%S}] {message}", file=stdout, flush=True
+        )
+
+    if not no_cache:
+        g2p_cache.load(cache_dir / "g2p.json")
+    if warm != "none":
+        from inference import configure_threads
+        from stages import warm_up
+
+        echo(f"Loading the {ALIGNERS[warm.lower()]} models...")
+        start = time.perf_counter()
+        if warm.lower() == "sofa":
+            # The inter-op pool cannot be resized once the model has used it
+            configure_threads(torch_threads, torch_interop_threads)
+        warm_up(ALIGNERS[warm.lower()], model_precision)
+        echo(f"Loaded in {time.perf_counter() - start:.2f}s")
+
+    shared_options = {
+        "num_workers": num_workers,
+        "cache_dir": None if no_cache else cache_dir,
+        "cache_size": cache_size,
+        "tools_dir": cache_dir / "tools",
+        "moresampler_archive": None,
+        "moresampler_sha256": None,
+        "staging": staging,
+        "dedup": "off",
+        "expand_duplicates": False,
+        "textgrid_format": textgrid_format,
+        "shard_workers": 0,
+        "shard_memory": 0,
+        "torch_threads": torch_threads,
+        "torch_interop_threads": torch_interop_threads,
+        "model_precision": model_precision,
+        "ap_workers": ap_workers,
+    }
+    # Unfinished jobs of an earlier server go first; the queue grows past its size for them once
+    backlog = spool.unfinished()
+    jobs = queue.Queue(maxsize=max(queue_size, len(backlog)))
+    for entry in backlog:
+        spool.set_status(entry["id"], state="queued")
+        jobs.put(entry)
+        echo(f"{entry['id']} ({entry['job']['name']}): resumed")
+    stopping = threading.Event()
+    thread = threading.Thread(
+        target=worker,
+        args=(spool, jobs, shared_options, stopping, echo),
+        name="converter",
+    )
+    thread.start()
+    echo(f"Waiting for jobs in {spool.incoming_dir}")
+    try:
+        while True:
+            for path in spool.incoming():
+                if jobs.qsize() >= queue_size:
+                    break
+                entry = spool.accept(path)
+                jobs.put(entry)
+                echo(f"{entry['id']} ({entry['job']['name']}): queued")
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        echo("Stopping after the running job; queued jobs resume on the next start.")
+    finally:
+        stopping.set()
+        thread.join()
+
+
+@cli.command()
+@spool_option
+@click.argument(
+    "job_file", type=click.Path(exists=True, dir_okay=False, path_type=pathlib.Path)
+)
+@click.option(
+    "--aligner",
+    type=click.Choice(list(ALIGNERS), case_sensitive=False),
+    default=None,
+    help="Forced aligner for jobs that do not set one.",
+)
+@click.option(
+    "--normalize/--no-normalize",
+    default=False,
+    show_default=True,
+    help="Normalize the volume for jobs that do not set it.",
+)
+@click.option(
+    "--trim/--no-trim",
+    default=False,
+    show_default=True,
+    help="Trim silence (SOFA only) for jobs that do not set it.",
+)
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    default=None,
+    help="Parent directory of the job outputs. Defaults to a timestamped directory under src/outputs.",
+)
+@click.option(
+    "--work-dir",
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    default=None,
+    help="Parent directory of the job work directories.",
+)
+def submit(
+    spool_dir: pathlib.Path,
+    job_file: pathlib.Path,
+    aligner: str | None,
+    normalize: bool,
+    trim: bool,
+    output: pathlib.Path | None,
+    work_dir: pathlib.Path | None,
+):
+    """
+    Submit the [[jobs]] of a TOML job file (see `main.py --jobs`) and print their ids.
+    """
+    jobs = load_jobs(
+        job_file,
+        {
+            "output": output,
+            "work_dir": work_dir,
+            "aligner": aligner.lower() if aligner is not None else None,
+            "normalize": normalize,
+            "trim": trim,
+            "trim_top_db": 30,
+            "sample_rate": None,
+            "oto_tolerance": 0,
+            "batch_frames": 0,
+        },
+    )
+    # Fail now rather than after the server has converted everything
+    for job in jobs:
+        check_output_path(
+            job["output"], False, "Choose another --output or remove it first."
+        )
+    spool = Spool(spool_dir)
+    for job in jobs:
+        # The server may run in another directory
+        for key in ("output", "work_dir"):
+            if job[key] is not None:
+                job[key] = str(pathlib.Path(job[key]).resolve())
+        job["voicebanks"] = [
+            str(pathlib.Path(path).resolve()) for path in job["voicebanks"]
+        ]
+        print(f"{spool.submit(job)} {job['name']}")
+
+
+@cli.command()
+@spool_option
+@click.argument("job_ids", nargs=-1)
+def status(spool_dir: pathlib.Path, job_ids: tuple[str, ...]):
+    """
+    Print the state and latency of the given jobs, or of every job in the spool.
+    """
+    spool = Spool(spool_dir)
+    if not job_ids:
+        job_ids = sorted(
+            {path.stem for path in spool.status_dir.glob("*.json")}
+            | {path.stem for path in spool.incoming()}
+        )
+    for job_id in job_ids:
+        job_status = spool.status(job_id)
+        if job_status is None:
+            raise click.BadParameter(f"Unknown job '{job_id}'.", param_hint="JOB_IDS")
+        line = f"{job_id} {job_status.get('name', '')} {job_status['state']}"
+        if job_status["state"] in ("done", "failed"):
+            line += (
+                f" queue {job_status['queue_seconds']:.2f}s"
+                f" run {job_status['run_seconds']:.2f}s"
+                f" latency {job_status['latency_seconds']:.2f}s"
+            )
+        if job_status["state"] == "done":
+            line += f" -> {job_status['output']}"
+        if job_status.get("error"):
+            line += f" ({job_status['error']})"
+        print(line)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,107 @@
+import pathlib
+import random
+from typing import TYPE_CHECKING
+
+import numpy as np
+import soundfile
+import tqdm
+
+from textgrids import filled_intervals, read_bundle, read_textgrid
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# build_dataset is a port of MakeDiffSinger/acoustic_forced_alignment/build_dataset.py,
+# which is a click command that reads TextGrid files and writes
+# transcriptions.csv itself. The repository does not pin a submodule commit, so
+# compare against the checked-out src/MakeDiffSinger when updating it.
+# Divergences: the TextGrids may come from the align stage's TextGrid.jsonl
+# bundle, and the transcriptions are returned instead of written.
+
+SAMPLE_RATE = 44100
+
+
+def phoneme_durations(data: dict) -> tuple[list[str], list[float]]:
+    """
+    Phonemes and durations of the second tier, as MakeDiffSinger's build_dataset gets them from `textgrid.TextGrid.read`.
+
+    `TextGrid.read` rounds the times to 5 digits and drops the intervals that
+    are empty after rounding.
+    """
+    ph_seq = []
+    ph_dur = []
+    for start, end, mark in filled_intervals(data["tiers"][1]):
+        start, end = round(start, 5), round(end, 5)
+        if start < end:
+            ph_seq.append(mark)
+            ph_dur.append(end - start)
+    return ph_seq, ph_dur
+
+
+def load_textgrids(align_dir: pathlib.Path) -> dict[str, dict]:
+    """
+    TextGrid data of the align stage by recording name, from its TextGrid.jsonl bundle or its TextGrid directory.
+    """
+    bundle_path = align_dir / "TextGrid.jsonl"
+    if bundle_path.exists():
+        return read_bundle(bundle_path)
+    return {
+        textgrid_file.stem: read_textgrid(textgrid_file)
+        for textgrid_file in (align_dir / "TextGrid").glob("*.TextGrid")
+    }
+
+
+def build_dataset(
+    wavs_dir: pathlib.Path,
+    textgrids: dict[str, dict],
+    dataset_dir: pathlib.Path,
+    wav_subtype: str = "PCM_16",
+) -> "pd.DataFrame":
+    """
+    MakeDiffSinger's acoustic_forced_alignment/build_dataset.py, returning the transcriptions instead of writing them.
+
+    Each recording is resampled to 44.1 kHz, padded at either end with 0.1 to
+    0.5 seconds of silence (SP) with probability 0.5 and written to
+    `dataset_dir/wavs`.
+
+    Returns:
+        pd.DataFrame: `name`, `ph_seq` and `ph_dur` of every recording
+    """
+    import librosa
+    import pandas as pd
+
+    wav_files = list(wavs_dir.glob("*.wav"))
+    (dataset_dir / "wavs").mkdir(parents=True, exist_ok=True)
+    transcriptions = []
+    min_sil = int(0.1 * SAMPLE_RATE)
+    max_sil = int(0.5 * SAMPLE_RATE)
+    for wav_file in tqdm.tqdm(wav_files):
+        y, _ = librosa.load(wav_file, sr=SAMPLE_RATE, mono=True)
+        ph_seq, ph_dur = phoneme_durations(textgrids[wav_file.stem])
+        if random.random() < 0.5:
+            len_sil = random.randrange(min_sil, max_sil)
+            y = np.concatenate((np.zeros((len_sil,), dtype=np.float32), y))
+            if ph_seq[0] == "SP":
+                ph_dur[0] += len_sil / SAMPLE_RATE
+            else:
+                ph_seq.insert(0, "SP")
+                ph_dur.insert(0, len_sil / SAMPLE_RATE)
+        if random.random() < 0.5:
+            len_sil = random.randrange(min_sil, max_sil)
+            y = np.concatenate((y, np.zeros((len_sil,), dtype=np.float32)))
+            if ph_seq[-1] == "SP":
+                ph_dur[-1] += len_sil / SAMPLE_RATE
+            else:
+                ph_seq.append("SP")
+                ph_dur.append(len_sil / SAMPLE_RATE)
+        soundfile.write(
+            dataset_dir / "wavs" / wav_file.name, y, SAMPLE_RATE, subtype=wav_subtype
+        )
+        transcriptions.append(
+            {
+                "name": wav_file.stem,
+                "ph_seq": " ".join(ph_seq),
+                "ph_dur": " ".join(str(round(d, 6)) for d in ph_dur),
+            }
+        )
+    return pd.DataFrame(transcriptions, columns=["name", "ph_seq", "ph_dur"])
@@ -0,0 +1,112 @@
+import csv
+import functools
+import hashlib
+import json
+import pathlib
+
+import soundfile
+
+from audio import process_wav_files, report_errors
+from cache import hash_file
+from staging import Stager
+
+
+def pcm_digest(wav_file: pathlib.Path) -> str:
+    """
+    Hash the decoded samples and sample rate, so files that differ only in their headers or metadata chunks match.
+    """
+    y, sr = soundfile.read(str(wav_file), dtype="float64", always_2d=True)
+    digest = hashlib.sha256()
+    digest.update(f"{sr} {y.shape[0]} {y.shape[1]}".encode("ascii"))
+    digest.update(y.tobytes())
+    return digest.hexdigest()
+
+
+def content_digest(wav_file: pathlib.Path, mode: str = "bytes") -> str:
+    return pcm_digest(wav_file) if mode == "pcm" else hash_file(wav_file)
+
+
+def find_duplicates(
+    wav_files: dict[str, pathlib.Path], mode: str, num_workers: int = 1
+) -> dict[str, str]:
+    """
+    Find recordings that appear more than once among the merged voicebanks.
+
+    Two files are duplicates when they have the same name in their voicebanks
+    (and therefore the same label) and the same content. The first file in
+    `wav_files` order is kept.
+
+    Args:
+        wav_files (dict[str, pathlib.Path]): Source file by merged name, in merge order
+        mode (str): "bytes" to hash the files, "pcm" to hash the decoded audio, "off" to skip
+        num_workers (int): Number of worker processes for hashing
+
+    Returns:
+        dict[str, str]: Merged name of each duplicate mapped to the merged name of the kept file
+    """
+    if mode == "off":
+        return {}
+    digests, errors = process_wav_files(
+        functools.partial(content_digest, mode=mode),
+        list(wav_files.values()),
+        num_workers,
+    )
+    # Files that cannot be hashed are kept and fail later where they are processed
+    report_errors(errors)
+    canonical_names: dict[tuple[str, str], str] = {}
+    duplicates = {}
+    for merged_name, wav_file in wav_files.items():
+        if wav_file not in digests:
+            continue
+        key = (wav_file.name, digests[wav_file])
+        if key in canonical_names:
+            duplicates[merged_name] = canonical_names[key]
+        else:
+            canonical_names[key] = merged_name
+    return duplicates
+
+
+def save_duplicates(path: pathlib.Path, duplicates: dict[str, str]):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(duplicates, f, ensure_ascii=False, indent=2)
+
+
+def expand_duplicates(
+    output_path: pathlib.Path, duplicates: dict[str, str], stager: Stager
+) -> int:
+    """
+    Re-create the dataset items of every duplicate from those of the kept file.
+
+    The dataset build names every item after its recording, so the item of
+    the kept file is copied under the name of each duplicate. The audio and
+    .ds files are placed with `stager` (hardlinks where possible) and the rows
+    of transcriptions.csv are duplicated.
+
+    Returns:
+        int: Number of added items
+    """
+    duplicate_stems: dict[str, list[str]] = {}
+    for duplicate_name, canonical_name in duplicates.items():
+        duplicate_stems.setdefault(pathlib.Path(canonical_name).stem, []).append(
+            pathlib.Path(duplicate_name).stem
+        )
+
+    transcriptions_path = output_path / "transcriptions.csv"
+    with open(transcriptions_path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        rows = list(reader)
+    added_rows = []
+    wavs_path = output_path / "wavs"
+    for row in rows:
+        for name in duplicate_stems.get(row["name"], []):
+            added_rows.append({**row, "name": name})
+            for suffix in (".wav", ".ds"):
+                source = wavs_path / f"{row['name']}{suffix}"
+                if source.exists():
+                    stager.place(source, wavs_path / f"{name}{suffix}")
+    with open(transcriptions_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows + added_rows)
+    return len(added_rows)
@@ -1,12 +1,154 @@
-import pyopenjtalk
 import warnings
 import pathlib
-import pandas as pd
+import json
+import os
+import sys
+import threading
+import contextlib
+from collections import OrderedDict
 
-from SOFA.modules.g2p.base_g2p import DataFrameDataset
+
+@contextlib.contextmanager
+def file_lock(path: pathlib.Path):
+    """
+    Hold an exclusive lock on `path` (created if missing) across processes.
+    """
+    with open(path, "a+b") as f:
+        if sys.platform == "win32":
+            import msvcrt
+
+            f.seek(0)
+            while True:
+                try:
+                    # Retries for about 10 seconds before raising
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class G2PCache:
+    """
+    Bounded, thread-safe LRU cache in front of `pyopenjtalk.g2p(text, join=False)`.
+
+    The same few hundred kana syllables recur across every file of a voicebank,
+    so most lookups are hits. The cache can be persisted as JSON so that later
+    runs over the same voicebank skip OpenJTalk entirely.
+    """
+
+    # OpenJTalk uses a single global instance, so calls into it are serialized
+    _openjtalk_lock = threading.Lock()
+
+    def __init__(self, max_size: int = 65536):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[str, ...]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, text: str) -> list[str]:
+        with self._lock:
+            phones = self._entries.get(text)
+            if phones is not None:
+                self._entries.move_to_end(text)
+                self.hits += 1
+                return list(phones)
+            self.misses += 1
+        import pyopenjtalk
+
+        with self._openjtalk_lock:
+            phones = tuple(pyopenjtalk.g2p(text, join=False))
+        self._put(text, phones)
+        return list(phones)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _put(self, text: str, phones: tuple[str, ...]):
+        with self._lock:
+            self._entries[text] = phones
+            self._entries.move_to_end(text)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _version() -> str:
+        import pyopenjtalk
+
+        return str(getattr(pyopenjtalk, "__version__", "unknown"))
+
+    def _read(self, path: pathlib.Path) -> dict[str, list[str]]:
+        if not path.exists():
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            warnings.warn(f"Failed to load G2P cache {path}: {e}")
+            return {}
+        if data.get("version") != self._version():
+            return {}
+        return data["entries"]
+
+    def load(self, path: pathlib.Path):
+        """
+        Load entries saved by `save`. Files written by another pyopenjtalk version are ignored.
+        """
+        for text, phones in self._read(path).items():
+            self._put(text, tuple(phones))
+
+    def save(self, path: pathlib.Path):
+        """
+        Add the entries to those saved at `path`.
+
+        Parallel shards and conversions save the same file, so the entries on
+        disk are merged under a lock instead of being replaced; the entries of
+        this cache count as the most recently used.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with file_lock(path.with_suffix(path.suffix + ".lock")):
+            entries = OrderedDict(self._read(path))
+            with self._lock:
+                for text, phones in self._entries.items():
+                    entries[text] = list(phones)
+                    entries.move_to_end(text)
+            while len(entries) > self.max_size:
+                entries.popitem(last=False)
+            temp_path = path.with_suffix(path.suffix + f".{os.getpid()}.tmp")
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"version": self._version(), "entries": entries},
+                    f,
+                    ensure_ascii=False,
+                )
+            os.replace(temp_path, path)
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0
+        return f"G2P cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), {len(self)} entries"
+
+
+g2p_cache = G2PCache()
 
 
 class PyOpenJTalkG2P:
+    def __init__(self, cache: G2PCache | None = None):
+        self.cache = cache if cache is not None else g2p_cache
+
     def __call__(self, text: str):
         ph_seq, word_seq, ph_idx_to_word_idx = self._g2p(text)
 
@@ -25,7 +167,7 @@ class PyOpenJTalkG2P:
         ph_seq = ["SP"]
         ph_idx_to_word_idx = [-1]
         for word in word_seq_raw:
-            phones = pyopenjtalk.g2p(word, join=False)
+            phones = self.cache(word)
             if not phones:
                 warnings.warn(f"Word {word} is not in the dictionary. Ignored.")
                 continue
@@ -47,6 +189,10 @@ class PyOpenJTalkG2P:
         return ph_seq, word_seq, ph_idx_to_word_idx
 
     def get_dataset(self, wav_paths: list[pathlib.Path]):
+        import pandas as pd
+
+        from SOFA.modules.g2p.base_g2p import DataFrameDataset
+
         dataset = []
         for wav_path in wav_paths:
             try:
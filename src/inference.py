@@ -0,0 +1,150 @@
+import json
+import os
+import pathlib
+import warnings
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from SOFA.train import LitForcedAlignmentTask
+
+# "fp32" runs the checkpoint as trained. "int8" quantizes the weights of the
+# linear layers dynamically (activations are quantized on the fly,
+# convolutions stay fp32); the quantized model is cached next to the
+# checkpoint so that later runs only load it.
+PRECISIONS = ("fp32", "int8")
+
+
+def configure_threads(intra_op: int, inter_op: int):
+    """
+    Set the number of threads torch uses within an operator and between operators. 0 keeps the torch default.
+
+    The inter-op pool can only be sized before it is first used, so a later
+    request for a different size only warns.
+    """
+    import torch
+
+    if intra_op > 0:
+        torch.set_num_threads(intra_op)
+    if inter_op > 0 and torch.get_num_interop_threads() != inter_op:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError as e:
+            warnings.warn(f"Could not set the inter-op threads: {e}")
+
+
+def default_threads(num_processes: int) -> int:
+    """
+    Intra-op threads per process when `num_processes` processes run models at the same time, so that together they do not oversubscribe the cores.
+    """
+    return max(1, (os.cpu_count() or 1) // num_processes)
+
+
+def variant_path(checkpoint_path: pathlib.Path, precision: str) -> pathlib.Path:
+    return checkpoint_path.with_name(f"{checkpoint_path.stem}.{precision}.pt")
+
+
+def checkpoint_signature(checkpoint_path: pathlib.Path) -> dict:
+    import torch
+
+    stat = checkpoint_path.stat()
+    return {
+        "checkpoint": checkpoint_path.name,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "torch": torch.__version__,
+    }
+
+
+def quantize(model: "LitForcedAlignmentTask") -> "LitForcedAlignmentTask":
+    import torch
+
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def quantized_structure(model: "LitForcedAlignmentTask") -> "LitForcedAlignmentTask":
+    """
+    Replace the linear layers with empty int8 ones like `quantize` creates, so that a saved quantized state_dict can be loaded without quantizing again.
+    """
+    import torch
+
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if type(child) is torch.nn.Linear:
+                setattr(
+                    module,
+                    name,
+                    torch.ao.nn.quantized.dynamic.Linear(
+                        child.in_features,
+                        child.out_features,
+                        bias_=child.bias is not None,
+                        dtype=torch.qint8,
+                    ),
+                )
+    return model
+
+
+def load_cached_variant(
+    checkpoint_path: pathlib.Path, precision: str
+) -> "LitForcedAlignmentTask | None":
+    """
+    The model saved by `load_model` next to the checkpoint, or None if there is none or it was made from another checkpoint or torch version.
+    """
+    import pickle
+
+    import torch
+    from SOFA.train import LitForcedAlignmentTask
+
+    path = variant_path(checkpoint_path, precision)
+    if not path.exists():
+        return None
+    try:
+        cached = torch.load(path, map_location="cpu", weights_only=True)
+    except pickle.UnpicklingError as e:
+        warnings.warn(f"Ignoring {path}: {e}")
+        return None
+    if cached["signature"] != checkpoint_signature(checkpoint_path):
+        return None
+    model = quantized_structure(LitForcedAlignmentTask(**cached["hyper_parameters"]))
+    model.load_state_dict(cached["state_dict"])
+    model.set_inference_mode("force")
+    return model.eval()
+
+
+def load_model(
+    checkpoint_path: pathlib.Path, precision: str = "fp32"
+) -> "LitForcedAlignmentTask":
+    """
+    Load a SOFA checkpoint for inference in `precision`.
+
+    Quantized models are saved next to the checkpoint (tensors, settings and
+    plain data only, so they load with `weights_only=True`) and later loaded
+    from there without reading the fp32 checkpoint, while the checkpoint and
+    torch are unchanged.
+    """
+    import torch
+    from SOFA.train import LitForcedAlignmentTask
+
+    if precision != "fp32":
+        model = load_cached_variant(checkpoint_path, precision)
+        if model is not None:
+            return model
+    model = LitForcedAlignmentTask.load_from_checkpoint(str(checkpoint_path))
+    model.set_inference_mode("force")
+    if precision == "fp32":
+        return model
+    model = quantize(model.eval())
+    path = variant_path(checkpoint_path, precision)
+    temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    torch.save(
+        {
+            "signature": checkpoint_signature(checkpoint_path),
+            # Plain data, which weights_only loading accepts
+            "hyper_parameters": json.loads(json.dumps(dict(model.hparams))),
+            "state_dict": model.state_dict(),
+        },
+        temp_path,
+    )
+    os.replace(temp_path, path)
+    return model
@@ -0,0 +1,210 @@
+import contextlib
+import json
+import os
+import pathlib
+import sys
+import time
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+
+def peak_rss_bytes() -> int | None:
+    """
+    Peak resident set size of the current process so far, or None where it cannot be determined.
+    """
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(),
+            ctypes.byref(counters),
+            counters.cb,
+        ):
+            return None
+        return counters.PeakWorkingSetSize
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def cpu_seconds() -> float:
+    """
+    CPU time of this process and of its finished child processes (worker pools, Moresampler).
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class Step:
+    def __init__(self, name: str):
+        self.name = name
+        self.files = 0
+        self.audio_seconds = 0.0
+        self.skipped = False
+        self.wall_seconds = 0.0
+        self.cpu_seconds: float | None = None
+        self.peak_rss_bytes: int | None = None
+        self.aggregated = False
+        self.profile: str | None = None
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "skipped": self.skipped,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "files": self.files,
+            "audio_seconds": self.audio_seconds,
+            "files_per_second": self.files / self.wall_seconds
+            if self.wall_seconds
+            else None,
+            "audio_seconds_per_second": self.audio_seconds / self.wall_seconds
+            if self.wall_seconds
+            else None,
+            "aggregated": self.aggregated,
+            "profile": self.profile,
+        }
+
+
+class Recorder:
+    """
+    Collect wall time, CPU time, peak RSS and throughput of the phases and their sub-steps.
+
+    Steps nest; a sub-step is named `<phase> / <sub-step>`. Code that knows how
+    much it processed reports it with `count`, which adds to the innermost
+    open step. Work done in worker processes is reported with `add` as the sum
+    of the per-file times, marked `aggregated`. Peak RSS is the peak of the
+    main process up to the end of the step.
+    """
+
+    def __init__(self):
+        self.steps: list[Step] = []
+        self._stack: list[Step] = []
+        self.profile_names: set[str] = set()
+        self.profiler = "cprofile"
+        self.profile_dir: pathlib.Path | None = None
+
+    def reset(self):
+        self.steps = []
+        self._stack = []
+
+    def configure_profiling(
+        self, names: list[str], profiler: str, profile_dir: pathlib.Path
+    ):
+        self.profile_names = set(names)
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+
+    def _full_name(self, name: str) -> str:
+        return " / ".join([*(step.name for step in self._stack[-1:]), name])
+
+    @contextlib.contextmanager
+    def step(self, name: str, profile_name: str | None = None):
+        """
+        Measure the enclosed block. When `profile_name` was passed to `configure_profiling`, the block is also profiled.
+        """
+        step = Step(self._full_name(name))
+        self.steps.append(step)
+        self._stack.append(step)
+        profiler = None
+        if profile_name is not None and profile_name in self.profile_names:
+            profiler = self._start_profiler()
+        start_wall = time.perf_counter()
+        start_cpu = cpu_seconds()
+        try:
+            yield step
+        finally:
+            step.wall_seconds = time.perf_counter() - start_wall
+            step.cpu_seconds = cpu_seconds() - start_cpu
+            step.peak_rss_bytes = peak_rss_bytes()
+            if profiler is not None:
+                step.profile = self._stop_profiler(profiler, profile_name)
+            self._stack.pop()
+
+    def count(self, files: int = 0, audio_seconds: float = 0.0):
+        if self._stack:
+            self._stack[-1].files += files
+            self._stack[-1].audio_seconds += audio_seconds
+
+    def add(
+        self, name: str, seconds: float, files: int = 0, audio_seconds: float = 0.0
+    ):
+        step = Step(self._full_name(name))
+        step.wall_seconds = seconds
+        step.files = files
+        step.audio_seconds = audio_seconds
+        step.aggregated = True
+        self.steps.append(step)
+
+    def skip(self, name: str):
+        step = Step(self._full_name(name))
+        step.skipped = True
+        self.steps.append(step)
+
+    def _start_profiler(self):
+        if self.profiler == "pyinstrument":
+            import pyinstrument
+
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+        else:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, profiler, profile_name: str) -> str:
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        if self.profiler == "pyinstrument":
+            profiler.stop()
+            path = self.profile_dir / f"{profile_name}.html"
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.disable()
+            path = self.profile_dir / f"{profile_name}.prof"
+            profiler.dump_stats(str(path))
+        return str(path)
+
+    def report(self) -> list[dict]:
+        return [step.to_dict() for step in self.steps]
+
+    def summary(self) -> str:
+        lines = []
+        for step in self.steps:
+            if step.skipped:
+                lines.append(f"  {step.name}: skipped")
+            else:
+                lines.append(f"  {step.name}: {step.wall_seconds:.2f}s")
+        return "\n".join(lines)
+
+
+def write_report(path: pathlib.Path, report: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+
+
+recorder = Recorder()
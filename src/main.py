@@ -4,907 +4,630 @@ sys.path.append("src/SOFA")
 sys.path.append("src/SOFA/modules")
 sys.path.append("src/MakeDiffSinger/acoustic_forced_alignment")
 sys.path.append("src/MakeDiffSinger/variance-temp-solution")
-import tempfile
+import traceback
 import pathlib
-import tqdm
-import re
+import hashlib
 import tomllib
-import soundfile
-import librosa
-import librosa.effects
-import librosa.util
-import SOFA.modules.AP_detector
-import SOFA.modules.g2p
-from SOFA.modules.utils.export_tool import Exporter
-from SOFA.modules.utils.post_processing import post_processing
-from SOFA.train import LitForcedAlignmentTask
-from g2p import PyOpenJTalkG2P
-from utils import (
-    import_module_from_path,
-    bowlroll_file_download,
-    remove_specific_consecutive_duplicates,
-    remove_duplicate_otos,
-    convert_sharp_flat_in_notes,
+from instrumentation import (
+    PROFILERS,
+    cpu_seconds,
+    peak_rss_bytes,
+    recorder,
+    write_report,
 )
-import pyopenjtalk
-import torch
-import lightning as pl
+from inference import PRECISIONS
+from pipeline import Pipeline
 import click
-from MakeDiffSinger.acoustic_forced_alignment.build_dataset import build_dataset
 import datetime
 import shutil
-import os
-import subprocess
-import utaupy
 import time
-import textgrid
-
+import os
 
-add_ph_num: click.Command = import_module_from_path(
-    "src/MakeDiffSinger/variance-temp-solution/add_ph_num.py", "add_ph_num"
-).add_ph_num
-estimate_midi: click.Command = import_module_from_path(
-    "src/MakeDiffSinger/variance-temp-solution/estimate_midi.py", "estimate_midi"
-).estimate_midi
-csv2ds: click.Command = import_module_from_path(
-    "src/MakeDiffSinger/variance-temp-solution/convert_ds.py", "convert_ds"
-).csv2ds
 
+# Keep the imports above light so that --version and --help return immediately;
+# the aligners and MakeDiffSinger steps are imported when their stages run.
+with open(pathlib.Path(__file__).resolve().parent.parent / "pyproject.toml", "rb") as f:
+    pyproject = tomllib.load(f)
 
-if not pathlib.Path("src/Moresampler").exists():
-    with tempfile.TemporaryDirectory() as temp_dir_str:
-        temp_dir = pathlib.Path(temp_dir_str)
-        file_id = 139123
-        file_name = pathlib.Path("Moresampler.zip")
-        content = bowlroll_file_download(file_id)
-        with open(temp_dir / file_name, "wb") as f:
-            f.write(content)
-        shutil.unpack_archive(temp_dir / file_name, temp_dir / "Moresampler")
-        shutil.move(temp_dir / "Moresampler", "src/Moresampler")
 
+def default_work_dir(
+    voicebank_dirs: list[pathlib.Path], forced_aligner: str
+) -> pathlib.Path:
+    key = "\n".join(
+        [
+            forced_aligner,
+            *(str(voicebank_dir.resolve()) for voicebank_dir in voicebank_dirs),
+        ]
+    )
+    return (
+        pathlib.Path("src/work") / hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+    )
 
-with open("pyproject.toml", "rb") as f:
-    pyproject = tomllib.load(f)
 
-HIRAGANA_REGEX = re.compile(r"([あ-ん][ぁぃぅぇぉゃゅょ]|[あ-ん])")
-KATAKANA_REGEX = re.compile(r"([ア-ン][ァィゥェォャュョ]|[ア-ン])")
+ALIGNERS = {"sofa": "SOFA", "moresampler": "Moresampler"}
+
+STAGE_NAMES = [
+    "merge",
+    "oto",
+    "preprocess",
+    "graphemes",
+    "align",
+    "dataset",
+]
+
+JOB_KEYS = {
+    "name",
+    "voicebanks",
+    "output",
+    "work_dir",
+    "aligner",
+    "normalize",
+    "trim",
+    "trim_top_db",
+    "sample_rate",
+    "oto_tolerance",
+    "batch_frames",
+}
 
 
 def validate_directories(
     ctx: click.Context, param: click.Parameter, value: tuple[str, ...]
 ) -> tuple[str, ...]:
-    if not value:
-        raise click.BadParameter("At least one directory path must be specified.")
     for path in value:
         if not os.path.isdir(path):
             raise click.BadParameter(f"'{path}' is not a directory.")
     return value
 
 
-@click.command()
-@click.version_option(version=pyproject["project"]["version"])
-@click.argument("voicebank_dir_strs", nargs=-1, callback=validate_directories)
-def main(voicebank_dir_strs: list[str]):
-    print(
-        f"Voicebank to DiffSinger {pyproject['project']['version']} - Convert the UTAU Voicebank to a configuration compatible with DiffSinger Dataset"
-    )
-    print()
-    print("Select the forced aligner to use:")
-    print("1: SOFA")
-    print("2: Moresampler")
-    forced_aligner_type = input("Enter the number of the forced aligner to use: ")
-    if forced_aligner_type == "1":
-        forced_aligner = "SOFA"
-    elif forced_aligner_type == "2":
-        forced_aligner = "Moresampler"
-    else:
-        print("Invalid input.")
-        sys.exit(1)
-    normalize_flag = False
-    if forced_aligner == "SOFA" or forced_aligner == "Moresampler":
-        normalize_flag = input("Do you want to normalize the volume? (y/n): ") == "y"
-    detect_nonslicent_flag = False
-    if forced_aligner == "SOFA":
-        detect_nonslicent_flag = (
-            input("Do you want to perform silence trimming? (y/n): ") == "y"
+def load_jobs(job_file: pathlib.Path, defaults: dict) -> list[dict]:
+    """
+    Read a TOML job file with one `[[jobs]]` table per conversion.
+
+    Every table needs `voicebanks`, a list of voicebank directories, and may
+    set `name` (default: `job<N>`). The other keys have the same names as the
+    command line options (`aligner`, `normalize`, `trim`, `trim_top_db`,
+    `sample_rate`, `oto_tolerance`, `batch_frames`, `output`, `work_dir`) and
+    fall back to the values given on the command line, except that `--output`
+    and `--work-dir` become parent directories with one subdirectory per job.
+    Relative paths in the file are resolved against the job file.
+    """
+    with open(job_file, "rb") as f:
+        job_tables = tomllib.load(f).get("jobs", [])
+    if not job_tables:
+        raise click.BadParameter(
+            f"'{job_file}' does not contain any [[jobs]] tables.", param_hint="--jobs"
         )
-    print()
-
-    voicebank_dirs = [
-        pathlib.Path(voicebank_dir_str) for voicebank_dir_str in voicebank_dir_strs
-    ]
-
-    with tempfile.TemporaryDirectory() as temp_dir_str:
-        temp_dir = pathlib.Path(temp_dir_str)
-        if forced_aligner == "SOFA":
-            print("Phase 1: Merge voicebanks...")
-            print()
-
-            with tqdm.tqdm(total=len(voicebank_dirs)) as pbar:
-                for voicebank_dir in voicebank_dirs:
-                    for wav_file in voicebank_dir.glob("*.wav"):
-                        shutil.copy(
-                            wav_file,
-                            temp_dir / convert_sharp_flat_in_notes(f"{wav_file.stem}_{voicebank_dir.stem}.wav"),
-                        )
-                    pbar.update(1)
-
-            wav_files = list(temp_dir.glob("*.wav"))
-
-            print()
-            print("Phase 1: Done.")
-            print()
-
-            if normalize_flag:
-                print("Phase 1-1: Normalizing volume...")
-                print()
-
-                with tqdm.tqdm(total=len(wav_files)) as pbar:
-                    for wav_file in wav_files:
-                        y, sr = librosa.load(wav_file, sr=None)
-                        y = librosa.util.normalize(y)
-                        soundfile.write(wav_file, y, sr)
-                        pbar.update(1)
-
-                print()
-                print("Phase 1-1: Done.")
-                print()
-
-            if detect_nonslicent_flag:
-                print("Phase 1-1: Performing silence trimming...")
-                print()
-
-                with tqdm.tqdm(total=len(wav_files)) as pbar:
-                    for wav_file in wav_files:
-                        y, sr = librosa.load(wav_file, sr=None)
-                        y = librosa.effects.trim(y, top_db=30)[0]
-                        soundfile.write(wav_file, y, sr)
-                        pbar.update(1)
-
-                print()
-                print("Phase 1-1: Done.")
-                print()
-
-            print("Phase 2: Generating text files...")
-            print()
-
-            with tqdm.tqdm(total=len(wav_files)) as pbar:
-                for wav_file in wav_files:
-                    file_name = pathlib.Path(wav_file).stem
-                    words = file_name[1:]
-                    graphemes = remove_specific_consecutive_duplicates(
-                        [
-                            *HIRAGANA_REGEX.findall(words),
-                            *KATAKANA_REGEX.findall(words),
-                        ],
-                        ["あ", "い", "う", "え", "お", "ん"],
-                    )
-                    with open(
-                        str(temp_dir) + "/" + file_name + ".txt",
-                        "w",
-                        encoding="utf-8",
-                    ) as f:
-                        f.write(" ".join(graphemes))
-                    pbar.update(1)
-
-            print()
-            print("Phase 2: Done.")
-            print()
-            print("Phase 3: Generating TextGrids...")
-            print()
-
-            AP_detector_class = (
-                SOFA.modules.AP_detector.LoudnessSpectralcentroidAPDetector
+    batch_output_path = defaults["output"] or pathlib.Path(
+        "src/outputs"
+    ) / datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    jobs = []
+    names = set()
+    for index, job_table in enumerate(job_tables):
+        unknown_keys = set(job_table) - JOB_KEYS
+        if unknown_keys:
+            raise click.BadParameter(
+                f"Job {index + 1} has unknown keys: {', '.join(sorted(unknown_keys))}.",
+                param_hint="--jobs",
             )
-            get_AP = AP_detector_class()
-
-            g2p_class = PyOpenJTalkG2P
-            grapheme_to_phoneme = g2p_class()
-
-            torch.set_grad_enabled(False)
-
-            model = LitForcedAlignmentTask.load_from_checkpoint(
-                "src/ckpt/step.100000.ckpt"
+        if not job_table.get("voicebanks"):
+            raise click.BadParameter(
+                f"Job {index + 1} does not list any voicebanks.", param_hint="--jobs"
             )
-            model.set_inference_mode("force")
-
-            trainer = pl.Trainer(logger=False)
-
-            dataset = grapheme_to_phoneme.get_dataset(wav_files)
-
-            predictions = trainer.predict(
-                model, dataloaders=dataset, return_predictions=True
+        job = {**defaults, "name": f"job{index + 1}", **job_table}
+        if job["name"] in names:
+            raise click.BadParameter(
+                f"Job name '{job['name']}' is used more than once.", param_hint="--jobs"
             )
-
-            predictions = get_AP.process(predictions)
-            predictions, log = post_processing(predictions)
-
-            exporter = Exporter(predictions, log)
-            exporter.export(["textgrid"])
-
-            print()
-            print("Phase 3: Done.")
-            print()
-        elif forced_aligner == "Moresampler":
-            print("Phase 1: Generating oto.ini file...")
-            print()
-
-            for voicebank_dir in voicebank_dirs:
-                temp_voicebank_dir = temp_dir / voicebank_dir.stem
-                temp_voicebank_dir.mkdir()
-                wav_files = list(voicebank_dir.glob("*.wav"))
-                with tqdm.tqdm(total=len(wav_files)) as pbar:
-                    for wav_file in voicebank_dir.glob("*.wav"):
-                        shutil.copy(
-                            wav_file,
-                            temp_voicebank_dir / wav_file.name,
-                        )
-                        pbar.update(1)
-                print()
-                process = subprocess.Popen(
-                    [
-                        "src/Moresampler/moresampler.exe",
-                        str(temp_voicebank_dir),
-                    ],
-                    stdin=subprocess.PIPE,
-                    text=True,
+        names.add(job["name"])
+        job["voicebanks"] = [job_file.parent / path for path in job["voicebanks"]]
+        job["output"] = batch_output_path / job["name"]
+        if defaults["work_dir"] is not None:
+            job["work_dir"] = defaults["work_dir"] / job["name"]
+        for key in ("output", "work_dir"):
+            if job_table.get(key) is not None:
+                job[key] = job_file.parent / job_table[key]
+        if job["aligner"] is not None:
+            job["aligner"] = job["aligner"].lower()
+        for voicebank_dir in job["voicebanks"]:
+            if not voicebank_dir.is_dir():
+                raise click.BadParameter(
+                    f"'{voicebank_dir}' in job {index + 1} is not a directory.",
+                    param_hint="--jobs",
                 )
-                process.stdin.write("1\n")
-                process.stdin.flush()
-                process.stdin.write("y\n")
-                process.stdin.flush()
-                process.stdin.write("n\n")
-                process.stdin.flush()
-                process.stdin.write("1\n")
-                process.stdin.flush()
-                process.stdin.write("n\n")
-                process.stdin.flush()
-                process.stdin.write("\n")
-                process.stdin.flush()
-                while process.poll() is None:
-                    process.stdin.write("\n")
-                    process.stdin.flush()
-                    time.sleep(0.1)
-                print()
-
-            print()
-            print("Phase 1: Done.")
-            print()
-            print("Phase 2: Merge voicebanks...")
-            print()
+        if job["aligner"] not in ALIGNERS:
+            raise click.BadParameter(
+                f"Job {index + 1} needs an aligner ({' or '.join(ALIGNERS)}).",
+                param_hint="--jobs",
+            )
+        jobs.append(job)
+    return jobs
+
+
+def prompt_missing_options(job: dict):
+    """
+    Ask for the settings that were not given on the command line, as the tool did before it had options for them.
+    """
+    if job["aligner"] is None:
+        print("Select the forced aligner to use:")
+        print("1: SOFA")
+        print("2: Moresampler")
+        forced_aligner_type = input("Enter the number of the forced aligner to use: ")
+        if forced_aligner_type == "1":
+            job["aligner"] = "sofa"
+        elif forced_aligner_type == "2":
+            job["aligner"] = "moresampler"
+        else:
+            print("Invalid input.")
+            sys.exit(1)
+    if job["normalize"] is None:
+        job["normalize"] = input("Do you want to normalize the volume? (y/n): ") == "y"
+    if job["trim"] is None and job["aligner"] == "sofa":
+        job["trim"] = input("Do you want to perform silence trimming? (y/n): ") == "y"
+    print()
 
-            merged_oto_ini = utaupy.otoini.OtoIni()
-            with tqdm.tqdm(total=len(voicebank_dirs)) as pbar:
-                for voicebank_dir in voicebank_dirs:
-                    temp_voicebank_dir = temp_dir / voicebank_dir.stem
-                    oto_ini = utaupy.otoini.load(str(temp_voicebank_dir / "oto.ini"))
-                    for wav_file in (temp_voicebank_dir).glob("*.wav"):
-                        shutil.move(
-                            wav_file,
-                            temp_dir / convert_sharp_flat_in_notes(f"{wav_file.stem}_{voicebank_dir.stem}.wav"),
-                        )
-                        otos: list[utaupy.otoini.Oto] = list(
-                            filter(lambda oto: oto.filename == wav_file.name, oto_ini)
-                        )
-                        for oto in otos:
-                            oto.filename = convert_sharp_flat_in_notes(f"{wav_file.stem}_{voicebank_dir.stem}.wav")
-                            merged_oto_ini.append(oto)
-                    shutil.rmtree(temp_voicebank_dir)
-                    pbar.update(1)
-            merged_oto_ini.write(str(temp_dir / "oto.ini"))
 
-            print()
-            print("Phase 2: Done.")
-            print()
-            print("Phase 3: Convert oto.ini to TextGrid...")
-            print()
+def check_output_path(
+    output_path: pathlib.Path | str | None,
+    overwrite: bool,
+    hint: str = "Choose another --output or pass --overwrite.",
+):
+    if output_path is not None and pathlib.Path(output_path).exists() and not overwrite:
+        raise click.UsageError(
+            f"Output directory '{output_path}' already exists. {hint}"
+        )
 
-            textgrid_dir = temp_dir / "TextGrid"
-            textgrid_dir.mkdir()
-            oto_ini = utaupy.otoini.load(str(temp_dir / "oto.ini"))
-            wav_files = list(temp_dir.glob("*.wav"))
-            with tqdm.tqdm(total=len(wav_files)) as pbar:
-                for wav_file in wav_files:
-                    otos: list[utaupy.otoini.Oto] = remove_duplicate_otos(
-                        list(filter(lambda oto: oto.filename == wav_file.name, oto_ini))
-                    )
-                    sorted_otos = sorted(otos, key=lambda oto: oto.offset)
-                    if any(
-                        [
-                            len(pyopenjtalk.g2p(oto.alias.split()[1], join=False)) > 2
-                            for oto in sorted_otos
-                            if oto.alias.split()[1] != "-"
-                        ]
-                    ):
-                        wav_file.unlink()
-                        pbar.update(1)
-                        continue
-                    y, sr = librosa.load(wav_file, sr=None)
-                    duration_seconds = librosa.get_duration(y=y, sr=sr)
-                    tg = textgrid.TextGrid()
-                    grapheme_tier = textgrid.IntervalTier(
-                        name="graphemes", minTime=0, maxTime=duration_seconds
-                    )
-                    phoneme_tier = textgrid.IntervalTier(
-                        name="phonemes", minTime=0, maxTime=duration_seconds
-                    )
-                    for i, oto in enumerate(sorted_otos[:-1]):
-                        splitted_alias = oto.alias.split()
-                        next_splitted_alias = sorted_otos[i + 1].alias.split()
-                        phs = (
-                            pyopenjtalk.g2p(splitted_alias[1], join=False)
-                            if splitted_alias[1] != "-"
-                            else []
-                        )
-                        next_phs = (
-                            pyopenjtalk.g2p(next_splitted_alias[1], join=False)
-                            if next_splitted_alias[1] != "-"
-                            else []
-                        )
-                        if i == 0:
-                            if len(next_phs) == 0:
-                                if len(phs) == 1:
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = "SP"
-                                    # phoneme.start = 0
-                                    # phoneme.end = (oto.offset + oto.preutterance) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[0]
-                                    # phoneme.start = (oto.offset + oto.preutterance) * 1000
-                                    # phoneme.end = (otos[i + 1].offset + otos[i + 1].preutterance) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = "SP"
-                                    # phoneme.start = (otos[i + 1].offset + otos[i + 1].preutterance) * 1000
-                                    # phoneme.end = audio_length
-                                    # label.append(phoneme)
-                                    grapheme_tier.add(
-                                        0,
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        "AP",
-                                    )
-                                    grapheme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        duration_seconds,
-                                        splitted_alias[1],
-                                    )
-                                    grapheme_tier.add(
-                                        0,
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        "SP",
-                                    )
-                                    phoneme_tier.add(
-                                        0,
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        "AP",
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        phs[0],
-                                    )
-                                    phoneme_tier.add(
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        duration_seconds,
-                                        "SP",
-                                    )
-                                elif len(phs) == 2:
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = "SP"
-                                    # phoneme.start = 0
-                                    # phoneme.end = (oto.offset + oto.overlap) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[0]
-                                    # phoneme.start = (oto.offset + oto.overlap) * 1000
-                                    # phoneme.end = (oto.offset + oto.preutterance) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[1]
-                                    # phoneme.start = (oto.offset + oto.preutterance) * 1000
-                                    # phoneme.end = (otos[i + 1].offset + otos[i + 1].preutterance) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = "SP"
-                                    # phoneme.start = (otos[i + 1].offset + otos[i + 1].preutterance) * 1000
-                                    # phoneme.end = audio_length
-                                    # label.append(phoneme)
-                                    grapheme_tier.add(
-                                        0,
-                                        (oto.offset + oto.overlap) / 1000,
-                                        "AP",
-                                    )
-                                    grapheme_tier.add(
-                                        (oto.offset + oto.overlap) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        splitted_alias[1],
-                                    )
-                                    grapheme_tier.add(
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        duration_seconds,
-                                        "SP",
-                                    )
-                                    phoneme_tier.add(
-                                        0,
-                                        (oto.offset + oto.overlap) / 1000,
-                                        "AP",
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.overlap) / 1000,
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        phs[0],
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        phs[1],
-                                    )
-                                    phoneme_tier.add(
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        duration_seconds,
-                                        "SP",
-                                    )
-                                else:
-                                    raise ValueError("Invalid phoneme length.")
-                            elif len(next_phs) == 1:
-                                if len(phs) == 1:
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = "SP"
-                                    # phoneme.start = 0
-                                    # phoneme.end = (oto.offset + oto.preutterance) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[0]
-                                    # phoneme.start = (oto.offset + oto.preutterance) * 1000
-                                    # phoneme.end = (otos[i + 1].offset + otos[i + 1].preutterance) * 1000
-                                    # label.append(phoneme)
-                                    grapheme_tier.add(
-                                        0,
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        "AP",
-                                    )
-                                    grapheme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        splitted_alias[1],
-                                    )
-                                    phoneme_tier.add(
-                                        0,
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        "AP",
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        phs[0],
-                                    )
-                                elif len(phs) == 2:
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = "SP"
-                                    # phoneme.start = 0
-                                    # phoneme.end = (oto.offset + oto.overlap) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[0]
-                                    # phoneme.start = (oto.offset + oto.overlap) * 1000
-                                    # phoneme.end = (oto.offset + oto.preutterance) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[1]
-                                    # phoneme.start = (oto.offset + oto.preutterance) * 1000
-                                    # phoneme.end = (otos[i + 1].offset + otos[i + 1].preutterance) * 1000
-                                    # label.append(phoneme)
-                                    grapheme_tier.add(
-                                        0,
-                                        (oto.offset + oto.overlap) / 1000,
-                                        "AP",
-                                    )
-                                    grapheme_tier.add(
-                                        (oto.offset + oto.overlap) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        splitted_alias[1],
-                                    )
-                                    phoneme_tier.add(
-                                        0,
-                                        (oto.offset + oto.overlap) / 1000,
-                                        "AP",
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.overlap) / 1000,
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        phs[0],
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        phs[1],
-                                    )
-                                else:
-                                    raise ValueError("Invalid phoneme length.")
-                            elif len(next_phs) == 2:
-                                if len(phs) == 1:
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = "SP"
-                                    # phoneme.start = 0
-                                    # phoneme.end = (oto.offset + oto.preutterance) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[0]
-                                    # phoneme.start = (oto.offset + oto.preutterance) * 1000
-                                    # phoneme.end = (otos[i + 1].offset + otos[i + 1].overlap) * 1000
-                                    # label.append(phoneme)
-                                    grapheme_tier.add(
-                                        0,
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        "AP",
-                                    )
-                                    grapheme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].overlap)
-                                        / 1000,
-                                        splitted_alias[1],
-                                    )
-                                    phoneme_tier.add(
-                                        0,
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        "AP",
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].overlap)
-                                        / 1000,
-                                        phs[0],
-                                    )
-                                elif len(phs) == 2:
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = "SP"
-                                    # phoneme.start = 0
-                                    # phoneme.end = (oto.offset + oto.overlap) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[0]
-                                    # phoneme.start = (oto.offset + oto.overlap) * 1000
-                                    # phoneme.end = (oto.offset + oto.preutterance) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[1]
-                                    # phoneme.start = (oto.offset + oto.preutterance) * 1000
-                                    # phoneme.end = (otos[i + 1].offset + otos[i + 1].overlap) * 1000
-                                    # label.append(phoneme)
-                                    grapheme_tier.add(
-                                        0,
-                                        (oto.offset + oto.overlap) / 1000,
-                                        "AP",
-                                    )
-                                    grapheme_tier.add(
-                                        (oto.offset + oto.overlap) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].overlap)
-                                        / 1000,
-                                        splitted_alias[1],
-                                    )
-                                    phoneme_tier.add(
-                                        0,
-                                        (oto.offset + oto.overlap) / 1000,
-                                        "AP",
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.overlap) / 1000,
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        phs[0],
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].overlap)
-                                        / 1000,
-                                        phs[1],
-                                    )
-                                else:
-                                    raise ValueError("Invalid phoneme length.")
-                            else:
-                                raise ValueError("Invalid phoneme length.")
-                        else:
-                            if len(next_phs) == 0:
-                                if len(phs) == 1:
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[0]
-                                    # phoneme.start = (oto.offset + oto.preutterance) * 1000
-                                    # phoneme.end = (otos[i + 1].offset + otos[i + 1].preutterance) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = "SP"
-                                    # phoneme.start = (otos[i + 1].offset + otos[i + 1].preutterance) * 1000
-                                    # phoneme.end = audio_length
-                                    # label.append(phoneme)
-                                    grapheme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        splitted_alias[1],
-                                    )
-                                    grapheme_tier.add(
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        duration_seconds,
-                                        "SP",
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        phs[0],
-                                    )
-                                    phoneme_tier.add(
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        duration_seconds,
-                                        "SP",
-                                    )
-                                elif len(phs) == 2:
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[0]
-                                    # phoneme.start = (oto.offset + oto.overlap) * 1000
-                                    # phoneme.end = (oto.offset + oto.preutterance) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[1]
-                                    # phoneme.start = (oto.offset + oto.preutterance) * 1000
-                                    # phoneme.end = (otos[i + 1].offset + otos[i + 1].preutterance) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = "SP"
-                                    # phoneme.start = (otos[i + 1].offset + otos[i + 1].preutterance) * 1000
-                                    # phoneme.end = audio_length
-                                    # label.append(phoneme)
-                                    grapheme_tier.add(
-                                        (oto.offset + oto.overlap) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        splitted_alias[1],
-                                    )
-                                    grapheme_tier.add(
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        duration_seconds,
-                                        "SP",
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.overlap) / 1000,
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        phs[0],
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        phs[1],
-                                    )
-                                    phoneme_tier.add(
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        duration_seconds,
-                                        "SP",
-                                    )
-                                else:
-                                    raise ValueError("Invalid phoneme length.")
-                            elif len(next_phs) == 1:
-                                if len(phs) == 1:
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[0]
-                                    # phoneme.start = (oto.offset + oto.preutterance) * 1000
-                                    # phoneme.end = (otos[i + 1].offset + otos[i + 1].preutterance) * 1000
-                                    # label.append(phoneme)
-                                    grapheme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        splitted_alias[1],
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        phs[0],
-                                    )
-                                elif len(phs) == 2:
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[0]
-                                    # phoneme.start = (oto.offset + oto.overlap) * 1000
-                                    # phoneme.end = (oto.offset + oto.preutterance) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[1]
-                                    # phoneme.start = (oto.offset + oto.preutterance) * 1000
-                                    # phoneme.end = (otos[i + 1].offset + otos[i + 1].preutterance) * 1000
-                                    # label.append(phoneme)
-                                    grapheme_tier.add(
-                                        (oto.offset + oto.overlap) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        splitted_alias[1],
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.overlap) / 1000,
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        phs[0],
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].preutterance)
-                                        / 1000,
-                                        phs[1],
-                                    )
-                                else:
-                                    raise ValueError("Invalid phoneme length.")
-                            elif len(next_phs) == 2:
-                                if len(phs) == 1:
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[0]
-                                    # phoneme.start = (oto.offset + oto.preutterance) * 1000
-                                    # phoneme.end = (otos[i + 1].offset + otos[i + 1].overlap) * 1000
-                                    # label.append(phoneme)
-                                    grapheme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].overlap)
-                                        / 1000,
-                                        splitted_alias[1],
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].overlap)
-                                        / 1000,
-                                        phs[0],
-                                    )
-                                elif len(phs) == 2:
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[0]
-                                    # phoneme.start = (oto.offset + oto.overlap) * 1000
-                                    # phoneme.end = (oto.offset + oto.preutterance) * 1000
-                                    # label.append(phoneme)
-                                    # phoneme = utaupy.label.Phoneme()
-                                    # phoneme.symbol = phs[1]
-                                    # phoneme.start = (oto.offset + oto.preutterance) * 1000
-                                    # phoneme.end = (otos[i + 1].offset + otos[i + 1].overlap) * 1000
-                                    # label.append(phoneme)
-                                    grapheme_tier.add(
-                                        (oto.offset + oto.overlap) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].overlap)
-                                        / 1000,
-                                        splitted_alias[1],
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.overlap) / 1000,
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        phs[0],
-                                    )
-                                    phoneme_tier.add(
-                                        (oto.offset + oto.preutterance) / 1000,
-                                        (otos[i + 1].offset + otos[i + 1].overlap)
-                                        / 1000,
-                                        phs[1],
-                                    )
-                                else:
-                                    raise ValueError("Invalid phoneme length.")
-                            else:
-                                raise ValueError("Invalid phoneme length.")
-                    tg.append(grapheme_tier)
-                    tg.append(phoneme_tier)
-                    tg.write(str(textgrid_dir / f"{wav_file.stem}.TextGrid"))
-                    pbar.update(1)
 
-            print()
-            print("Phase 3: Done.")
-            print()
+def convert(
+    job: dict,
+    shared_options: dict,
+    resume: bool,
+    profile_stages: list[str],
+    profiler: str,
+    overwrite: bool = False,
+):
+    """
+    Run one conversion. `shared_options` holds the `ConversionOptions` fields that are the same for every job.
 
-            if normalize_flag:
-                print("Phase 3-1: Normalizing volume...")
-                print()
-
-                wav_files = list(temp_dir.glob("*.wav"))
-                with tqdm.tqdm(total=len(wav_files)) as pbar:
-                    for wav_file in wav_files:
-                        y, sr = librosa.load(wav_file, sr=None)
-                        y = librosa.util.normalize(y)
-                        soundfile.write(wav_file, y, sr)
-                        pbar.update(1)
-
-                print()
-                print("Phase 3-1: Done.")
-                print()
-        else:
-            print("Invalid forced aligner.")
-            sys.exit(1)
-        print("Phase 4: Build dataset...")
-        print()
+    The output directory is checked before any stage runs; with `overwrite`
+    an existing one is replaced once the conversion has finished.
+    """
+    import dataclasses
 
-        ctx = click.Context(build_dataset)
-        with ctx:
-            build_dataset.parse_args(
-                ctx,
-                [
-                    "--wavs",
-                    str(temp_dir),
-                    "--tg",
-                    str(temp_dir / "TextGrid"),
-                    "--dataset",
-                    str(temp_dir / "Dataset"),
-                ],
-            )
-            build_dataset.invoke(ctx)
+    from stages import ConversionOptions, build_stages, export_dataset
 
+    voicebank_dirs = [
+        pathlib.Path(voicebank_dir) for voicebank_dir in job["voicebanks"]
+    ]
+    forced_aligner = ALIGNERS[job["aligner"]]
+    options = ConversionOptions(
+        forced_aligner=forced_aligner,
+        normalize=bool(job["normalize"]),
+        # Trimming would shift the audio against the timings in oto.ini
+        trim=bool(job["trim"]) and forced_aligner == "SOFA",
+        trim_top_db=job["trim_top_db"],
+        sample_rate=job["sample_rate"],
+        oto_tolerance=job["oto_tolerance"],
+        batch_frames=job["batch_frames"],
+        **shared_options,
+    )
+    work_dir = job["work_dir"]
+    if work_dir is None:
+        work_dir = default_work_dir(voicebank_dirs, forced_aligner)
+    started_at = datetime.datetime.now()
+    output_path = job["output"]
+    if output_path is None:
         outputs_path = pathlib.Path("src/outputs")
-        output_path = outputs_path / datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-        output_path.mkdir()
-        shutil.move(temp_dir / "Dataset" / "transcriptions.csv", output_path)
-        shutil.move(temp_dir / "Dataset" / "wavs", output_path)
-        output_wavs_path = output_path / "wavs"
-
-    print()
-    print("Phase 4: Done.")
-    print()
-    print("Phase 5: Add phoneme number...")
+        output_path = outputs_path / started_at.strftime("%Y%m%d%H%M%S")
+    output_path = pathlib.Path(output_path)
+    check_output_path(output_path, overwrite)
+    print(f"Work directory: {work_dir}")
     print()
 
-    ctx = click.Context(add_ph_num)
-    with ctx:
-        add_ph_num.parse_args(
-            ctx,
-            [
-                str(output_path / "transcriptions.csv"),
-                "--dictionary",
-                "src/dictionaries/japanese-extension-sofa.txt",
-            ],
+    recorder.reset()
+    recorder.configure_profiling(
+        profile_stages, profiler, pathlib.Path(work_dir) / "profiles"
+    )
+    start_wall = time.perf_counter()
+    start_cpu = cpu_seconds()
+    shard_reports = []
+    if options.shard_workers > 0:
+        from shards import run_shards
+
+        print(
+            f"Converting {len(voicebank_dirs)} voicebank(s) in {options.shard_workers} worker(s)..."
         )
-        add_ph_num.invoke(ctx)
-
-    print()
-    print("Phase 5: Done.")
+        with recorder.step("Shards"):
+            shard_reports = run_shards(
+                voicebank_dirs,
+                pathlib.Path(work_dir),
+                options,
+                resume,
+                profile_stages,
+                profiler,
+            )
+        print()
+    else:
+        pipeline = Pipeline(pathlib.Path(work_dir), resume=resume)
+        for stage in build_stages(voicebank_dirs, options, pipeline):
+            pipeline.run(stage)
+
+    if output_path.exists():
+        shutil.rmtree(output_path)
+    with recorder.step("Export"):
+        if shard_reports:
+            from shards import merge_shard_outputs
+            from staging import Stager
+
+            stager = Stager(options.staging)
+            merge_shard_outputs(
+                [pathlib.Path(report["output"]) for report in shard_reports],
+                output_path,
+                stager,
+            )
+            print(stager.stats())
+        else:
+            export_dataset(pipeline, output_path, options)
+
+    profiles = [(step.profile, output_path / "profiles") for step in recorder.steps]
+    for report in shard_reports:
+        profiles.extend(
+            (
+                step["profile"],
+                output_path / "profiles" / pathlib.Path(report["work_dir"]).name,
+            )
+            for step in report["steps"]
+        )
+    for profile, profiles_path in profiles:
+        if profile is not None:
+            profiles_path.mkdir(parents=True, exist_ok=True)
+            shutil.copy(profile, profiles_path)
+    write_report(
+        output_path / "run_report.json",
+        {
+            "version": pyproject["project"]["version"],
+            "started_at": started_at.isoformat(timespec="seconds"),
+            "voicebanks": [str(voicebank_dir) for voicebank_dir in voicebank_dirs],
+            "work_dir": str(work_dir),
+            "options": dataclasses.asdict(options),
+            "wall_seconds": time.perf_counter() - start_wall,
+            "cpu_seconds": cpu_seconds() - start_cpu,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "steps": recorder.report(),
+            "shards": shard_reports,
+        },
+    )
+    print("Time per phase:")
+    print(recorder.summary())
     print()
-    print("Phase 6: Estimate MIDI...")
+    print(f"Output: {output_path}")
     print()
 
-    ctx = click.Context(estimate_midi)
-    with ctx:
-        estimate_midi.parse_args(
-            ctx,
-            [
-                str(output_path / "transcriptions.csv"),
-                str(output_wavs_path),
-            ],
-        )
-        estimate_midi.invoke(ctx)
 
+@click.command()
+@click.version_option(version=pyproject["project"]["version"])
+@click.argument("voicebank_dir_strs", nargs=-1, callback=validate_directories)
+@click.option(
+    "--aligner",
+    type=click.Choice(list(ALIGNERS), case_sensitive=False),
+    default=None,
+    help="Forced aligner to use. Asked interactively if omitted.",
+)
+@click.option(
+    "--normalize/--no-normalize",
+    default=None,
+    help="Normalize the volume. Asked interactively if omitted.",
+)
+@click.option(
+    "--trim/--no-trim",
+    default=None,
+    help="Trim leading and trailing silence (SOFA only). Asked interactively if omitted.",
+)
+@click.option(
+    "--trim-top-db",
+    type=click.FloatRange(min=0, min_open=True),
+    default=30,
+    show_default=True,
+    help="Threshold in decibels below the peak that is considered silence when trimming.",
+)
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    default=None,
+    help="Directory to write the dataset to. Defaults to a timestamped directory under src/outputs.",
+)
+@click.option(
+    "--jobs",
+    "job_file",
+    type=click.Path(exists=True, dir_okay=False, path_type=pathlib.Path),
+    default=None,
+    help="TOML file listing several conversions as [[jobs]] tables; they run one after another in this process.",
+)
+@click.option(
+    "--workers",
+    "-j",
+    "num_workers",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    show_default=True,
+    help="Number of worker processes for audio preprocessing.",
+)
+@click.option(
+    "--sample-rate",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Resample the audio to this rate during preprocessing.",
+)
+@click.option(
+    "--oto-tolerance",
+    type=click.FloatRange(min=0),
+    default=0,
+    show_default=True,
+    help="Treat oto.ini entries whose timings differ by at most this many milliseconds as duplicates.",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    default="src/cache",
+    show_default=True,
+    help="Directory for caches that are reused across runs.",
+)
+@click.option(
+    "--batch-frames",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Align utterances of similar length together in padded SOFA batches of at most this many frames. 0 aligns one utterance at a time.",
+)
+@click.option(
+    "--cache-size",
+    type=click.IntRange(min=0),
+    default=1024,
+    show_default=True,
+    help="Maximum size of the alignment cache in MiB.",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Do not read or write the caches in --cache-dir.",
+)
+@click.option(
+    "--staging",
+    type=click.Choice(["link", "copy"]),
+    default="link",
+    show_default=True,
+    help="How audio is placed into the work and output directories. 'link' uses hardlinks, reflinks or symlinks where possible and copies only audio that may be modified; 'copy' always copies.",
+)
+@click.option(
+    "--dedup",
+    type=click.Choice(["off", "bytes", "pcm"]),
+    default="off",
+    show_default=True,
+    help="Process recordings that appear with the same name and content in several voicebanks only once. 'pcm' compares the decoded audio, ignoring header differences.",
+)
+@click.option(
+    "--expand-duplicates",
+    is_flag=True,
+    help="Re-create the dataset items of deduplicated recordings in the output by hardlink instead of listing them in duplicates.json.",
+)
+@click.option(
+    "--textgrid-format",
+    type=click.Choice(["files", "bundle"]),
+    default="files",
+    show_default=True,
+    help="How alignments are passed to the dataset build. 'files' writes one TextGrid per recording; 'bundle' writes them all to one TextGrid.jsonl file.",
+)
+@click.option(
+    "--shard-workers",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Convert each voicebank independently in a pool of this many processes and merge the results in argument order. --workers and --ap-workers are divided between them. 0 converts all voicebanks together in this process.",
+)
+@click.option(
+    "--shard-memory",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Memory limit in MiB applied separately to each --shard-workers process and to each process it starts (preprocessing workers, tools). 0 means no limit.",
+)
+@click.option(
+    "--model-precision",
+    type=click.Choice(PRECISIONS),
+    default="fp32",
+    show_default=True,
+    help="Weights of the SOFA model. 'int8' quantizes the linear layers for faster CPU inference and caches them next to the checkpoint.",
+)
+@click.option(
+    "--torch-threads",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Threads torch uses within an operator during SOFA alignment. 0 uses the torch default, or splits the cores between --shard-workers.",
+)
+@click.option(
+    "--torch-interop-threads",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Threads torch uses to run independent operators in parallel. 0 uses the torch default.",
+)
+@click.option(
+    "--ap-workers",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Worker processes that detect breaths (AP) in the SOFA alignments. 0 detects them in this process.",
+)
+@click.option(
+    "--moresampler-archive",
+    default=None,
+    help="Local archive path or URL of Moresampler to use instead of downloading it from BOWLROLL.",
+)
+@click.option(
+    "--moresampler-sha256",
+    default=None,
+    help="Expected SHA-256 of the Moresampler archive.",
+)
+@click.option(
+    "--profile",
+    "profile_stages",
+    type=click.Choice(STAGE_NAMES),
+    multiple=True,
+    help="Profile this stage and save the result in the output directory. Can be given more than once.",
+)
+@click.option(
+    "--profiler",
+    type=click.Choice(PROFILERS),
+    default="cprofile",
+    show_default=True,
+    help="Profiler for --profile. pyinstrument must be installed separately.",
+)
+@click.option(
+    "--work-dir",
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    default=None,
+    help="Persistent directory for intermediate files. Defaults to a directory under src/work derived from the voicebank paths.",
+)
+@click.option(
+    "--overwrite",
+    is_flag=True,
+    help="Replace output directories that already exist once their conversion has finished. Without it, an existing output directory is an error before anything runs.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Skip stages whose inputs are unchanged since the last run in the work directory.",
+)
+def main(
+    voicebank_dir_strs: list[str],
+    aligner: str | None,
+    normalize: bool | None,
+    trim: bool | None,
+    trim_top_db: float,
+    output: pathlib.Path | None,
+    job_file: pathlib.Path | None,
+    num_workers: int,
+    sample_rate: int | None,
+    oto_tolerance: float,
+    cache_dir: pathlib.Path,
+    batch_frames: int,
+    cache_size: int,
+    no_cache: bool,
+    staging: str,
+    dedup: str,
+    expand_duplicates: bool,
+    textgrid_format: str,
+    shard_workers: int,
+    shard_memory: int,
+    model_precision: str,
+    torch_threads: int,
+    torch_interop_threads: int,
+    ap_workers: int,
+    moresampler_archive: str | None,
+    moresampler_sha256: str | None,
+    profile_stages: tuple[str, ...],
+    profiler: str,
+    work_dir: pathlib.Path | None,
+    overwrite: bool,
+    resume: bool,
+):
+    print(
+        f"Voicebank to DiffSinger {pyproject['project']['version']} - Convert the UTAU Voicebank to a configuration compatible with DiffSinger Dataset"
+    )
     print()
-    print("Phase 6: Done.")
-    print()
-    print("Phase 7: Convert CSV to DiffSinger...")
-    print()
-
-    ctx = click.Context(csv2ds)
-    with ctx:
-        csv2ds.parse_args(
-            ctx,
-            [
-                str(output_path / "transcriptions.csv"),
-                str(output_wavs_path),
-            ],
+    defaults = {
+        "output": output,
+        "work_dir": work_dir,
+        "aligner": aligner.lower() if aligner is not None else None,
+        "normalize": normalize,
+        "trim": trim,
+        "trim_top_db": trim_top_db,
+        "sample_rate": sample_rate,
+        "oto_tolerance": oto_tolerance,
+        "batch_frames": batch_frames,
+    }
+    if shard_workers > 0 and dedup != "off":
+        raise click.UsageError(
+            "--dedup compares recordings across voicebanks and cannot be used with --shard-workers."
+        )
+    interactive = False
+    if job_file is not None:
+        if voicebank_dir_strs:
+            raise click.UsageError("Pass voicebank directories or --jobs, not both.")
+        jobs = load_jobs(job_file, defaults)
+        # Fail before any job runs rather than after the first has converted everything
+        for job in jobs:
+            check_output_path(job["output"], overwrite)
+    else:
+        if not voicebank_dir_strs:
+            raise click.UsageError("At least one directory path must be specified.")
+        job = {**defaults, "voicebanks": list(voicebank_dir_strs)}
+        check_output_path(job["output"], overwrite)
+        interactive = (
+            job["aligner"] is None
+            or job["normalize"] is None
+            or (job["trim"] is None and job["aligner"] != "moresampler")
         )
-        csv2ds.invoke(ctx)
+        if interactive:
+            prompt_missing_options(job)
+        jobs = [job]
+
+    if not no_cache:
+        from g2p import g2p_cache
+
+        g2p_cache.load(cache_dir / "g2p.json")
+
+    shared_options = {
+        "num_workers": num_workers,
+        "cache_dir": None if no_cache else cache_dir,
+        "cache_size": cache_size,
+        # Provisioned tools are not results, so --no-cache does not affect them
+        "tools_dir": cache_dir / "tools",
+        "moresampler_archive": moresampler_archive,
+        "moresampler_sha256": moresampler_sha256,
+        "staging": staging,
+        "dedup": dedup,
+        "expand_duplicates": expand_duplicates,
+        "textgrid_format": textgrid_format,
+        "shard_workers": shard_workers,
+        "shard_memory": shard_memory,
+        "torch_threads": torch_threads,
+        "torch_interop_threads": torch_interop_threads,
+        "model_precision": model_precision,
+        "ap_workers": ap_workers,
+    }
+    failed_jobs = []
+    for index, job in enumerate(jobs):
+        if len(jobs) > 1:
+            print(
+                f"Job {index + 1}/{len(jobs)} ({job['name']}): {', '.join(map(str, job['voicebanks']))}"
+            )
+            print()
+        try:
+            convert(
+                job,
+                shared_options,
+                resume,
+                list(profile_stages),
+                profiler,
+                overwrite,
+            )
+        except Exception:
+            # One broken voicebank set should not stop the rest of the batch
+            if len(jobs) == 1:
+                raise
+            traceback.print_exc()
+            print()
+            failed_jobs.append(job["name"])
 
-    print()
-    print("Phase 7: Done.")
-    print()
-    input("Press Enter to exit...")
+    if failed_jobs:
+        print(
+            f"{len(failed_jobs)} of {len(jobs)} job(s) failed: {', '.join(failed_jobs)}"
+        )
+        sys.exit(1)
+    if interactive:
+        input("Press Enter to exit...")
 
 
 if __name__ == "__main__":
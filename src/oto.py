@@ -0,0 +1,308 @@
+import numpy as np
+import textgrid
+import utaupy
+
+from g2p import g2p_cache
+from oto_table import OtoTable
+
+
+def is_convertible(table: OtoTable, rows: np.ndarray) -> bool:
+    """
+    Whether every alias among `rows` has a second field that maps to at most two phonemes.
+    """
+    graphemes = {
+        table.alias_graphemes[alias] for alias in table.entries["alias"][rows].tolist()
+    }
+    return all(
+        grapheme is not None and (grapheme == "-" or len(g2p_cache(grapheme)) <= 2)
+        for grapheme in graphemes
+    )
+
+
+INTERVAL_DTYPE = np.dtype([("start", "f8"), ("end", "f8"), ("mark", "O")])
+TIERS = ("graphemes", "phonemes")
+
+# Intervals added for each entry but the last of a file, in the order the
+# original branch tree added them: (tier, mark, start, end, condition).
+# Boundaries are in seconds: "zero" and "end" are the ends of the file,
+# "start" is where the entry's first phoneme begins (offset + overlap with two
+# phonemes, offset + preutterance with one), "middle" is offset + preutterance,
+# and "next" is "start" of the following entry. "before_rest" holds when the
+# following entry is a rest ("-").
+INTERVAL_RULES = [
+    ("graphemes", "AP", "zero", "start", "first"),
+    ("graphemes", "grapheme", "start", "next", "always"),
+    ("graphemes", "SP", "next", "end", "before_rest"),
+    ("phonemes", "AP", "zero", "start", "first"),
+    ("phonemes", "first_phoneme", "start", "middle", "two_phonemes"),
+    ("phonemes", "last_phoneme", "middle", "next", "always"),
+    ("phonemes", "SP", "next", "end", "before_rest"),
+]
+
+OTO_DTYPE = np.dtype(
+    [
+        ("file", "i8"),
+        ("offset", "f8"),
+        ("preutterance", "f8"),
+        ("overlap", "f8"),
+        # Timings of the entry at the same position in oto.ini order, which the
+        # original used for the following entry (`otos[i + 1]`)
+        ("listed_offset", "f8"),
+        ("listed_preutterance", "f8"),
+        ("listed_overlap", "f8"),
+        ("num_phonemes", "i8"),
+        # Indices into the symbol list returned with the table
+        ("grapheme", "i8"),
+        ("first_phoneme", "i8"),
+        ("last_phoneme", "i8"),
+    ]
+)
+
+
+def load_oto_table(
+    table: OtoTable, files: list[tuple[np.ndarray, float]]
+) -> tuple[np.ndarray, list[str]]:
+    """
+    Load the entries of the files that have at least two into one structured array, sorted by offset within each file.
+
+    Graphemes and phonemes are stored as indices into the returned symbol
+    list, which starts with "AP" and "SP". An alias without a second field has
+    -1 phonemes.
+    """
+    kept = [
+        (file_index, rows)
+        for file_index, (rows, _) in enumerate(files)
+        if len(rows) >= 2
+    ]
+    listed_rows = np.concatenate(
+        [rows for _, rows in kept] or [np.empty(0, dtype=np.intp)]
+    )
+    file_indices = np.repeat(
+        [file_index for file_index, _ in kept], [len(rows) for _, rows in kept]
+    ).astype("i8")
+    # lexsort is stable, like the sorted() of the original
+    sorted_rows = listed_rows[
+        np.lexsort((table.entries["offset"][listed_rows], file_indices))
+    ]
+
+    symbols = {"AP": 0, "SP": 1}
+    # One G2P lookup per distinct alias instead of two per entry
+    alias_rows = np.full((len(table.aliases), 4), -1, dtype="i8")
+    for alias in np.unique(table.entries["alias"][sorted_rows]).tolist():
+        grapheme = table.alias_graphemes[alias]
+        if grapheme is None:
+            continue
+        phs = g2p_cache(grapheme) if grapheme != "-" else []
+        alias_rows[alias] = (
+            len(phs),
+            symbols.setdefault(grapheme, len(symbols)),
+            symbols.setdefault(phs[0], len(symbols)) if phs else -1,
+            symbols.setdefault(phs[-1], len(symbols)) if phs else -1,
+        )
+    sorted_entries = table.entries[sorted_rows]
+    listed_entries = table.entries[listed_rows]
+    alias_table = alias_rows[sorted_entries["alias"]]
+
+    oto_table = np.empty(len(sorted_rows), dtype=OTO_DTYPE)
+    oto_table["file"] = file_indices
+    oto_table["offset"] = sorted_entries["offset"]
+    oto_table["preutterance"] = sorted_entries["preutterance"]
+    oto_table["overlap"] = sorted_entries["overlap"]
+    oto_table["listed_offset"] = listed_entries["offset"]
+    oto_table["listed_preutterance"] = listed_entries["preutterance"]
+    oto_table["listed_overlap"] = listed_entries["overlap"]
+    oto_table["num_phonemes"] = alias_table[:, 0]
+    oto_table["grapheme"] = alias_table[:, 1]
+    oto_table["first_phoneme"] = alias_table[:, 2]
+    oto_table["last_phoneme"] = alias_table[:, 3]
+    return oto_table, list(symbols)
+
+
+def build_intervals(
+    oto_table: OtoTable, files: list[tuple[np.ndarray, float]]
+) -> list[dict[str, np.ndarray] | None]:
+    """
+    Compute the grapheme and phoneme intervals of many files at once.
+
+    The boundaries of all entries are computed in vectorized form and the
+    intervals are emitted by `INTERVAL_RULES`, matching the output of the
+    original per-entry branch tree. Files for which it raised (an alias with
+    no or more than two phonemes or without a second field, a first entry with one phoneme followed by a
+    rest, or intervals that are empty, outside the file or overlapping) get
+    None. Unlike `textgrid.IntervalTier.add`, which only notices overlaps with
+    the intervals its binary search happens to compare against, every overlap
+    is rejected.
+
+    Args:
+        oto_table (OtoTable): The oto.ini
+        files (list[tuple[np.ndarray, float]]): Rows of the deduplicated entries of each file in oto.ini order, and the length of the file
+
+    Returns:
+        list[dict[str, np.ndarray] | None]: Intervals (`INTERVAL_DTYPE`, sorted by time) by tier name for each file
+    """
+    table, symbols = load_oto_table(oto_table, files)
+    durations = np.array([duration for _, duration in files], dtype="f8")
+    file = table["file"]
+    # Every entry but the last of its file starts a pair with the following one
+    current = np.flatnonzero(file[:-1] == file[1:])
+    following = current + 1
+    segment_file = file[current]
+    num_phonemes = table["num_phonemes"][current]
+    next_num_phonemes = table["num_phonemes"][following]
+    is_first = np.ones(len(current), dtype=bool)
+    is_first[1:] = segment_file[1:] != segment_file[:-1]
+
+    invalid = (
+        ((num_phonemes != 1) & (num_phonemes != 2))
+        | (next_num_phonemes < 0)
+        | (next_num_phonemes > 2)
+        | (is_first & (next_num_phonemes == 0) & (num_phonemes == 1))
+    )
+    offset = table["offset"][current]
+    boundaries = {
+        "zero": np.zeros(len(current)),
+        "start": (
+            offset
+            + np.where(
+                num_phonemes == 2,
+                table["overlap"][current],
+                table["preutterance"][current],
+            )
+        )
+        / 1000,
+        "middle": (offset + table["preutterance"][current]) / 1000,
+        "next": (
+            table["listed_offset"][following]
+            + np.where(
+                next_num_phonemes == 2,
+                table["listed_overlap"][following],
+                table["listed_preutterance"][following],
+            )
+        )
+        / 1000,
+        "end": durations[segment_file],
+    }
+    conditions = {
+        "first": is_first,
+        "always": np.ones(len(current), dtype=bool),
+        "before_rest": next_num_phonemes == 0,
+        "two_phonemes": num_phonemes == 2,
+    }
+    marks = {
+        "AP": np.zeros(len(current), dtype="i8"),
+        "SP": np.ones(len(current), dtype="i8"),
+        "grapheme": table["grapheme"][current],
+        "first_phoneme": table["first_phoneme"][current],
+        "last_phoneme": table["last_phoneme"][current],
+    }
+    symbol_array = np.array(symbols, dtype=object)
+
+    invalid_files = set(segment_file[invalid].tolist())
+    tier_rows = {}
+    for tier in TIERS:
+        columns = {"file": [], "start": [], "end": [], "mark": []}
+        for name, mark, start, end, condition in INTERVAL_RULES:
+            if name != tier:
+                continue
+            selected = conditions[condition]
+            columns["file"].append(segment_file[selected])
+            columns["start"].append(boundaries[start][selected])
+            columns["end"].append(boundaries[end][selected])
+            columns["mark"].append(marks[mark][selected])
+        row_file, starts, ends, mark_ids = (
+            np.concatenate(column) for column in columns.values()
+        )
+        order = np.lexsort((starts, row_file))
+        row_file = row_file[order]
+        rows = np.empty(len(order), dtype=INTERVAL_DTYPE)
+        rows["start"] = starts[order]
+        rows["end"] = ends[order]
+        rows["mark"] = symbol_array[mark_ids[order]]
+
+        row_duration = durations[row_file]
+        bad = (
+            (rows["start"] >= rows["end"])
+            | (rows["start"] < 0)
+            | ((row_duration != 0) & (rows["end"] > row_duration))
+        )
+        same_file = row_file[1:] == row_file[:-1]
+        overlapping = same_file & (rows["end"][:-1] > rows["start"][1:])
+        invalid_files.update(row_file[bad].tolist())
+        invalid_files.update(row_file[:-1][overlapping].tolist())
+        bounds = np.searchsorted(row_file, np.arange(len(files) + 1)).tolist()
+        tier_rows[tier] = (rows, bounds)
+
+    return [
+        None
+        if file_index in invalid_files
+        else {
+            tier: rows[bounds[file_index] : bounds[file_index + 1]]
+            for tier, (rows, bounds) in tier_rows.items()
+        }
+        for file_index in range(len(files))
+    ]
+
+
+def intervals_to_textgrid(
+    intervals: dict[str, np.ndarray], duration_seconds: float
+) -> textgrid.TextGrid:
+    """
+    Make a TextGrid from intervals returned by `build_intervals`.
+    """
+    tg = textgrid.TextGrid()
+    for name in TIERS:
+        tier = textgrid.IntervalTier(name=name, minTime=0, maxTime=duration_seconds)
+        # The intervals are sorted and checked, so the bisection of tier.add is not needed.
+        # A first interval starting at 0 keeps the integer 0 the original passed, which is written as "0".
+        tier.intervals = [
+            textgrid.Interval(start or 0, end, mark)
+            for start, end, mark in intervals[name].tolist()
+        ]
+        tg.append(tier)
+    return tg
+
+
+def intervals_to_data(
+    intervals: dict[str, np.ndarray], duration_seconds: float
+) -> dict:
+    """
+    Make TextGrid data (see `textgrids.read_textgrid`) from intervals returned by `build_intervals`.
+    """
+    # `textgrid.TextGrid` starts at 0.0, its tiers at the 0 passed to them
+    return {
+        "xmin": 0.0,
+        "xmax": duration_seconds,
+        "tiers": [
+            {
+                "name": name,
+                "xmin": 0,
+                "xmax": duration_seconds,
+                "intervals": [
+                    [start or 0, end, mark]
+                    for start, end, mark in intervals[name].tolist()
+                ],
+            }
+            for name in TIERS
+        ],
+    }
+
+
+def otos_to_textgrid(
+    otos: list[utaupy.otoini.Oto], duration_seconds: float
+) -> textgrid.TextGrid:
+    """
+    Convert the oto.ini entries of one file to a TextGrid with grapheme and phoneme tiers.
+
+    Args:
+        otos (list[utaupy.otoini.Oto]): Deduplicated entries of the file, in oto.ini order
+        duration_seconds (float): Length of the file
+
+    Returns:
+        textgrid.TextGrid: TextGrid with "graphemes" and "phonemes" tiers
+    """
+    intervals = build_intervals(
+        OtoTable.from_otos(otos), [(np.arange(len(otos)), duration_seconds)]
+    )[0]
+    if intervals is None:
+        raise ValueError(f"Invalid intervals for {otos[0].filename}.")
+    return intervals_to_textgrid(intervals, duration_seconds)
@@ -0,0 +1,182 @@
+import pathlib
+from typing import Iterable
+
+import numpy as np
+import utaupy
+
+from utils import unique_key_indices
+
+TIMING_FIELDS = ("offset", "consonant", "cutoff", "preutterance", "overlap")
+ENTRY_DTYPE = np.dtype(
+    [("filename", "i4"), ("alias", "i4"), *((name, "f8") for name in TIMING_FIELDS)]
+)
+
+
+def decode_oto_ini(data: bytes) -> str:
+    """
+    Decode an oto.ini as UTF-8 (with or without BOM) where it is valid, and as cp932 otherwise.
+    """
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("cp932")
+
+
+def intern(values: Iterable[str], vocabulary: dict[str, int]) -> list[int]:
+    return [vocabulary.setdefault(value, len(vocabulary)) for value in values]
+
+
+class OtoTable:
+    """
+    oto.ini entries stored column-wise.
+
+    `entries` is a structured array (`ENTRY_DTYPE`) with the timings in
+    milliseconds. File names and aliases are interned: `entries["filename"]`
+    and `entries["alias"]` index `filenames` and `aliases`, so renaming a file
+    only touches the vocabulary. `alias_graphemes[i]` is the second
+    whitespace-separated field of `aliases[i]` ("か" for "a か"), or None when
+    there is none.
+    """
+
+    def __init__(self, entries: np.ndarray, filenames: list[str], aliases: list[str]):
+        self.entries = entries
+        self.filenames = filenames
+        self.aliases = aliases
+        self.alias_graphemes = [
+            fields[1] if len(fields) > 1 else None
+            for fields in (alias.split() for alias in aliases)
+        ]
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def from_otos(cls, otos: Iterable[utaupy.otoini.Oto]) -> "OtoTable":
+        otos = list(otos)
+        filenames: dict[str, int] = {}
+        aliases: dict[str, int] = {}
+        entries = np.empty(len(otos), dtype=ENTRY_DTYPE)
+        entries["filename"] = intern((oto.filename for oto in otos), filenames)
+        entries["alias"] = intern((oto.alias for oto in otos), aliases)
+        for name in TIMING_FIELDS:
+            entries[name] = [getattr(oto, name) for oto in otos]
+        return cls(entries, list(filenames), list(aliases))
+
+    @classmethod
+    def read(cls, path: pathlib.Path, encoding: str | None = None) -> "OtoTable":
+        """
+        Read an oto.ini. Without `encoding`, UTF-8 and cp932 are detected.
+        """
+        data = pathlib.Path(path).read_bytes()
+        text = decode_oto_ini(data) if encoding is None else data.decode(encoding)
+        rows = []
+        for line_number, line in enumerate(text.splitlines(), 1):
+            line = line.strip()
+            if not line:
+                continue
+            # Every line is `<filename>=<alias>,<offset>,<consonant>,<cutoff>,<preutterance>,<overlap>`.
+            # The alias may contain "=" or "," itself, so the timings are split off from the right.
+            filename, separator, rest = line.partition("=")
+            fields = rest.rsplit(",", len(TIMING_FIELDS))
+            if not separator or len(fields) != 1 + len(TIMING_FIELDS):
+                raise ValueError(f"Invalid oto.ini entry in {path}:{line_number}")
+            rows.append((filename, *fields))
+        filenames: dict[str, int] = {}
+        aliases: dict[str, int] = {}
+        entries = np.empty(len(rows), dtype=ENTRY_DTYPE)
+        columns = list(zip(*rows)) or [()] * (2 + len(TIMING_FIELDS))
+        entries["filename"] = intern(columns[0], filenames)
+        entries["alias"] = intern(columns[1], aliases)
+        for column, name in enumerate(TIMING_FIELDS, 2):
+            entries[name] = np.array(columns[column], dtype="f8")
+        return cls(entries, list(filenames), list(aliases))
+
+    def write(self, path: pathlib.Path, encoding: str = "cp932"):
+        """
+        Write the entries in the format of `utaupy.otoini.OtoIni.write`.
+        """
+        columns = [
+            [
+                self.filenames[filename] + "="
+                for filename in self.entries["filename"].tolist()
+            ],
+            [self.aliases[alias] for alias in self.entries["alias"].tolist()],
+        ]
+        for name in TIMING_FIELDS:
+            # Timings repeat a lot, so each distinct value is formatted once
+            values, inverse = np.unique(self.entries[name], return_inverse=True)
+            formatted = [str(round(value, 4)) for value in values.tolist()]
+            columns.append([formatted[index] for index in inverse.tolist()])
+        lines = [filename + ",".join(fields) for filename, *fields in zip(*columns)]
+        with open(path, "w", encoding=encoding) as f:
+            f.write("\n".join(lines) + "\n")
+
+    def to_otos(self) -> list[utaupy.otoini.Oto]:
+        otos = []
+        for filename, alias, *timings in self.entries.tolist():
+            oto = utaupy.otoini.Oto()
+            oto.filename = self.filenames[filename]
+            oto.alias = self.aliases[alias]
+            for name, value in zip(TIMING_FIELDS, timings):
+                setattr(oto, name, value)
+            otos.append(oto)
+        return otos
+
+    def take(self, rows: np.ndarray) -> "OtoTable":
+        """
+        The entries at `rows`, sharing the vocabulary.
+        """
+        return OtoTable(self.entries[rows], self.filenames, self.aliases)
+
+    def rename_files(self, names: dict[str, str]) -> "OtoTable":
+        """
+        Rename the files in `names` (old name to new name). Files that end up with the same name are merged.
+        """
+        filenames: dict[str, int] = {}
+        new_ids = np.array(
+            intern((names.get(name, name) for name in self.filenames), filenames),
+            dtype="i4",
+        )
+        entries = self.entries.copy()
+        entries["filename"] = new_ids[entries["filename"]]
+        return OtoTable(entries, list(filenames), self.aliases)
+
+    @classmethod
+    def concatenate(cls, tables: list["OtoTable"]) -> "OtoTable":
+        filenames: dict[str, int] = {}
+        aliases: dict[str, int] = {}
+        parts = []
+        for table in tables:
+            entries = table.entries.copy()
+            entries["filename"] = np.array(
+                intern(table.filenames, filenames), dtype="i4"
+            )[entries["filename"]]
+            entries["alias"] = np.array(intern(table.aliases, aliases), dtype="i4")[
+                entries["alias"]
+            ]
+            parts.append(entries)
+        entries = np.concatenate(parts) if parts else np.empty(0, dtype=ENTRY_DTYPE)
+        return cls(entries, list(filenames), list(aliases))
+
+    def groupby_filename(self) -> dict[str, np.ndarray]:
+        """
+        Row indices of the entries of each file, in table order.
+        """
+        ids = self.entries["filename"]
+        order = np.argsort(ids, kind="stable")
+        bounds = np.searchsorted(ids[order], np.arange(len(self.filenames) + 1))
+        return {
+            self.filenames[file_id]: order[bounds[file_id] : bounds[file_id + 1]]
+            for file_id in range(len(self.filenames))
+            if bounds[file_id] < bounds[file_id + 1]
+        }
+
+    def unique_rows(self, rows: np.ndarray, tolerance: float = 0) -> np.ndarray:
+        """
+        Drop duplicate entries among `rows` like `utils.remove_duplicate_otos`.
+        """
+        entries = self.entries[rows]
+        keys = list(
+            zip(*(entries[name].tolist() for name in ("filename", *TIMING_FIELDS)))
+        )
+        return rows[unique_key_indices(keys, tolerance)]
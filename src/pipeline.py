@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+from typing import Callable
+
+from instrumentation import recorder
+
+
+def file_signature(path: pathlib.Path) -> list:
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Stage:
+    """
+    One phase of the conversion.
+
+    Args:
+        name (str): Name of the stage; also the name of its directory in the work directory
+        phase (str): Label printed in the progress output, e.g. "Phase 1"
+        description (str): What the stage does, printed when it starts
+        run (Callable[[pathlib.Path], dict | None]): Called with the (empty) stage directory. May return JSON-serializable data that is stored in the manifest
+        params (dict | None): JSON-serializable settings that affect the output of the stage
+        sources (list[pathlib.Path] | None): Files outside the work directory the stage reads
+    """
+
+    def __init__(
+        self,
+        name: str,
+        phase: str,
+        description: str,
+        run: Callable[[pathlib.Path], dict | None],
+        params: dict | None = None,
+        sources: list[pathlib.Path] | None = None,
+    ):
+        self.name = name
+        self.phase = phase
+        self.description = description
+        self.run = run
+        self.params = params or {}
+        self.sources = sources or []
+
+
+class Pipeline:
+    """
+    Run stages in order inside a persistent work directory.
+
+    After a stage finishes, a manifest with a fingerprint of its inputs and the
+    size and mtime of every file it wrote is saved to `manifests/<name>.json`.
+    The fingerprint covers the stage's params and sources as well as the
+    manifest of the previous stage, so a change anywhere invalidates every
+    later stage. With `resume`, a stage whose fingerprint matches and whose
+    outputs are intact is skipped.
+    """
+
+    def __init__(self, work_dir: pathlib.Path, resume: bool = False):
+        self.work_dir = work_dir
+        self.resume = resume
+        self.manifests: dict[str, dict] = {}
+        self._previous_digest = ""
+        if not resume and (self.work_dir / "manifests").exists():
+            shutil.rmtree(self.work_dir / "manifests")
+        (self.work_dir / "manifests").mkdir(parents=True, exist_ok=True)
+
+    def stage_dir(self, name: str) -> pathlib.Path:
+        return self.work_dir / name
+
+    def data(self, name: str) -> dict:
+        return self.manifests[name]["data"]
+
+    def _manifest_path(self, name: str) -> pathlib.Path:
+        return self.work_dir / "manifests" / f"{name}.json"
+
+    def _fingerprint(self, stage: Stage) -> str:
+        payload = json.dumps(
+            {
+                "name": stage.name,
+                "params": stage.params,
+                "sources": {
+                    str(source.resolve()): file_signature(source)
+                    for source in stage.sources
+                },
+                "previous": self._previous_digest,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _outputs(self, stage_dir: pathlib.Path) -> dict[str, list]:
+        return {
+            path.relative_to(stage_dir).as_posix(): file_signature(path)
+            for path in sorted(stage_dir.rglob("*"))
+            if path.is_file()
+        }
+
+    def _load_manifest(self, name: str) -> dict | None:
+        try:
+            with open(self._manifest_path(name), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _is_up_to_date(self, stage: Stage, manifest: dict | None, fingerprint: str):
+        if not self.resume or manifest is None:
+            return False
+        if manifest["fingerprint"] != fingerprint:
+            return False
+        stage_dir = self.stage_dir(stage.name)
+        for relative_path, signature in manifest["outputs"].items():
+            path = stage_dir / relative_path
+            if not path.is_file() or file_signature(path) != signature:
+                return False
+        return True
+
+    def run(self, stage: Stage):
+        fingerprint = self._fingerprint(stage)
+        manifest = self._load_manifest(stage.name)
+        step_name = f"{stage.phase} ({stage.name})"
+        if self._is_up_to_date(stage, manifest, fingerprint):
+            recorder.skip(step_name)
+            print(f"{stage.phase}: Up to date, skipped.")
+            print()
+        else:
+            print(f"{stage.phase}: {stage.description}...")
+            print()
+
+            # Drop the old manifest first so that an interrupted stage is never considered complete
+            self._manifest_path(stage.name).unlink(missing_ok=True)
+            stage_dir = self.stage_dir(stage.name)
+            if stage_dir.exists():
+                shutil.rmtree(stage_dir)
+            stage_dir.mkdir(parents=True)
+            with recorder.step(step_name, profile_name=stage.name):
+                data = stage.run(stage_dir) or {}
+            manifest = {
+                "fingerprint": fingerprint,
+                "outputs": self._outputs(stage_dir),
+                "data": data,
+            }
+            temp_path = self._manifest_path(stage.name).with_suffix(".tmp")
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            os.replace(temp_path, self._manifest_path(stage.name))
+
+            print()
+            print(f"{stage.phase}: Done.")
+            print()
+        self.manifests[stage.name] = manifest
+        self._previous_digest = hashlib.sha256(
+            json.dumps(manifest["outputs"], sort_keys=True).encode("utf-8")
+            + fingerprint.encode("ascii")
+        ).hexdigest()
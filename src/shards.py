@@ -0,0 +1,274 @@
+import concurrent.futures
+import contextlib
+import csv
+import dataclasses
+import pathlib
+import shutil
+import sys
+import time
+
+from inference import default_threads
+from instrumentation import cpu_seconds, peak_rss_bytes, recorder
+from pipeline import Pipeline
+from staging import Stager
+
+if sys.platform == "win32":
+    import ctypes
+    from ctypes import wintypes
+
+    JOB_OBJECT_LIMIT_PROCESS_MEMORY = 0x100
+    JOB_OBJECT_EXTENDED_LIMIT_INFORMATION_CLASS = 9
+
+    class IO_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("ReadOperationCount", ctypes.c_ulonglong),
+            ("WriteOperationCount", ctypes.c_ulonglong),
+            ("OtherOperationCount", ctypes.c_ulonglong),
+            ("ReadTransferCount", ctypes.c_ulonglong),
+            ("WriteTransferCount", ctypes.c_ulonglong),
+            ("OtherTransferCount", ctypes.c_ulonglong),
+        ]
+
+    class JOBOBJECT_BASIC_LIMIT_INFORMATION(ctypes.Structure):
+        _fields_ = [
+            ("PerProcessUserTimeLimit", wintypes.LARGE_INTEGER),
+            ("PerJobUserTimeLimit", wintypes.LARGE_INTEGER),
+            ("LimitFlags", wintypes.DWORD),
+            ("MinimumWorkingSetSize", ctypes.c_size_t),
+            ("MaximumWorkingSetSize", ctypes.c_size_t),
+            ("ActiveProcessLimit", wintypes.DWORD),
+            ("Affinity", ctypes.c_size_t),
+            ("PriorityClass", wintypes.DWORD),
+            ("SchedulingClass", wintypes.DWORD),
+        ]
+
+    class JOBOBJECT_EXTENDED_LIMIT_INFORMATION(ctypes.Structure):
+        _fields_ = [
+            ("BasicLimitInformation", JOBOBJECT_BASIC_LIMIT_INFORMATION),
+            ("IoInfo", IO_COUNTERS),
+            ("ProcessMemoryLimit", ctypes.c_size_t),
+            ("JobMemoryLimit", ctypes.c_size_t),
+            ("PeakProcessMemoryUsed", ctypes.c_size_t),
+            ("PeakJobMemoryUsed", ctypes.c_size_t),
+        ]
+
+
+def limit_memory(max_bytes: int):
+    """
+    Make allocations fail with MemoryError once the current process, or any process it starts, uses more than `max_bytes` on its own.
+
+    On Windows the process is put into a job object with a per-process
+    memory limit (committed memory). Elsewhere RLIMIT_AS limits the address
+    space, which is larger than the resident memory, so the limit needs some
+    headroom there.
+    """
+    if sys.platform == "win32":
+        kernel32 = ctypes.windll.kernel32
+        kernel32.CreateJobObjectW.restype = wintypes.HANDLE
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        job = kernel32.CreateJobObjectW(None, None)
+        if not job:
+            raise ctypes.WinError()
+        info = JOBOBJECT_EXTENDED_LIMIT_INFORMATION()
+        info.BasicLimitInformation.LimitFlags = JOB_OBJECT_LIMIT_PROCESS_MEMORY
+        info.ProcessMemoryLimit = max_bytes
+        if not kernel32.SetInformationJobObject(
+            job,
+            JOB_OBJECT_EXTENDED_LIMIT_INFORMATION_CLASS,
+            ctypes.byref(info),
+            ctypes.sizeof(info),
+        ):
+            raise ctypes.WinError()
+        if not kernel32.AssignProcessToJobObject(job, kernel32.GetCurrentProcess()):
+            raise ctypes.WinError()
+        return
+    import resource
+
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        max_bytes = min(max_bytes, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, hard))
+
+
+def shard_dirs(
+    voicebank_dirs: list[pathlib.Path], work_dir: pathlib.Path
+) -> list[pathlib.Path]:
+    return [
+        work_dir / "shards" / f"{index}_{voicebank_dir.stem}"
+        for index, voicebank_dir in enumerate(voicebank_dirs)
+    ]
+
+
+def run_shard(
+    voicebank_dir: pathlib.Path,
+    shard_dir: pathlib.Path,
+    options,
+    resume: bool,
+    profile_stages: list[str],
+    profiler: str,
+) -> dict:
+    """
+    Convert one voicebank in `shard_dir` and export its dataset to `shard_dir/output`. Runs in a worker process.
+
+    The output of the stages goes to `shard_dir/shard.log`, since several
+    shards run at the same time.
+
+    Returns:
+        dict: Run report of the shard
+    """
+    from g2p import g2p_cache
+    from stages import build_stages, export_dataset
+
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    with (
+        open(shard_dir / "shard.log", "w", encoding="utf-8") as log,
+        contextlib.redirect_stdout(log),
+        contextlib.redirect_stderr(log),
+    ):
+        if options.cache_dir is not None:
+            g2p_cache.load(options.cache_dir / "g2p.json")
+        recorder.reset()
+        recorder.configure_profiling(profile_stages, profiler, shard_dir / "profiles")
+        start_wall = time.perf_counter()
+        start_cpu = cpu_seconds()
+        pipeline = Pipeline(shard_dir, resume=resume)
+        for stage in build_stages([voicebank_dir], options, pipeline):
+            pipeline.run(stage)
+        output_path = shard_dir / "output"
+        if output_path.exists():
+            shutil.rmtree(output_path)
+        with recorder.step("Export"):
+            export_dataset(pipeline, output_path, options)
+    return {
+        "voicebank": str(voicebank_dir),
+        "work_dir": str(shard_dir),
+        "output": str(output_path),
+        "wall_seconds": time.perf_counter() - start_wall,
+        "cpu_seconds": cpu_seconds() - start_cpu,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "steps": recorder.report(),
+    }
+
+
+def run_shards(
+    voicebank_dirs: list[pathlib.Path],
+    work_dir: pathlib.Path,
+    options,
+    resume: bool,
+    profile_stages: list[str],
+    profiler: str,
+) -> list[dict]:
+    """
+    Convert every voicebank as an independent shard in a pool of `options.shard_workers` processes.
+
+    The preprocessing and AP detection pools of the shards (`num_workers`,
+    `ap_workers`) are divided by the number of shards running at once, and
+    so are the torch threads unless `options.torch_threads` is set.
+    `options.shard_memory` (MiB, 0 for no limit) applies to each process of a
+    shard separately, the worker and every process it starts; it does not
+    limit the total memory of a shard. Shards keep their own work directories, so `resume` applies
+    per voicebank.
+
+    Returns:
+        list[dict]: Run reports of the shards, in the order of `voicebank_dirs`
+    """
+    if options.forced_aligner == "Moresampler":
+        from tools import ensure_moresampler
+
+        # Provision the tool once instead of letting the shards race to extract it
+        ensure_moresampler(
+            options.tools_dir, options.moresampler_archive, options.moresampler_sha256
+        )
+    num_processes = min(options.shard_workers, len(voicebank_dirs))
+    # Every shard starts its own pools; split the requested sizes between them
+    options = dataclasses.replace(
+        options,
+        num_workers=max(1, options.num_workers // num_processes),
+        ap_workers=options.ap_workers // num_processes,
+        torch_threads=options.torch_threads or default_threads(num_processes),
+    )
+    directories = shard_dirs(voicebank_dirs, work_dir)
+    max_bytes = options.shard_memory * 1024 * 1024
+    reports: list[dict | None] = [None] * len(voicebank_dirs)
+    errors: dict[int, BaseException] = {}
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=num_processes,
+        initializer=limit_memory if max_bytes else None,
+        initargs=(max_bytes,) if max_bytes else (),
+    ) as executor:
+        futures = {
+            executor.submit(
+                run_shard,
+                voicebank_dir,
+                shard_dir,
+                options,
+                resume,
+                profile_stages,
+                profiler,
+            ): index
+            for index, (voicebank_dir, shard_dir) in enumerate(
+                zip(voicebank_dirs, directories)
+            )
+        }
+        for future in concurrent.futures.as_completed(futures):
+            index = futures[future]
+            exception = future.exception()
+            if exception is not None:
+                errors[index] = exception
+                print(
+                    f"  {voicebank_dirs[index]}: {type(exception).__name__}: {exception} "
+                    f"(log: {directories[index] / 'shard.log'})"
+                )
+            else:
+                reports[index] = future.result()
+                print(
+                    f"  {voicebank_dirs[index]}: done in {reports[index]['wall_seconds']:.2f}s"
+                )
+    if errors:
+        raise RuntimeError(
+            f"{len(errors)} of {len(voicebank_dirs)} shard(s) failed: "
+            + ", ".join(str(voicebank_dirs[index]) for index in sorted(errors))
+        )
+    return reports
+
+
+def merge_shard_outputs(
+    shard_outputs: list[pathlib.Path], output_path: pathlib.Path, stager: Stager
+) -> int:
+    """
+    Combine the datasets exported by the shards in the given order.
+
+    The rows of transcriptions.csv are concatenated shard by shard and the
+    files in `wavs` are placed with `stager`, so the result does not depend on
+    which shard finished first.
+
+    Returns:
+        int: Number of items
+    """
+    output_wavs_path = output_path / "wavs"
+    output_wavs_path.mkdir(parents=True)
+    fieldnames = None
+    rows = []
+    names = set()
+    for shard_output in shard_outputs:
+        with open(
+            shard_output / "transcriptions.csv", "r", encoding="utf-8", newline=""
+        ) as f:
+            reader = csv.DictReader(f)
+            fieldnames = fieldnames or reader.fieldnames
+            for row in reader:
+                if row["name"] in names:
+                    raise ValueError(
+                        f"Item {row['name']} is produced by more than one voicebank."
+                    )
+                names.add(row["name"])
+                rows.append(row)
+        for path in sorted((shard_output / "wavs").iterdir()):
+            stager.place(path, output_wavs_path / path.name)
+    with open(
+        output_path / "transcriptions.csv", "w", encoding="utf-8", newline=""
+    ) as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames or ["name"])
+        writer.writeheader()
+        writer.writerows(rows)
+    return len(rows)
@@ -0,0 +1,745 @@
+import dataclasses
+import functools
+import pathlib
+import re
+import shutil
+import subprocess
+import sys
+import time
+from typing import TYPE_CHECKING
+
+import numpy as np
+import tqdm
+from audio import (
+    AudioTransform,
+    build_operations,
+    probe_duration,
+    probe_durations,
+    process_wav_files,
+    report_errors,
+)
+from cache import AlignmentCache, F0Cache
+from dedup import expand_duplicates, find_duplicates, save_duplicates
+from g2p import G2PCache, PyOpenJTalkG2P, g2p_cache
+from instrumentation import recorder
+from oto import build_intervals, intervals_to_data, is_convertible
+from oto_table import OtoTable
+from pipeline import Pipeline, Stage
+from staging import Stager
+from textgrids import read_textgrid, write_bundle, write_textgrid
+from tools import ensure_moresampler
+from utils import (
+    remove_specific_consecutive_duplicates,
+    convert_sharp_flat_in_notes,
+)
+
+if TYPE_CHECKING:
+    import lightning as pl
+    from SOFA.train import LitForcedAlignmentTask
+
+# torch, lightning, SOFA and the MakeDiffSinger scripts take several seconds to
+# import, so each stage imports what it needs when it runs.
+
+CHECKPOINT_PATH = pathlib.Path("src/ckpt/step.100000.ckpt")
+DICTIONARY_PATH = pathlib.Path("src/dictionaries/japanese-extension-sofa.txt")
+
+F0_CACHE_NAME = "f0.h5"
+
+HIRAGANA_REGEX = re.compile(r"([あ-ん][ぁぃぅぇぉゃゅょ]|[あ-ん])")
+KATAKANA_REGEX = re.compile(r"([ア-ン][ァィゥェォャュョ]|[ア-ン])")
+
+
+@dataclasses.dataclass
+class ConversionOptions:
+    forced_aligner: str
+    normalize: bool = False
+    trim: bool = False
+    trim_top_db: float = 30
+    sample_rate: int | None = None
+    oto_tolerance: float = 0
+    batch_frames: int = 0
+    num_workers: int = 1
+    # None disables the persistent caches
+    cache_dir: pathlib.Path | None = None
+    cache_size: int = 1024
+    tools_dir: pathlib.Path = pathlib.Path("src/cache/tools")
+    moresampler_archive: str | None = None
+    moresampler_sha256: str | None = None
+    # "link" avoids copying audio where the filesystem allows it; "copy" always copies
+    staging: str = "link"
+    # "bytes" or "pcm" drops recordings that appear in several voicebanks; see dedup.py
+    dedup: str = "off"
+    expand_duplicates: bool = False
+    # "bundle" passes the alignments to the dataset build in one TextGrid.jsonl instead of a TextGrid per recording
+    textgrid_format: str = "files"
+    # Processes that convert one voicebank each (0 converts them together) and their memory limit in MiB; see shards.py
+    shard_workers: int = 0
+    shard_memory: int = 0
+    # torch threads within and between operators (0 keeps the torch default) and the SOFA weights; see inference.py
+    torch_threads: int = 0
+    torch_interop_threads: int = 0
+    model_precision: str = "fp32"
+    # Processes that add AP intervals after alignment (0 or 1 runs them in this process); see ap_detection.py
+    ap_workers: int = 0
+
+    def operations(self):
+        return build_operations(
+            normalize=self.normalize,
+            trim_top_db=self.trim_top_db if self.trim else None,
+            sample_rate=self.sample_rate,
+        )
+
+    def save_g2p_cache(self):
+        print(g2p_cache.stats())
+        if self.cache_dir is not None:
+            g2p_cache.save(self.cache_dir / "g2p.json")
+
+
+@functools.cache
+def load_sofa_model(
+    checkpoint_path: pathlib.Path, precision: str = "fp32"
+) -> "LitForcedAlignmentTask":
+    """
+    Load the SOFA model once per process and precision so that batch runs reuse it across jobs.
+    """
+    from inference import load_model
+
+    return load_model(checkpoint_path, precision)
+
+
+@functools.cache
+def load_trainer() -> "pl.Trainer":
+    """
+    Create the lightning Trainer used for unbatched prediction once per process.
+    """
+    import lightning as pl
+
+    return pl.Trainer(logger=False)
+
+
+def warm_up(forced_aligner: str, precision: str = "fp32"):
+    """
+    Import and load everything a conversion with `forced_aligner` needs, so that a long-running process does not pay for it on its first job.
+    """
+    import pyopenjtalk
+
+    # OpenJTalk loads its dictionary on first use
+    with G2PCache._openjtalk_lock:
+        pyopenjtalk.g2p("あ")
+    if forced_aligner == "SOFA":
+        import SOFA.modules.utils.export_tool
+        import SOFA.modules.utils.post_processing
+        import alignment
+        from ap_detection import load_ap_detector
+
+        load_sofa_model(CHECKPOINT_PATH, precision)
+        load_ap_detector()
+        load_trainer()
+
+
+def merged_wav_name(wav_file: pathlib.Path, voicebank_dir: pathlib.Path) -> str:
+    return convert_sharp_flat_in_notes(f"{wav_file.stem}_{voicebank_dir.stem}.wav")
+
+
+def deduplicate(
+    stage_dir: pathlib.Path,
+    wav_files: dict[str, pathlib.Path],
+    options: ConversionOptions,
+) -> dict[str, str]:
+    duplicates = find_duplicates(wav_files, options.dedup, options.num_workers)
+    if options.dedup != "off":
+        save_duplicates(stage_dir / "duplicates.json", duplicates)
+        print(f"{len(duplicates)} duplicate recording(s) are processed only once.")
+    return duplicates
+
+
+def merge_voicebanks(
+    stage_dir: pathlib.Path,
+    voicebank_dirs: list[pathlib.Path],
+    options: ConversionOptions,
+) -> dict:
+    wav_files = {
+        merged_wav_name(wav_file, voicebank_dir): wav_file
+        for voicebank_dir in voicebank_dirs
+        for wav_file in voicebank_dir.glob("*.wav")
+    }
+    duplicates = deduplicate(stage_dir, wav_files, options)
+    stager = Stager(options.staging)
+    with tqdm.tqdm(total=len(wav_files)) as pbar:
+        for merged_name, wav_file in wav_files.items():
+            if merged_name not in duplicates:
+                stager.place(wav_file, stage_dir / merged_name)
+            pbar.update(1)
+    recorder.count(files=len(wav_files))
+    print(stager.stats())
+    return {"duplicates": duplicates}
+
+
+def preprocess_audio(
+    stage_dir: pathlib.Path, audio_dir: pathlib.Path, options: ConversionOptions
+) -> dict:
+    results, errors = process_wav_files(
+        AudioTransform(options.operations(), stage_dir).timed,
+        sorted(audio_dir.glob("*.wav")),
+        options.num_workers,
+    )
+    report_errors(errors)
+    durations = {wav_file: duration for wav_file, (duration, _) in results.items()}
+    audio_seconds = sum(durations.values())
+    recorder.count(files=len(durations), audio_seconds=audio_seconds)
+    # The operations run in the workers, so report their summed time per operation
+    operation_seconds: dict[str, float] = {}
+    for _, timings in results.values():
+        for name, seconds in timings.items():
+            operation_seconds[name] = operation_seconds.get(name, 0.0) + seconds
+    for name, seconds in operation_seconds.items():
+        recorder.add(name, seconds, len(durations), audio_seconds)
+    return {
+        "durations": {
+            wav_file.name: duration for wav_file, duration in durations.items()
+        }
+    }
+
+
+def graphemes_from_file_name(file_name: str) -> list[str]:
+    words = file_name[1:]
+    return remove_specific_consecutive_duplicates(
+        [
+            *HIRAGANA_REGEX.findall(words),
+            *KATAKANA_REGEX.findall(words),
+        ],
+        ["あ", "い", "う", "え", "お", "ん"],
+    )
+
+
+def generate_graphemes(stage_dir: pathlib.Path, audio_dir: pathlib.Path):
+    wav_files = sorted(audio_dir.glob("*.wav"))
+    with tqdm.tqdm(total=len(wav_files)) as pbar:
+        for wav_file in wav_files:
+            file_name = wav_file.stem
+            graphemes = graphemes_from_file_name(file_name)
+            with open(stage_dir / f"{file_name}.txt", "w", encoding="utf-8") as f:
+                f.write(" ".join(graphemes))
+            pbar.update(1)
+    recorder.count(files=len(wav_files))
+
+
+def align_with_sofa(
+    stage_dir: pathlib.Path,
+    audio_dir: pathlib.Path,
+    text_dir: pathlib.Path,
+    options: ConversionOptions,
+):
+    wavs_dir = stage_dir / "wavs"
+    textgrid_dir = stage_dir / "TextGrid"
+    wavs_dir.mkdir()
+    textgrid_dir.mkdir()
+    # SOFA only reads the audio and the text
+    stager = Stager(options.staging)
+    wav_files = []
+    for wav_file in sorted(audio_dir.glob("*.wav")):
+        stager.place(wav_file, wavs_dir / wav_file.name, "symlink")
+        stager.place(
+            text_dir / f"{wav_file.stem}.txt",
+            wavs_dir / f"{wav_file.stem}.txt",
+            "symlink",
+        )
+        wav_files.append(wavs_dir / wav_file.name)
+    recorder.count(files=len(wav_files))
+    print(stager.stats())
+    print()
+
+    alignment_cache = None
+    alignment_keys: dict[pathlib.Path, str] = {}
+    textgrids: dict[str, dict] = {}
+    uncached_wav_files = wav_files
+    if options.cache_dir is not None:
+        alignment_cache = AlignmentCache(
+            options.cache_dir / "alignments", options.cache_size * 1024 * 1024
+        )
+        checkpoint_digest = alignment_cache.digest_file(CHECKPOINT_PATH)
+        flags = {
+            "normalize": options.normalize,
+            "trim": options.trim,
+            "trim_top_db": options.trim_top_db if options.trim else None,
+            "sample_rate": options.sample_rate,
+        }
+        if options.model_precision != "fp32":
+            # Only added when set, so that existing fp32 entries stay valid
+            flags["model_precision"] = options.model_precision
+        uncached_wav_files = []
+        with recorder.step("cache lookup"):
+            for wav_file in wav_files:
+                alignment_keys[wav_file] = alignment_cache.key(
+                    wav_file,
+                    wav_file.with_suffix(".txt").read_text(encoding="utf-8"),
+                    checkpoint_digest,
+                    flags,
+                )
+                cached = alignment_cache.get(alignment_keys[wav_file])
+                if cached is None:
+                    uncached_wav_files.append(wav_file)
+                elif options.textgrid_format == "bundle":
+                    textgrids[wav_file.stem] = cached
+                else:
+                    write_textgrid(textgrid_dir / f"{wav_file.stem}.TextGrid", cached)
+            recorder.count(files=len(wav_files))
+        print(alignment_cache.stats())
+        print()
+
+    if uncached_wav_files:
+        import torch
+        from SOFA.modules.utils.export_tool import Exporter
+        from SOFA.modules.utils.post_processing import post_processing
+        from alignment import predict_batched
+        from ap_detection import detect_AP
+        from inference import configure_threads
+
+        configure_threads(options.torch_threads, options.torch_interop_threads)
+        g2p_class = PyOpenJTalkG2P
+        grapheme_to_phoneme = g2p_class()
+
+        with recorder.step("load model"):
+            model = load_sofa_model(CHECKPOINT_PATH, options.model_precision)
+
+        with recorder.step("G2P"):
+            dataset = grapheme_to_phoneme.get_dataset(uncached_wav_files)
+            recorder.count(files=len(uncached_wav_files))
+
+        with recorder.step("SOFA predict"), torch.inference_mode():
+            if options.batch_frames > 0:
+                predictions = predict_batched(model, dataset, options.batch_frames)
+            else:
+                trainer = load_trainer()
+                predictions = trainer.predict(
+                    model, dataloaders=dataset, return_predictions=True
+                )
+            audio_seconds = sum(prediction[1] for prediction in predictions)
+            recorder.count(files=len(predictions), audio_seconds=audio_seconds)
+
+        with recorder.step("AP detection"), torch.inference_mode():
+            predictions = detect_AP(predictions, options.ap_workers)
+            recorder.count(files=len(predictions), audio_seconds=audio_seconds)
+        with recorder.step("post_processing"):
+            predictions, log = post_processing(predictions)
+            recorder.count(files=len(predictions), audio_seconds=audio_seconds)
+
+        # The exporter writes next to the audio; move the TextGrids out of the wavs directory
+        with recorder.step("export"):
+            exporter = Exporter(predictions, log)
+            exporter.export(["textgrid"])
+            for textgrid_file in (wavs_dir / "TextGrid").glob("*.TextGrid"):
+                shutil.move(textgrid_file, textgrid_dir / textgrid_file.name)
+            shutil.rmtree(wavs_dir / "TextGrid", ignore_errors=True)
+            recorder.count(files=len(predictions))
+
+    uncached_wav_file_set = set(uncached_wav_files)
+    for wav_file in wav_files:
+        textgrid_file = textgrid_dir / f"{wav_file.stem}.TextGrid"
+        if wav_file in uncached_wav_file_set and textgrid_file.exists():
+            if options.textgrid_format == "bundle" or alignment_cache is not None:
+                textgrids[wav_file.stem] = read_textgrid(textgrid_file)
+            if alignment_cache is not None:
+                alignment_cache.put(alignment_keys[wav_file], textgrids[wav_file.stem])
+        elif wav_file.stem not in textgrids and not textgrid_file.exists():
+            # Alignment failed; leave the file out of the dataset
+            wav_file.unlink()
+            wav_file.with_suffix(".txt").unlink()
+    if alignment_cache is not None:
+        alignment_cache.evict()
+    if options.textgrid_format == "bundle":
+        write_bundle(
+            stage_dir / "TextGrid.jsonl",
+            (
+                (wav_file.stem, textgrids[wav_file.stem])
+                for wav_file in wav_files
+                if wav_file.stem in textgrids
+            ),
+        )
+        shutil.rmtree(textgrid_dir)
+
+    print()
+    options.save_g2p_cache()
+
+
+def generate_oto_ini(
+    stage_dir: pathlib.Path,
+    voicebank_dirs: list[pathlib.Path],
+    options: ConversionOptions,
+) -> dict:
+    moresampler_dir = ensure_moresampler(
+        options.tools_dir, options.moresampler_archive, options.moresampler_sha256
+    )
+    # Duplicates are dropped before Moresampler analyzes them
+    duplicates = deduplicate(
+        stage_dir,
+        {
+            merged_wav_name(wav_file, voicebank_dir): wav_file
+            for voicebank_dir in voicebank_dirs
+            for wav_file in voicebank_dir.glob("*.wav")
+        },
+        options,
+    )
+    # Moresampler is an external tool, so its input is never linked to the source voicebank
+    stager = Stager(options.staging)
+    for voicebank_dir in voicebank_dirs:
+        temp_voicebank_dir = stage_dir / voicebank_dir.stem
+        temp_voicebank_dir.mkdir()
+        wav_files = [
+            wav_file
+            for wav_file in voicebank_dir.glob("*.wav")
+            if merged_wav_name(wav_file, voicebank_dir) not in duplicates
+        ]
+        with tqdm.tqdm(total=len(wav_files)) as pbar:
+            for wav_file in wav_files:
+                stager.place(wav_file, temp_voicebank_dir / wav_file.name, "copy")
+                pbar.update(1)
+        print(stager.stats())
+        print()
+        process = subprocess.Popen(
+            [
+                str(moresampler_dir / "moresampler.exe"),
+                str(temp_voicebank_dir),
+            ],
+            stdin=subprocess.PIPE,
+            text=True,
+            # Ctrl+C is left to this process, which stops the tool when it is meant to stop
+            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP
+            if sys.platform == "win32"
+            else 0,
+            start_new_session=sys.platform != "win32",
+        )
+        process.stdin.write("1\n")
+        process.stdin.flush()
+        process.stdin.write("y\n")
+        process.stdin.flush()
+        process.stdin.write("n\n")
+        process.stdin.flush()
+        process.stdin.write("1\n")
+        process.stdin.flush()
+        process.stdin.write("n\n")
+        process.stdin.flush()
+        process.stdin.write("\n")
+        process.stdin.flush()
+        try:
+            while process.poll() is None:
+                process.stdin.write("\n")
+                process.stdin.flush()
+                time.sleep(0.1)
+        except KeyboardInterrupt:
+            process.kill()
+            raise
+        print()
+    return {"duplicates": duplicates}
+
+
+def merge_oto_voicebanks(
+    stage_dir: pathlib.Path,
+    oto_dir: pathlib.Path,
+    voicebank_dirs: list[pathlib.Path],
+    duplicates: dict[str, str],
+    options: ConversionOptions,
+):
+    """
+    Merge the voicebanks analyzed by Moresampler. `duplicates` were left out by `generate_oto_ini` and are passed on for the export.
+    """
+    stager = Stager(options.staging)
+    tables = []
+    with tqdm.tqdm(total=len(voicebank_dirs)) as pbar:
+        for voicebank_dir in voicebank_dirs:
+            temp_voicebank_dir = oto_dir / voicebank_dir.stem
+            oto_table = OtoTable.read(temp_voicebank_dir / "oto.ini")
+            rows_by_filename = oto_table.groupby_filename()
+            selected_rows = []
+            merged_names = {}
+            for wav_file in temp_voicebank_dir.glob("*.wav"):
+                merged_name = merged_wav_name(wav_file, voicebank_dir)
+                stager.place(wav_file, stage_dir / merged_name)
+                if wav_file.name in rows_by_filename:
+                    selected_rows.append(rows_by_filename[wav_file.name])
+                    merged_names[wav_file.name] = merged_name
+            rows = np.concatenate(selected_rows or [np.empty(0, dtype=np.intp)])
+            tables.append(oto_table.take(rows).rename_files(merged_names))
+            pbar.update(1)
+    OtoTable.concatenate(tables).write(stage_dir / "oto.ini")
+    print(stager.stats())
+    return {"duplicates": duplicates}
+
+
+def convert_oto_ini(
+    stage_dir: pathlib.Path,
+    audio_dir: pathlib.Path,
+    oto_ini_path: pathlib.Path,
+    durations: dict[str, float],
+    options: ConversionOptions,
+):
+    wavs_dir = stage_dir / "wavs"
+    textgrid_dir = stage_dir / "TextGrid"
+    wavs_dir.mkdir()
+    if options.textgrid_format == "files":
+        textgrid_dir.mkdir()
+    oto_table = OtoTable.read(oto_ini_path)
+    rows_by_filename = oto_table.groupby_filename()
+    wav_files = sorted(audio_dir.glob("*.wav"))
+    duration_table, errors = probe_durations(
+        wav_files, {audio_dir / name: duration for name, duration in durations.items()}
+    )
+    report_errors(errors)
+    print()
+    wav_files = [wav_file for wav_file in wav_files if wav_file not in errors]
+    audio_seconds = sum(duration_table[wav_file] for wav_file in wav_files)
+    recorder.count(files=len(wav_files), audio_seconds=audio_seconds)
+    stager = Stager(options.staging)
+    with (
+        recorder.step("TextGrid building"),
+        tqdm.tqdm(total=len(wav_files)) as pbar,
+    ):
+        recorder.count(files=len(wav_files), audio_seconds=audio_seconds)
+        no_rows = np.empty(0, dtype=np.intp)
+        rows_per_file: dict[pathlib.Path, np.ndarray] = {}
+        for wav_file in wav_files:
+            rows = oto_table.unique_rows(
+                rows_by_filename.get(wav_file.name, no_rows), options.oto_tolerance
+            )
+            if is_convertible(oto_table, rows):
+                rows_per_file[wav_file] = rows
+            else:
+                pbar.update(1)
+        intervals_per_file = build_intervals(
+            oto_table,
+            [
+                (rows, duration_table[wav_file])
+                for wav_file, rows in rows_per_file.items()
+            ],
+        )
+
+        def textgrids():
+            for wav_file, intervals in zip(rows_per_file, intervals_per_file):
+                if intervals is None:
+                    raise ValueError(f"Invalid intervals for {wav_file.name}.")
+                stager.place(wav_file, wavs_dir / wav_file.name, "symlink")
+                pbar.update(1)
+                yield (
+                    wav_file.stem,
+                    intervals_to_data(intervals, duration_table[wav_file]),
+                )
+
+        if options.textgrid_format == "bundle":
+            write_bundle(stage_dir / "TextGrid.jsonl", textgrids())
+        else:
+            for name, data in textgrids():
+                write_textgrid(textgrid_dir / f"{name}.TextGrid", data)
+
+    print()
+    print(stager.stats())
+    options.save_g2p_cache()
+
+
+def build_variance_dataset(stage_dir: pathlib.Path, align_dir: pathlib.Path):
+    """
+    Build the dataset from the alignments and add phoneme numbers, notes and DiffSinger files (.ds) to it.
+
+    The transcriptions are passed between the steps in memory and
+    transcriptions.csv is written once at the end. estimate_midi and csv2ds
+    read the pitch of every recording from one `F0Cache`, so it is extracted
+    once.
+    """
+    from dataset import build_dataset, load_textgrids
+    from get_pitch import get_pitch
+    from variance import (
+        add_ph_num,
+        estimate_midi,
+        write_ds_files,
+        write_transcriptions,
+    )
+
+    wavs_dir = stage_dir / "wavs"
+    with recorder.step("build_dataset"):
+        transcriptions = build_dataset(
+            align_dir / "wavs", load_textgrids(align_dir), stage_dir
+        )
+        audio_seconds = sum(
+            probe_duration(wavs_dir / f"{name}.wav") for name in transcriptions["name"]
+        )
+        recorder.count(files=len(transcriptions), audio_seconds=audio_seconds)
+    with recorder.step("add_ph_num"):
+        transcriptions = add_ph_num(transcriptions, DICTIONARY_PATH)
+        recorder.count(files=len(transcriptions))
+    f0_cache = F0Cache(stage_dir / F0_CACHE_NAME)
+    try:
+        cached_get_pitch = f0_cache.cached(get_pitch)
+        with recorder.step("estimate_midi"):
+            transcriptions = estimate_midi(transcriptions, wavs_dir, cached_get_pitch)
+            recorder.count(files=len(transcriptions), audio_seconds=audio_seconds)
+        # csv2ds writes next to the audio, as MakeDiffSinger's does
+        with recorder.step("csv2ds"):
+            write_ds_files(transcriptions, wavs_dir, wavs_dir, cached_get_pitch)
+            recorder.count(files=len(transcriptions), audio_seconds=audio_seconds)
+    finally:
+        f0_cache.close()
+    print(f0_cache.stats())
+    write_transcriptions(transcriptions, stage_dir / "transcriptions.csv")
+
+
+def build_stages(
+    voicebank_dirs: list[pathlib.Path], options: ConversionOptions, pipeline: Pipeline
+) -> list[Stage]:
+    source_wav_files = [
+        wav_file
+        for voicebank_dir in voicebank_dirs
+        for wav_file in sorted(voicebank_dir.glob("*.wav"))
+    ]
+    voicebank_params = {
+        "voicebank_dirs": [
+            str(voicebank_dir.resolve()) for voicebank_dir in voicebank_dirs
+        ]
+    }
+    operations = options.operations()
+    preprocess_params = {
+        "normalize": options.normalize,
+        "trim": options.trim,
+        "trim_top_db": options.trim_top_db,
+        "sample_rate": options.sample_rate,
+    }
+    stages: list[Stage] = []
+    if options.forced_aligner == "SOFA":
+        stages.append(
+            Stage(
+                "merge",
+                "Phase 1",
+                "Merge voicebanks",
+                lambda stage_dir: merge_voicebanks(stage_dir, voicebank_dirs, options),
+                {**voicebank_params, "dedup": options.dedup},
+                source_wav_files,
+            )
+        )
+        audio_dir = pipeline.stage_dir("merge")
+        if operations:
+            stages.append(
+                Stage(
+                    "preprocess",
+                    "Phase 1-1",
+                    "Preprocessing audio",
+                    lambda stage_dir: preprocess_audio(
+                        stage_dir, pipeline.stage_dir("merge"), options
+                    ),
+                    preprocess_params,
+                )
+            )
+            audio_dir = pipeline.stage_dir("preprocess")
+        stages.append(
+            Stage(
+                "graphemes",
+                "Phase 2",
+                "Generating text files",
+                lambda stage_dir: generate_graphemes(stage_dir, audio_dir),
+            )
+        )
+        stages.append(
+            Stage(
+                "align",
+                "Phase 3",
+                "Generating TextGrids",
+                lambda stage_dir: align_with_sofa(
+                    stage_dir, audio_dir, pipeline.stage_dir("graphemes"), options
+                ),
+                {
+                    "batch_frames": options.batch_frames,
+                    "textgrid_format": options.textgrid_format,
+                    "model_precision": options.model_precision,
+                },
+                [CHECKPOINT_PATH],
+            )
+        )
+    elif options.forced_aligner == "Moresampler":
+        stages.append(
+            Stage(
+                "oto",
+                "Phase 1",
+                "Generating oto.ini file",
+                lambda stage_dir: generate_oto_ini(stage_dir, voicebank_dirs, options),
+                {**voicebank_params, "dedup": options.dedup},
+                source_wav_files,
+            )
+        )
+        stages.append(
+            Stage(
+                "merge",
+                "Phase 2",
+                "Merge voicebanks",
+                lambda stage_dir: merge_oto_voicebanks(
+                    stage_dir,
+                    pipeline.stage_dir("oto"),
+                    voicebank_dirs,
+                    pipeline.data("oto")["duplicates"],
+                    options,
+                ),
+            )
+        )
+        audio_dir = pipeline.stage_dir("merge")
+        if operations:
+            stages.append(
+                Stage(
+                    "preprocess",
+                    "Phase 2-1",
+                    "Preprocessing audio",
+                    lambda stage_dir: preprocess_audio(
+                        stage_dir, pipeline.stage_dir("merge"), options
+                    ),
+                    preprocess_params,
+                )
+            )
+            audio_dir = pipeline.stage_dir("preprocess")
+        stages.append(
+            Stage(
+                "align",
+                "Phase 3",
+                "Convert oto.ini to TextGrid",
+                lambda stage_dir: convert_oto_ini(
+                    stage_dir,
+                    audio_dir,
+                    pipeline.stage_dir("merge") / "oto.ini",
+                    pipeline.data("preprocess")["durations"] if operations else {},
+                    options,
+                ),
+                {
+                    "oto_tolerance": options.oto_tolerance,
+                    "textgrid_format": options.textgrid_format,
+                },
+            )
+        )
+    else:
+        raise ValueError(f"Invalid forced aligner: {options.forced_aligner}")
+
+    stages.append(
+        Stage(
+            "dataset",
+            "Phase 4",
+            "Build dataset",
+            lambda stage_dir: build_variance_dataset(
+                stage_dir, pipeline.stage_dir("align")
+            ),
+            sources=[DICTIONARY_PATH],
+        )
+    )
+    return stages
+
+
+def export_dataset(
+    pipeline: Pipeline, output_path: pathlib.Path, options: ConversionOptions
+):
+    stager = Stager(options.staging)
+    output_wavs_path = output_path / "wavs"
+    output_wavs_path.mkdir(parents=True)
+    dataset_dir = pipeline.stage_dir("dataset")
+    shutil.copy(dataset_dir / "transcriptions.csv", output_path / "transcriptions.csv")
+    for pattern in ("*.wav", "*.ds"):
+        for path in (dataset_dir / "wavs").glob(pattern):
+            stager.place(path, output_wavs_path / path.name)
+    duplicates = pipeline.data("merge").get("duplicates", {})
+    if duplicates and options.expand_duplicates:
+        added = expand_duplicates(output_path, duplicates, stager)
+        print(f"Re-expanded {added} item(s) of duplicate recordings.")
+    elif duplicates:
+        save_duplicates(output_path / "duplicates.json", duplicates)
+    print(stager.stats())
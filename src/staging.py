@@ -0,0 +1,103 @@
+import os
+import pathlib
+import shutil
+import sys
+
+# ioctl that makes the destination share the extents of the source (Btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+MODES = ("link", "copy")
+
+# Methods tried before falling back to a plain copy, by how the stage uses the file
+METHODS = {
+    "symlink": ["symlink", "hardlink", "reflink"],
+    "link": ["hardlink", "reflink"],
+    "copy": ["reflink"],
+}
+
+
+def reflink(source: pathlib.Path, destination: pathlib.Path):
+    """
+    Create a copy-on-write clone of `source`. Raises OSError where the filesystem or platform does not support it.
+    """
+    if not sys.platform.startswith("linux"):
+        raise OSError("Reflinks are only supported on Linux.")
+    import fcntl
+
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            destination.unlink(missing_ok=True)
+            raise
+
+
+class Stager:
+    """
+    Place files into stage directories without duplicating their data where possible.
+
+    `link` tries a hardlink, then a reflink, and copies only when neither works
+    (e.g. across filesystems). `symlink` additionally tries a symbolic link
+    first and is meant for stages that only read the file. Files that a stage
+    (or an external tool) may modify in place must be placed with `copy`, which
+    only uses a reflink, so that the change cannot reach the original voicebank.
+    With `mode="copy"`, every file is copied.
+
+    Args:
+        mode (str): "link" to avoid copies, "copy" to always copy
+    """
+
+    def __init__(self, mode: str = "link"):
+        if mode not in MODES:
+            raise ValueError(f"Invalid staging mode: {mode}")
+        self.mode = mode
+        self.counts = {"hardlink": 0, "reflink": 0, "symlink": 0, "copy": 0}
+        self.bytes_saved = 0
+
+    def _place(
+        self, source: pathlib.Path, destination: pathlib.Path, method: str
+    ) -> str:
+        if method == "symlink":
+            destination.symlink_to(source.resolve())
+            return "symlink"
+        if method == "hardlink":
+            os.link(source, destination)
+            return "hardlink"
+        if method == "reflink":
+            reflink(source, destination)
+            return "reflink"
+        shutil.copy(source, destination)
+        return "copy"
+
+    def place(
+        self, source: pathlib.Path, destination: pathlib.Path, how: str = "link"
+    ) -> str:
+        """
+        Make `destination` have the content of `source`.
+
+        Args:
+            how (str): "symlink" for files the stage only reads, "link" for files that are not modified in place, "copy" for files that may be
+
+        Returns:
+            str: The method that was used ("symlink", "hardlink", "reflink" or "copy")
+        """
+        methods = METHODS[how] if self.mode == "link" else []
+        for method in [*methods, "copy"]:
+            try:
+                used = self._place(source, destination, method)
+                break
+            except OSError:
+                if method == "copy":
+                    raise
+        self.counts[used] += 1
+        if used != "copy":
+            self.bytes_saved += source.stat().st_size
+        return used
+
+    def stats(self) -> str:
+        return (
+            f"Staging: {self.counts['hardlink']} hardlinked, {self.counts['reflink']} reflinked, "
+            f"{self.counts['symlink']} symlinked, {self.counts['copy']} copied, "
+            f"{self.bytes_saved / 1024 / 1024:.1f} MiB saved"
+        )
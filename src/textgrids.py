@@ -0,0 +1,146 @@
+import json
+import pathlib
+from typing import Iterable
+
+
+def _value(line: str) -> str:
+    return line.split("=", 1)[1].strip()
+
+
+def _text(line: str) -> str:
+    return _value(line)[1:-1].replace('""', '"')
+
+
+def _number(line: str) -> int | float:
+    # Integers such as the "0" the textgrid package writes for a start of 0 stay integers, so they are written back as they were
+    value = _value(line)
+    return int(value) if value.isdigit() else float(value)
+
+
+def _escape(text: str) -> str:
+    return text.replace('"', '""')
+
+
+def read_textgrid(path: pathlib.Path) -> dict:
+    """
+    Read a long-format TextGrid of interval tiers into plain data that can be stored as JSON.
+
+    Times are parsed at full precision (unlike `textgrid.TextGrid.read`, which
+    rounds them), so `write_textgrid` reproduces the file exactly.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    data = {"xmin": None, "xmax": None, "tiers": []}
+    tier = None
+    interval = None
+    for line in lines:
+        if line.startswith("item [") and line != "item []:":
+            tier = {"name": None, "xmin": None, "xmax": None, "intervals": []}
+            data["tiers"].append(tier)
+            interval = None
+        elif line.startswith("intervals ["):
+            interval = [None, None, None]
+            tier["intervals"].append(interval)
+        elif line.startswith("name ="):
+            tier["name"] = _text(line)
+        elif line.startswith("text ="):
+            interval[2] = _text(line)
+        elif line.startswith("xmin =") or line.startswith("xmax ="):
+            index = 0 if line.startswith("xmin") else 1
+            value = _number(line)
+            if interval is not None:
+                interval[index] = value
+            elif tier is not None:
+                tier["xmin" if index == 0 else "xmax"] = value
+            else:
+                data["xmin" if index == 0 else "xmax"] = value
+    return data
+
+
+def filled_intervals(tier: dict) -> list[tuple]:
+    """
+    The intervals of a tier with the gaps between them filled with empty ones, as `textgrid.IntervalTier` writes them.
+    """
+    previous_end = tier["xmin"]
+    intervals = []
+    for start, end, mark in tier["intervals"]:
+        if previous_end < start:
+            intervals.append((previous_end, start, ""))
+        intervals.append((start, end, mark))
+        previous_end = end
+    if tier["xmax"] is not None and previous_end < tier["xmax"]:
+        intervals.append((previous_end, tier["xmax"], ""))
+    return intervals
+
+
+def format_textgrid(data: dict) -> str:
+    """
+    Serialize data returned by `read_textgrid` exactly as `textgrid.TextGrid.write` would, without building interval objects.
+    """
+    xmax = data["xmax"]
+    if not xmax:
+        xmax = max(
+            tier["xmax"] if tier["xmax"] else tier["intervals"][-1][1]
+            for tier in data["tiers"]
+        )
+    parts = [
+        (
+            'File type = "ooTextFile"\n'
+            'Object class = "TextGrid"\n\n'
+            f"xmin = {data['xmin']}\n"
+            f"xmax = {xmax}\n"
+            "tiers? <exists>\n"
+            f"size = {len(data['tiers'])}\n"
+            "item []:\n"
+        )
+    ]
+    for i, tier in enumerate(data["tiers"], 1):
+        intervals = filled_intervals(tier)
+        parts.append(
+            f"\titem [{i}]:\n"
+            '\t\tclass = "IntervalTier"\n'
+            f'\t\tname = "{tier["name"]}"\n'
+            f"\t\txmin = {tier['xmin']}\n"
+            f"\t\txmax = {xmax}\n"
+            f"\t\tintervals: size = {len(intervals)}\n"
+        )
+        parts.extend(
+            f"\t\t\tintervals [{j}]:\n"
+            f"\t\t\t\txmin = {start}\n"
+            f"\t\t\t\txmax = {end}\n"
+            f'\t\t\t\ttext = "{_escape(mark)}"\n'
+            for j, (start, end, mark) in enumerate(intervals, 1)
+        )
+    return "".join(parts)
+
+
+def write_textgrid(path: pathlib.Path, data: dict):
+    """
+    Write data returned by `read_textgrid` back to a TextGrid file in one buffered write.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(format_textgrid(data).encode("utf-8"))
+
+
+def write_bundle(path: pathlib.Path, textgrids: Iterable[tuple[str, dict]]):
+    """
+    Write many TextGrids into one JSON Lines file, one `{"name": ..., **data}` object per line.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(
+            json.dumps({"name": name, **data}, ensure_ascii=False) + "\n"
+            for name, data in textgrids
+        )
+
+
+def read_bundle(path: pathlib.Path) -> dict[str, dict]:
+    """
+    Read a file written by `write_bundle` into data like `read_textgrid` returns, by name.
+    """
+    textgrids = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            data = json.loads(line)
+            textgrids[data.pop("name")] = data
+    return textgrids
@@ -0,0 +1,155 @@
+import json
+import os
+import pathlib
+import shutil
+
+import click
+
+from cache import hash_file
+from utils import bowlroll_file_download, download_file
+
+MORESAMPLER_FILE_ID = 139123
+# The archive on BOWLROLL is not pinned to a checksum; pass one with
+# --moresampler-sha256 to reject anything else
+MORESAMPLER_SHA256: str | None = None
+# Where older versions unpacked Moresampler; still used when present
+LEGACY_MORESAMPLER_DIR = pathlib.Path("src/Moresampler")
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def is_url(source: str) -> bool:
+    return source.startswith(("http://", "https://"))
+
+
+def fetch_archive(source: str | None, destination: pathlib.Path) -> str:
+    """
+    Stream an archive to `destination`.
+
+    Args:
+        source (str | None): An http(s) URL, or None to download Moresampler from BOWLROLL
+
+    Returns:
+        str: SHA-256 of the archive
+    """
+    if source is None:
+        return bowlroll_file_download(MORESAMPLER_FILE_ID, destination)
+    import requests
+
+    with requests.Session() as session:
+        return download_file(session, source, destination)
+
+
+def unpack_once(archive_path: pathlib.Path, unpack_dir: pathlib.Path):
+    if (unpack_dir / ".complete").exists():
+        return
+    temp_dir = unpack_dir.with_name(f"{unpack_dir.name}.tmp")
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    shutil.unpack_archive(archive_path, temp_dir, format="zip")
+    (temp_dir / ".complete").touch()
+    shutil.rmtree(unpack_dir, ignore_errors=True)
+    os.replace(temp_dir, unpack_dir)
+
+
+def verify_checksum(digest: str, sha256: str | None):
+    if sha256 is not None and digest != sha256:
+        raise ChecksumError(
+            f"Moresampler archive has SHA-256 {digest}, expected {sha256}."
+        )
+
+
+def ensure_moresampler(
+    tools_dir: pathlib.Path, source: str | None = None, sha256: str | None = None
+) -> pathlib.Path:
+    """
+    Return the directory that contains `moresampler.exe`, provisioning it on first use.
+
+    Each archive is unpacked once into `tools_dir/moresampler/<sha256>`.
+    `current.json` records which archive was downloaded from which URL, so
+    later runs neither download nor unpack again; local archives are hashed
+    and used in place. An existing `src/Moresampler` is used as is unless
+    another source or checksum is requested.
+
+    Args:
+        tools_dir (pathlib.Path): Cache directory for provisioned tools
+        source (str | None): A local archive path, an http(s) URL, or None to download from BOWLROLL
+        sha256 (str | None): Expected SHA-256 of the archive
+    """
+    sha256 = (sha256 or MORESAMPLER_SHA256 or "").lower() or None
+    if source is None and sha256 is None and LEGACY_MORESAMPLER_DIR.exists():
+        return LEGACY_MORESAMPLER_DIR
+
+    moresampler_dir = tools_dir / "moresampler"
+    moresampler_dir.mkdir(parents=True, exist_ok=True)
+    if source is not None and not is_url(source):
+        digest = hash_file(pathlib.Path(source))
+        verify_checksum(digest, sha256)
+        unpack_once(pathlib.Path(source), moresampler_dir / digest)
+        return moresampler_dir / digest
+
+    current_path = moresampler_dir / "current.json"
+    current = {}
+    if current_path.exists():
+        with open(current_path, "r", encoding="utf-8") as f:
+            current = json.load(f)
+    known_sha256 = sha256
+    if known_sha256 is None and current.get("source") == source:
+        known_sha256 = current.get("sha256")
+    if (
+        known_sha256 is not None
+        and (moresampler_dir / known_sha256 / ".complete").exists()
+    ):
+        return moresampler_dir / known_sha256
+
+    archive_path = moresampler_dir / "download.zip.tmp"
+    print(f"Downloading Moresampler from {source or 'BOWLROLL'}...")
+    try:
+        digest = fetch_archive(source, archive_path)
+        verify_checksum(digest, sha256)
+        unpack_once(archive_path, moresampler_dir / digest)
+    finally:
+        archive_path.unlink(missing_ok=True)
+
+    temp_path = current_path.with_suffix(".tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"source": source, "sha256": digest}, f)
+    os.replace(temp_path, current_path)
+    return moresampler_dir / digest
+
+
+@click.command()
+@click.option(
+    "--tools-dir",
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    default="src/cache/tools",
+    show_default=True,
+)
+@click.option(
+    "--moresampler-archive",
+    default=None,
+    help="Local archive path or URL to use instead of downloading from BOWLROLL.",
+)
+@click.option(
+    "--moresampler-sha256", default=None, help="Expected SHA-256 of the archive."
+)
+def provision(
+    tools_dir: pathlib.Path,
+    moresampler_archive: str | None,
+    moresampler_sha256: str | None,
+):
+    """
+    Fetch and unpack the external tools ahead of time, e.g. for offline builds.
+    """
+    try:
+        moresampler_dir = ensure_moresampler(
+            tools_dir, moresampler_archive, moresampler_sha256
+        )
+    except ChecksumError as e:
+        raise click.ClickException(str(e))
+    print(f"Moresampler: {moresampler_dir}")
+
+
+if __name__ == "__main__":
+    provision()
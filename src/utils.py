@@ -1,7 +1,9 @@
 import utaupy
 import importlib.util
-import requests
-from bs4 import BeautifulSoup
+import hashlib
+import pathlib
+from collections import defaultdict
+from typing import Iterable
 import re
 
 
@@ -12,7 +14,29 @@ def import_module_from_path(module_path: str, module_name: str):
     return module
 
 
-def bowlroll_file_download(file_id: int):
+def download_file(
+    session, url: str, destination: pathlib.Path, chunk_size: int = 1 << 20
+) -> str:
+    """
+    Stream `url` to `destination` in chunks instead of holding it in memory.
+
+    Returns:
+        str: SHA-256 of the downloaded file
+    """
+    digest = hashlib.sha256()
+    with session.get(url, stream=True) as response:
+        response.raise_for_status()
+        with open(destination, "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bowlroll_file_download(file_id: int, destination: pathlib.Path) -> str:
+    import requests
+    from bs4 import BeautifulSoup
+
     with requests.Session() as session:
         session.headers.update(
             {
@@ -36,9 +60,7 @@ def bowlroll_file_download(file_id: int):
             f"https://bowlroll.net/api/file/{file_id}/download-check", data=data
         )
         response.raise_for_status()
-        response = session.get(response.json()["url"], stream=True)
-        response.raise_for_status()
-        return response.content
+        return download_file(session, response.json()["url"], destination)
 
 
 def remove_specific_consecutive_duplicates(
@@ -60,22 +82,73 @@ def remove_specific_consecutive_duplicates(
     return result
 
 
-def remove_duplicate_otos(otos: list[utaupy.otoini.Oto]):
-    unique_otos: list[utaupy.otoini.Oto] = []
+def group_otos_by_filename(
+    otos: Iterable[utaupy.otoini.Oto],
+) -> dict[str, list[utaupy.otoini.Oto]]:
+    otos_by_filename: defaultdict[str, list[utaupy.otoini.Oto]] = defaultdict(list)
     for oto in otos:
-        for unique_oto in unique_otos:
-            if (
-                oto.filename == unique_oto.filename
-                and oto.offset == unique_oto.offset
-                and oto.consonant == unique_oto.consonant
-                and oto.cutoff == unique_oto.cutoff
-                and oto.preutterance == unique_oto.preutterance
-                and oto.overlap == unique_oto.overlap
-            ):
-                break
-        else:
-            unique_otos.append(oto)
-    return unique_otos
+        otos_by_filename[oto.filename].append(oto)
+    return dict(otos_by_filename)
+
+
+def oto_dedup_key(oto: utaupy.otoini.Oto) -> tuple:
+    return (
+        oto.filename,
+        oto.offset,
+        oto.consonant,
+        oto.cutoff,
+        oto.preutterance,
+        oto.overlap,
+    )
+
+
+def unique_key_indices(keys: list[tuple], tolerance: float = 0) -> list[int]:
+    """
+    重複したキーを取り除き、残すキーの位置を返す関数。最初に出現したものを順序通りに残す。
+
+    Args:
+        keys (list[tuple]): `oto_dedup_key` と同じ形式のキー (ファイル名, タイミング...)
+        tolerance (float): タイミング(ms)の許容誤差。0 の場合は完全一致のみを重複とみなす
+
+    Returns:
+        list[int]: 残すキーの位置
+    """
+    unique_indices: list[int] = []
+    if tolerance <= 0:
+        seen_keys: set[tuple] = set()
+        for index, key in enumerate(keys):
+            if key not in seen_keys:
+                seen_keys.add(key)
+                unique_indices.append(index)
+        return unique_indices
+
+    # Near-duplicates cannot be hashed, so only compare entries of the same file
+    unique_timings_by_filename: defaultdict[str, list[tuple]] = defaultdict(list)
+    for index, (filename, *timings) in enumerate(keys):
+        unique_timings = unique_timings_by_filename[filename]
+        if any(
+            all(abs(a - b) <= tolerance for a, b in zip(timings, other))
+            for other in unique_timings
+        ):
+            continue
+        unique_timings.append(timings)
+        unique_indices.append(index)
+    return unique_indices
+
+
+def remove_duplicate_otos(otos: list[utaupy.otoini.Oto], tolerance: float = 0):
+    """
+    重複したエントリを取り除く関数。最初に出現したものを順序通りに残す。
+
+    Args:
+        otos (list[utaupy.otoini.Oto]): 対象のエントリ
+        tolerance (float): タイミング(ms)の許容誤差。0 の場合は完全一致のみを重複とみなす
+
+    Returns:
+        list[utaupy.otoini.Oto]: 重複を取り除いたエントリ
+    """
+    keys = [oto_dedup_key(oto) for oto in otos]
+    return [otos[index] for index in unique_key_indices(keys, tolerance)]
 
 
 def convert_sharp_flat_in_notes(text: str) -> str:
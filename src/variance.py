@@ -0,0 +1,193 @@
+import json
+import pathlib
+from typing import TYPE_CHECKING, Callable
+
+import numpy as np
+import tqdm
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# The steps below are ports of the scripts in
+# MakeDiffSinger/variance-temp-solution (add_ph_num.py, estimate_midi.py and
+# convert_ds.py csv2ds). The scripts are click commands that read and rewrite
+# transcriptions.csv, so they cannot be called on a DataFrame and their logic
+# is copied here. The repository does not pin a submodule commit, so compare
+# against the checked-out src/MakeDiffSinger when updating it. Divergences:
+# - the transcriptions are passed between the steps as a DataFrame and
+#   transcriptions.csv is written once by the caller;
+# - estimate_midi and csv2ds take `get_pitch` as an argument (the submodule's
+#   get_pitch.get_pitch, wrapped by F0Cache) instead of importing it;
+# - the script options not used by this tool are left out.
+
+SAMPLE_RATE = 44100
+HOP_SIZE = 512
+
+PitchExtractor = Callable[..., tuple[np.ndarray, np.ndarray]]
+
+
+def write_transcriptions(transcriptions: "pd.DataFrame", path: pathlib.Path):
+    """
+    Write transcriptions.csv as the MakeDiffSinger scripts do (csv module defaults, CRLF line endings).
+    """
+    transcriptions.to_csv(path, index=False, encoding="utf-8", lineterminator="\r\n")
+
+
+def load_dictionary(dictionary_path: pathlib.Path) -> tuple[set[str], set[str]]:
+    """
+    Vowels and consonants of a two-phase dictionary (`<syllable>\\t<consonant> <vowel>` per line).
+    """
+    vowels = {"SP", "AP"}
+    consonants = set()
+    with open(dictionary_path, "r", encoding="utf-8") as f:
+        for line in f:
+            _, phonemes = line.split("\t")
+            phonemes = phonemes.split()
+            if len(phonemes) > 2:
+                raise ValueError(
+                    "Only two-phase dictionaries are supported for adding ph_num."
+                )
+            if len(phonemes) == 1:
+                vowels.add(phonemes[0])
+            else:
+                consonants.add(phonemes[0])
+                vowels.add(phonemes[1])
+    return vowels, consonants
+
+
+def add_ph_num(
+    transcriptions: "pd.DataFrame", dictionary_path: pathlib.Path
+) -> "pd.DataFrame":
+    """
+    add_ph_num.py: count the phonemes of every word, a word being a vowel or rest followed by its consonants.
+    """
+    vowels, consonants = load_dictionary(dictionary_path)
+    ph_nums = []
+    for name, ph_seq in zip(transcriptions["name"], transcriptions["ph_seq"]):
+        ph_seq = ph_seq.split()
+        for ph in ph_seq:
+            if ph not in vowels and ph not in consonants:
+                raise ValueError(f"Invalid phoneme symbol '{ph}' in '{name}'.")
+        ph_num = []
+        i = 0
+        while i < len(ph_seq):
+            j = i + 1
+            while j < len(ph_seq) and ph_seq[j] in consonants:
+                j += 1
+            ph_num.append(str(j - i))
+            i = j
+        ph_nums.append(" ".join(ph_num))
+    return transcriptions.assign(ph_num=ph_nums)
+
+
+def word_durations(ph_dur: list[float], ph_num: list[int]) -> list[float]:
+    word_dur = []
+    i = 0
+    for num in ph_num:
+        word_dur.append(sum(ph_dur[i : i + num]))
+        i += num
+    return word_dur
+
+
+def extract_pitch(
+    get_pitch: PitchExtractor, wav_file: pathlib.Path, ph_dur: list[float]
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    f0 and unvoiced flags of a recording, one frame per hop over the summed phoneme durations.
+    """
+    import librosa
+
+    waveform, _ = librosa.load(wav_file, sr=SAMPLE_RATE, mono=True)
+    timestep = HOP_SIZE / SAMPLE_RATE
+    align_length = int(sum(ph_dur) / timestep + 0.5)
+    return get_pitch(
+        waveform,
+        align_length,
+        {"audio_sample_rate": SAMPLE_RATE, "hop_size": HOP_SIZE},
+        interp_uv=True,
+    )
+
+
+def estimate_midi(
+    transcriptions: "pd.DataFrame",
+    wavs_dir: pathlib.Path,
+    get_pitch: PitchExtractor,
+    rest_uv_ratio: float = 0.85,
+) -> "pd.DataFrame":
+    """
+    estimate_midi.py: one note per word at the most common semitone of its voiced frames, or a rest when at least `rest_uv_ratio` of it is unvoiced.
+    """
+    import librosa
+
+    timestep = HOP_SIZE / SAMPLE_RATE
+    note_seqs = []
+    note_durs = []
+    for name, ph_dur, ph_num in tqdm.tqdm(
+        zip(
+            transcriptions["name"],
+            transcriptions["ph_dur"],
+            transcriptions["ph_num"],
+        ),
+        total=len(transcriptions),
+    ):
+        ph_dur = [float(d) for d in ph_dur.split()]
+        ph_num = [int(n) for n in ph_num.split()]
+        if sum(ph_num) != len(ph_dur):
+            raise ValueError(f"ph_num does not sum to number of phones in '{name}'.")
+        word_dur = word_durations(ph_dur, ph_num)
+        f0, uv = extract_pitch(get_pitch, wavs_dir / f"{name}.wav", ph_dur)
+        pitch = librosa.hz_to_midi(f0)
+        word_bound = np.round(np.cumsum(word_dur) / timestep).astype(np.int64)
+        note_seq = []
+        for i in range(len(word_dur)):
+            word_start = word_bound[i - 1] if i > 0 else 0
+            word_end = word_bound[i]
+            word_pitch = pitch[word_start:word_end]
+            word_uv = uv[word_start:word_end]
+            word_valid_pitch = np.extract(~word_uv & (word_pitch >= 0), word_pitch)
+            if len(word_valid_pitch) < (1 - rest_uv_ratio) * (word_end - word_start):
+                note_seq.append("rest")
+            else:
+                counts = np.bincount(np.round(word_valid_pitch).astype(np.int64))
+                midi = counts.argmax()
+                midi = np.mean(
+                    word_valid_pitch[
+                        (word_valid_pitch >= midi - 0.5)
+                        & (word_valid_pitch < midi + 0.5)
+                    ]
+                )
+                note_seq.append(librosa.midi_to_note(midi, cents=True, unicode=False))
+        note_seqs.append(" ".join(note_seq))
+        note_durs.append(" ".join(str(round(d, 6)) for d in word_dur))
+    return transcriptions.assign(note_seq=note_seqs, note_dur=note_durs)
+
+
+def write_ds_files(
+    transcriptions: "pd.DataFrame",
+    wavs_dir: pathlib.Path,
+    ds_dir: pathlib.Path,
+    get_pitch: PitchExtractor,
+):
+    """
+    convert_ds.py csv2ds: write a DiffSinger project (.ds) with the f0 curve for every transcription.
+    """
+    timestep = HOP_SIZE / SAMPLE_RATE
+    for item in tqdm.tqdm(transcriptions.to_dict("records")):
+        ph_dur = [float(d) for d in item["ph_dur"].split()]
+        f0, _ = extract_pitch(get_pitch, wavs_dir / f"{item['name']}.wav", ph_dur)
+        ds = [
+            {
+                "offset": 0.0,
+                "text": item["ph_seq"],
+                "ph_seq": item["ph_seq"],
+                "ph_dur": " ".join(str(round(d, 6)) for d in ph_dur),
+                "ph_num": item["ph_num"],
+                "note_seq": item["note_seq"],
+                "note_dur": item["note_dur"],
+                "note_slur": " ".join(["0"] * len(item["note_seq"].split())),
+                "f0_seq": " ".join(str(round(float(freq), 1)) for freq in f0),
+                "f0_timestep": str(timestep),
+            }
+        ]
+        with open(ds_dir / f"{item['name']}.ds", "w", encoding="utf-8") as f:
+            json.dump(ds, f, ensure_ascii=False, indent=4)